@@ -1,12 +1,42 @@
 # accounting_routes/accounts.py
 from __future__ import annotations
-from flask import Blueprint, render_template, request, redirect, url_for, send_file, flash
-from io import StringIO, BytesIO
-import csv, math, datetime as dt
+from flask import Blueprint, render_template, request, redirect, url_for, flash, Response, stream_with_context
+from io import StringIO, TextIOWrapper
+import csv, math, os, datetime as dt
 
+from pymongo import UpdateOne
 from db import db
+from accounting_routes.common import cached_count, drop_counts, prefix_rx
 accounts_col = db["accounts"]
 
+# When set, list pages render Previous/Next only and never count the collection.
+SKIP_TOTAL_COUNT = os.getenv("SKIP_TOTAL_COUNT", "").lower() in ("1", "true", "yes")
+
+_IMPORT_BATCH = 1000  # upserts per bulk_write round trip
+
+# CSV boolean tokens, compared after .strip().casefold()
+_TRUTHY = frozenset({"1", "true", "yes", "y", "on", "t"})
+_FALSY = frozenset({"0", "false", "no", "n", "off", "f"})
+
+def _ensure_indexes() -> None:
+    try:
+        # Backs ?q= search on the accounts list
+        accounts_col.create_index([("name", "text"), ("code", "text")], name="accounts_text")
+        accounts_col.create_index([("type", 1), ("active", 1), ("code", 1)])
+    except Exception:
+        pass
+    try:
+        # Separate so pre-existing duplicate codes don't block the indexes above
+        accounts_col.create_index([("code", 1)], unique=True)
+    except Exception:
+        # ?q= puts $text inside $or, which needs the code branch indexed either way
+        try:
+            accounts_col.create_index([("code", 1)])
+        except Exception:
+            pass
+
+_ensure_indexes()
+
 # Template folder points one level up (since folder is beside app.py)
 accounting_bp = Blueprint("accounting", __name__, template_folder="../templates")
 
@@ -14,22 +44,23 @@ accounting_bp = Blueprint("accounting", __name__, template_folder="../templates"
 def _q(s: str | None) -> str:
     return (s or "").strip()
 
-def _paginate(collection, query: dict, page: int, per: int):
-    """Pagination using public PyMongo API (count_documents)."""
-    total = collection.count_documents(query)
+def _page_url(args: dict, p: int) -> str:
+    """URL for page p; args is the request's query dict, snapshotted once by the caller."""
+    a = dict(args)
+    a["page"] = str(p)
+    return url_for("accounting.accounts", **a)
+
+def _paginate(collection, query: dict, page: int, per: int, args: dict):
+    """Pagination using public PyMongo API (estimated / cached counts)."""
+    total = cached_count(collection, query)
     pages = max(1, math.ceil(total / per))
     page = max(1, min(page, pages))  # clamp
 
-    def _u(p):
-        args = request.args.to_dict()
-        args["page"] = str(p)
-        return url_for("accounting.accounts", **args)
-
     return {
         "page": page,
         "pages": pages,
-        "prev_url": _u(page - 1) if page > 1 else None,
-        "next_url": _u(page + 1) if page < pages else None,
+        "prev_url": _page_url(args, page - 1) if page > 1 else None,
+        "next_url": _page_url(args, page + 1) if page < pages else None,
         "total": total,
     }
 
@@ -51,14 +82,15 @@ def accounts():
     q = _q(request.args.get("q"))
     typ = _q(request.args.get("type"))
     status = _q(request.args.get("status"))
-    page = int(request.args.get("page", 1))
+    page = max(1, int(request.args.get("page", 1)))
     per = min(50, int(request.args.get("per", 20)))
 
     query: dict = {}
     if q:
+        # Name words via accounts_text, or an account-code prefix via the code index
         query["$or"] = [
-            {"name": {"$regex": q, "$options": "i"}},
-            {"code": {"$regex": q, "$options": "i"}},
+            {"$text": {"$search": q}},
+            {"code": {"$in": prefix_rx(q)}},
         ]
     if typ:
         query["type"] = typ
@@ -66,16 +98,36 @@ def accounts():
         query["active"] = (status == "active")
 
     base_cur = "GHS"
+    args = request.args.to_dict(flat=True)
 
-    pager = _paginate(accounts_col, query, page, per)
-    page = pager["page"]  # use clamped page
+    if SKIP_TOTAL_COUNT:
+        # Fetch one extra row to learn whether a next page exists; no count.
+        docs = list(
+            accounts_col.find(query)
+            .sort("code", 1)
+            .skip((page - 1) * per)
+            .limit(per + 1)
+        )
+        has_next = len(docs) > per
+        docs = docs[:per]
+        pager = {
+            "page": page,
+            "prev_url": _page_url(args, page - 1) if page > 1 else None,
+            "next_url": _page_url(args, page + 1) if has_next else None,
+        }
+    else:
+        pager = _paginate(accounts_col, query, page, per, args)
+        page = pager["page"]  # use clamped page
 
-    cur = (
-        accounts_col.find(query)
-        .sort("code", 1)
-        .skip((page - 1) * per)
-        .limit(per)
-    )
+        if not pager["total"]:
+            docs = []  # nothing matched; skip the find round trip
+        else:
+            docs = (
+                accounts_col.find(query)
+                .sort("code", 1)
+                .skip((page - 1) * per)
+                .limit(per)
+            )
     accounts = [
         {
             "code": a.get("code"),
@@ -85,7 +137,7 @@ def accounts():
             "allow_post": bool(a.get("allow_post", True)),
             "active": bool(a.get("active", True)),
         }
-        for a in cur
+        for a in docs
     ]
 
     return render_template(
@@ -99,12 +151,14 @@ def accounts():
 @accounting_bp.post("/accounts")
 def accounts_create():
     """Create account from modal form POST."""
-    code = _q(request.form.get("code"))
-    name = _q(request.form.get("name"))
-    acc_type = _q(request.form.get("type")).lower()
-    currency = _q(request.form.get("currency")) or "GHS"
-    allow_post = request.form.get("allow_post") == "on"
-    active = request.form.get("active") != "off"  # default True
+    form = request.form
+    v = {k: _q(form.get(k)) for k in ("code", "name", "type", "currency", "allow_post", "active")}
+    code = v["code"]
+    name = v["name"]
+    acc_type = v["type"].lower()
+    currency = v["currency"] or "GHS"
+    allow_post = v["allow_post"] == "on"
+    active = v["active"] != "off"  # default True
 
     if not code or not name or acc_type not in {"asset","liability","equity","income","expense"}:
         flash("Code, Name and a valid Type are required.", "warning")
@@ -114,6 +168,7 @@ def accounts_create():
         flash("Account code already exists.", "warning")
         return redirect(url_for("accounting.accounts"))
 
+    now = dt.datetime.utcnow()
     doc = {
         "code": code,
         "name": name,
@@ -121,10 +176,11 @@ def accounts_create():
         "currency": currency,
         "allow_post": allow_post,
         "active": active,
-        "created_at": dt.datetime.utcnow(),
-        "updated_at": dt.datetime.utcnow(),
+        "created_at": now,
+        "updated_at": now,
     }
     accounts_col.insert_one(doc)
+    drop_counts(accounts_col)
     flash("Account created.", "success")
     return redirect(url_for("accounting.accounts"))
 
@@ -152,35 +208,46 @@ def accounts_toggle(code):
             }
         },
     )
+    drop_counts(accounts_col)
     flash("Status updated.", "success")
     return redirect(url_for("accounting.accounts", **request.args))
 
 @accounting_bp.get("/accounts/export")
 def accounts_export():
-    """Export all accounts as CSV."""
-    out = StringIO()
-    w = csv.writer(out)
-    w.writerow(["code", "name", "type", "currency", "allow_post", "active"])
-
-    for a in accounts_col.find({}).sort("code", 1):
-        w.writerow(
-            [
-                a.get("code"),
-                a.get("name"),
-                a.get("type"),
-                a.get("currency", "GHS"),
-                int(bool(a.get("allow_post", True))),
-                int(bool(a.get("active", True))),
-            ]
+    """Export all accounts as CSV (streamed row by row)."""
+    def gen():
+        out = StringIO()
+        w = csv.writer(out)
+        w.writerow(["code", "name", "type", "currency", "allow_post", "active"])
+        yield out.getvalue()
+
+        cur = (
+            accounts_col.find(
+                {},
+                {"_id": 0, "code": 1, "name": 1, "type": 1, "currency": 1, "allow_post": 1, "active": 1},
+            )
+            .sort("code", 1)
+            .batch_size(1000)
         )
+        for a in cur:
+            out.seek(0)
+            out.truncate()
+            w.writerow(
+                [
+                    a.get("code"),
+                    a.get("name"),
+                    a.get("type"),
+                    a.get("currency", "GHS"),
+                    int(bool(a.get("allow_post", True))),
+                    int(bool(a.get("active", True))),
+                ]
+            )
+            yield out.getvalue()
 
-    mem = BytesIO(out.getvalue().encode("utf-8"))
-    mem.seek(0)
-    return send_file(
-        mem,
+    return Response(
+        stream_with_context(gen()),
         mimetype="text/csv",
-        as_attachment=True,
-        download_name="chart_of_accounts.csv",
+        headers={"Content-Disposition": 'attachment; filename="chart_of_accounts.csv"'},
     )
 
 @accounting_bp.post("/accounts/import")
@@ -192,7 +259,10 @@ def accounts_import():
         return redirect(url_for("accounting.accounts"))
 
     try:
-        rdr = csv.DictReader((b.decode("utf-8") for b in f.stream), skipinitialspace=True)
+        text = TextIOWrapper(f.stream, encoding="utf-8", newline="")
+        rdr = csv.DictReader(text, skipinitialspace=True)
+        now = dt.datetime.utcnow()  # one timestamp for the whole import
+        ops: list = []
         for r in rdr:
             code = _q(r.get("code"))
             if not code:
@@ -203,17 +273,24 @@ def accounts_import():
                 "name": _q(r.get("name")),
                 "type": _q(r.get("type")).lower(),
                 "currency": _q(r.get("currency")) or "GHS",
-                "allow_post": r.get("allow_post") in ("1", "true", "True", "yes", "Yes"),
-                "active": r.get("active") not in ("0", "false", "False", "no", "No"),
-                "updated_at": dt.datetime.utcnow(),
+                "allow_post": _q(r.get("allow_post")).casefold() in _TRUTHY,
+                "active": _q(r.get("active")).casefold() not in _FALSY,
+                "updated_at": now,
             }
 
-            if accounts_col.find_one({"code": code}):
-                accounts_col.update_one({"code": code}, {"$set": payload})
-            else:
-                payload["created_at"] = dt.datetime.utcnow()
-                accounts_col.insert_one(payload)
+            ops.append(UpdateOne(
+                {"code": code},
+                {"$set": payload, "$setOnInsert": {"created_at": now}},
+                upsert=True,
+            ))
+            if len(ops) >= _IMPORT_BATCH:
+                accounts_col.bulk_write(ops, ordered=False)
+                ops.clear()
+
+        if ops:
+            accounts_col.bulk_write(ops, ordered=False)
 
+        drop_counts(accounts_col)
         flash("Import complete.", "success")
     except Exception as e:
         flash(f"Import failed: {e}", "danger")
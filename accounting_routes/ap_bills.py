@@ -1,18 +1,64 @@
 # accounting_routes/ap_bills.py
 from __future__ import annotations
 
-from flask import Blueprint, render_template, request, url_for, Response, jsonify
+from flask import Blueprint, render_template, request, url_for, Response, jsonify, stream_with_context
 from datetime import datetime
-import io, csv, math, re
+import io, csv, math
 from typing import Any, Dict, List
+from urllib.parse import urlencode
 
 from db import db
+from accounting_routes.common import after_token, keyset_after, parse_after, prefix_rx
 
 ap_bills_bp = Blueprint("ap_bills", __name__, template_folder="../templates")
 
 # Mongo collection for AP bills
 bills_col = db["ap_bills"]
 
+# Fallback display symbol when a bill doesn't store one
+_SYMBOLS = {"GHS": "GH₵", "GH₵": "GH₵", "USD": "$"}
+
+_EXPORT_BATCH = 1000  # rows per cursor batch / streamed CSV chunk
+
+# Fields read by the listing template / CSV export
+_BILL_PROJECTION = {
+    "no": 1,
+    "bill_no": 1,
+    "vendor": 1,
+    "vendor_name": 1,
+    "bill_date": 1,
+    "due_date": 1,
+    "currency": 1,
+    "symbol": 1,
+    "currency_symbol": 1,
+    "amount": 1,
+    "paid": 1,
+    "balance": 1,
+    "status": 1,
+    "bill_date_dt": 1,
+}
+
+
+def _ensure_indexes() -> None:
+    try:
+        # Matches the listing sort so keyset pages are a single index seek
+        bills_col.create_index([("bill_date_dt", -1), ("_id", -1)])
+        # Equality filter first, then the listing sort (ESR)
+        bills_col.create_index([("status", 1), ("bill_date_dt", -1), ("_id", -1)])
+        bills_col.create_index([("vendor", 1), ("bill_date_dt", -1)])
+        bills_col.create_index([("no", 1)])
+        # Backs ?q= search; a collection can only carry one text index
+        bills_col.create_index(
+            [("no", "text"), ("bill_no", "text"), ("vendor", "text"),
+             ("vendor_name", "text"), ("reference", "text")],
+            name="bills_text",
+        )
+    except Exception:
+        pass
+
+
+_ensure_indexes()
+
 
 def _iso(d: str | None):
     """Parse YYYY-MM-DD into datetime or return None."""
@@ -31,11 +77,14 @@ def _safe_float(v: Any) -> float:
         return 0.0
 
 
-def _paginate_url(page: int, per: int) -> str:
-    args = request.args.to_dict()
+def _paginate_url(base: str, args: Dict[str, str], page: int, per: int, after: str | None = None) -> str:
+    """Listing URL built from a per-request base path + args snapshot (no url_for per link)."""
     args["page"] = str(page)
     args["per"] = str(per)
-    return url_for("ap_bills.bills", **args)
+    args.pop("after", None)
+    if after:
+        args["after"] = after
+    return f"{base}?{urlencode(args)}"
 
 
 @ap_bills_bp.get("/ap/bills")
@@ -56,6 +105,7 @@ def bills():
     page   = max(1, int(request.args.get("page", 1)))
     per    = min(100, max(25, int(request.args.get("per", 25))))
     export = request.args.get("export") == "1"
+    after  = parse_after(request.args.get("after"))
 
     # ------------------------
     # Build Mongo query
@@ -63,13 +113,10 @@ def bills():
     q: Dict[str, Any] = {}
 
     if qtxt:
-        rx = re.compile(re.escape(qtxt), re.IGNORECASE)
+        # Word search (bills_text index) or a bill-number prefix (no_1 index)
         q["$or"] = [
-            {"no": rx},
-            {"bill_no": rx},
-            {"vendor": rx},
-            {"vendor_name": rx},
-            {"reference": rx},
+            {"$text": {"$search": qtxt}},
+            {"no": {"$in": prefix_rx(qtxt)}},
         ]
 
     if status:
@@ -83,90 +130,113 @@ def bills():
         if dto:
             q["bill_date_dt"]["$lte"] = datetime(dto.year, dto.month, dto.day, 23, 59, 59, 999999)
 
-    cur = bills_col.find(q).sort([("bill_date_dt", -1), ("_id", -1)])
-    docs = list(cur)
+    sort = [("bill_date_dt", -1), ("_id", -1)]
 
     # ------------------------
-    # CSV export
+    # CSV export (streamed one row at a time from the cursor)
     # ------------------------
-    if export and docs:
-        out = io.StringIO()
-        w   = csv.writer(out)
-        w.writerow([
-            "Bill No",
-            "Vendor",
-            "Bill Date",
-            "Due Date",
-            "Currency",
-            "Amount",
-            "Paid",
-            "Balance",
-            "Status",
-        ])
-        for d in docs:
-            amt  = _safe_float(d.get("amount"))
-            paid = _safe_float(d.get("paid"))
-            bal  = _safe_float(d.get("balance", amt - paid))
-
+    if export:
+        def gen():
+            out = io.StringIO()
+            w   = csv.writer(out)
             w.writerow([
-                d.get("no") or d.get("bill_no", ""),
-                d.get("vendor_name") or d.get("vendor", ""),
-                d.get("bill_date", ""),
-                d.get("due_date", ""),
-                d.get("currency", "GHS"),
-                f"{amt:0.2f}",
-                f"{paid:0.2f}",
-                f"{bal:0.2f}",
-                (d.get("status") or "draft").title(),
+                "Bill No",
+                "Vendor",
+                "Bill Date",
+                "Due Date",
+                "Currency",
+                "Amount",
+                "Paid",
+                "Balance",
+                "Status",
             ])
+            yield out.getvalue()
+
+            # Rows are formatted per cursor batch and handed to the C writer
+            # in one writerows() call, so each yielded chunk is a full batch.
+            sf = _safe_float
+            batch: List[list] = []
+            cur = bills_col.find(q, _BILL_PROJECTION).sort(sort).batch_size(_EXPORT_BATCH)
+            for d in cur:
+                amt  = sf(d.get("amount"))
+                paid = sf(d.get("paid"))
+                bal  = sf(d.get("balance", amt - paid))
+                batch.append([
+                    d.get("no") or d.get("bill_no", ""),
+                    d.get("vendor_name") or d.get("vendor", ""),
+                    d.get("bill_date", ""),
+                    d.get("due_date", ""),
+                    d.get("currency", "GHS"),
+                    f"{amt:0.2f}",
+                    f"{paid:0.2f}",
+                    f"{bal:0.2f}",
+                    (d.get("status") or "draft").title(),
+                ])
+                if len(batch) >= _EXPORT_BATCH:
+                    out.seek(0)
+                    out.truncate()
+                    w.writerows(batch)
+                    batch.clear()
+                    yield out.getvalue()
+
+            if batch:
+                out.seek(0)
+                out.truncate()
+                w.writerows(batch)
+                yield out.getvalue()
 
         return Response(
-            out.getvalue(),
+            stream_with_context(gen()),
             mimetype="text/csv",
             headers={"Content-Disposition": 'attachment; filename=\"ap_bills.csv\"'},
         )
 
     # ------------------------
-    # Pagination
+    # Pagination (only the requested page is fetched)
     # ------------------------
-    total = len(docs)
+    total = bills_col.count_documents(q)
     pages = max(1, math.ceil(total / per))
     page  = max(1, min(page, pages))
     start = (page - 1) * per
-    end   = start + per
 
+    if not total:
+        docs = []  # nothing matched; skip the page query entirely
+    elif after:
+        # Keyset: seek past the last row of the previous page instead of skip()
+        page_q = {"$and": [q, keyset_after("bill_date_dt", after)]}
+        docs = list(bills_col.find(page_q, _BILL_PROJECTION).sort(sort).limit(per))
+    else:
+        # Arbitrary page jump (or first page) falls back to skip()
+        docs = list(bills_col.find(q, _BILL_PROJECTION).sort(sort).skip(start).limit(per))
+
+    base = url_for("ap_bills.bills")
+    args = request.args.to_dict(flat=True)
+
+    export_args = dict(args)
+    export_args.pop("after", None)
+    export_args["export"] = "1"
+    export_url = f"{base}?{urlencode(export_args)}"
+
+    next_after = after_token(docs[-1], "bill_date_dt") if docs else None
     pager = {
         "total": total,
         "page": page,
         "pages": pages,
-        "prev_url": _paginate_url(page - 1, per) if page > 1 else None,
-        "next_url": _paginate_url(page + 1, per) if page < pages else None,
+        "prev_url": _paginate_url(base, args, page - 1, per) if page > 1 else None,
+        "next_url": _paginate_url(base, args, page + 1, per, next_after) if page < pages else None,
     }
 
-    export_args = request.args.to_dict(flat=True)
-    export_args["export"] = "1"
-    export_url = url_for("ap_bills.bills", **export_args)
-
     # ------------------------
     # Map docs -> rows for template
     # ------------------------
     rows: List[Dict[str, Any]] = []
-    for d in docs[start:end]:
+    for d in docs:
         amt  = _safe_float(d.get("amount"))
         paid = _safe_float(d.get("paid"))
         bal  = _safe_float(d.get("balance", amt - paid))
 
         currency = d.get("currency", "GHS")
-        if "symbol" in d:
-            currency_symbol = d.get("symbol") or d.get("currency_symbol", "")
-        else:
-            # very light defaulting
-            if currency in ("GHS", "GH₵"):
-                currency_symbol = "GH₵"
-            elif currency == "USD":
-                currency_symbol = "$"
-            else:
-                currency_symbol = ""
+        currency_symbol = d.get("symbol") or d.get("currency_symbol") or _SYMBOLS.get(currency, "")
 
         rows.append({
             "no": d.get("no") or d.get("bill_no", ""),
@@ -201,26 +271,31 @@ def quick_create():
 
     Inserts a basic bill document into ap_bills and returns JSON.
     """
-    def _q(x: str | None) -> str:
-        return (x or "").strip()
-
-    def _f(x) -> float:
+    def _f(x: str) -> float:
         try:
-            return float(str(x).replace(",", ""))
+            return float(x.replace(",", ""))
         except Exception:
             return 0.0
 
-    bill_no     = _q(request.form.get("bill_no"))
-    reference   = _q(request.form.get("reference"))
-    vendor_name = _q(request.form.get("vendor_name"))
-    vendor_code = _q(request.form.get("vendor"))
-    bill_date_s = _q(request.form.get("bill_date"))
-    due_date_s  = _q(request.form.get("due_date"))
-    currency    = _q(request.form.get("currency") or "GHS")
-    status      = (_q(request.form.get("status")) or "draft").lower()
-    amount      = _f(request.form.get("amount"))
-    paid        = _f(request.form.get("paid"))
-    notes       = _q(request.form.get("notes"))
+    # Snapshot the form once; every field is read exactly one time
+    form = request.form
+    v = {
+        k: (form.get(k) or "").strip()
+        for k in ("bill_no", "reference", "vendor_name", "vendor", "bill_date",
+                  "due_date", "currency", "status", "amount", "paid", "notes")
+    }
+
+    bill_no     = v["bill_no"]
+    reference   = v["reference"]
+    vendor_name = v["vendor_name"]
+    vendor_code = v["vendor"]
+    bill_date_s = v["bill_date"]
+    due_date_s  = v["due_date"]
+    currency    = v["currency"] or "GHS"
+    status      = (v["status"] or "draft").lower()
+    amount      = _f(v["amount"])
+    paid        = _f(v["paid"])
+    notes       = v["notes"]
 
     if not vendor_name or not bill_date_s or not due_date_s or amount <= 0:
         return jsonify(ok=False, message="Vendor, Bill Date, Due Date and Amount are required."), 400
@@ -1,7 +1,7 @@
 # accounting_routes/ar_aging.py
 from __future__ import annotations
 
-from flask import Blueprint, render_template, request, Response, url_for
+from flask import Blueprint, render_template, request, Response, url_for, stream_with_context
 from datetime import datetime, date
 from typing import Dict, Any, List
 import io, csv
@@ -27,28 +27,130 @@ def _parse_as_of(val: str | None) -> date:
         return datetime.utcnow().date()
 
 
-def _to_date(v: Any) -> date | None:
-    """
-    Try to coerce stored due date into a date object.
-    Supports datetime, date, and ISO-like strings.
+def _ensure_indexes() -> None:
+    try:
+        ar_invoices_col.create_index([("customer", 1), ("due_date_dt", 1)])
+        rec_col.create_index([("customer", 1), ("date_dt", 1)])
+    except Exception:
+        pass
+
+
+_ensure_indexes()
+
+
+def _aging_pipeline(as_of: date, customer_filter: str) -> List[Dict[str, Any]]:
     """
-    if isinstance(v, datetime):
-        return v.date()
-    if isinstance(v, date):
-        return v
-    if isinstance(v, str):
-        try:
-            return datetime.fromisoformat(v).date()
-        except Exception:
-            return None
-    return None
+    Aggregation that ages outstanding invoices per customer on the server.
 
+    FIFO allocation is expressed with a running total: once invoices are sorted
+    by due date, an invoice's outstanding part is
+    min(amount, max(0, cumulative_invoiced - paid_to_date)).
+    """
+    as_of_dt  = datetime(as_of.year, as_of.month, as_of.day)
+    as_of_end = datetime(as_of.year, as_of.month, as_of.day, 23, 59, 59, 999999)
 
-def _safe_float(v: Any) -> float:
-    try:
-        return float(v or 0)
-    except Exception:
-        return 0.0
+    inv_match: Dict[str, Any] = {}
+    rec_match: Dict[str, Any] = {"$expr": {"$eq": ["$customer", "$$code"]}, "date_dt": {"$lte": as_of_end}}
+    if customer_filter:
+        inv_match["customer"] = customer_filter
+        rec_match["customer"] = customer_filter
+
+    code_expr = {"$trim": {"input": {"$toString": {"$ifNull": ["$customer", ""]}}}}
+    name_expr = {"$trim": {"input": {"$toString": {"$ifNull": ["$customer_name", ""]}}}}
+
+    return [
+        {"$match": inv_match},
+        {"$project": {
+            "code":   {"$let": {"vars": {"c": code_expr},
+                                "in": {"$cond": [{"$eq": ["$$c", ""]}, "UNKNOWN", "$$c"]}}},
+            "name":   name_expr,
+            "amount": {"$convert": {"input": "$amount", "to": "double", "onError": 0.0, "onNull": 0.0}},
+            # due_date_dt is a BSON date written by ar_invoices; if missing, due as-of
+            "due":    {"$ifNull": ["$due_date_dt", as_of_dt]},
+        }},
+        {"$match": {"amount": {"$gt": 0}}},
+        {"$setWindowFields": {
+            "partitionBy": "$code",
+            "sortBy": {"due": 1, "_id": 1},
+            "output": {"cum": {"$sum": "$amount", "window": {"documents": ["unbounded", "current"]}}},
+        }},
+        {"$group": {
+            "_id":  "$code",
+            "name": {"$first": "$name"},
+            "invs": {"$push": {"amount": "$amount", "due": "$due", "cum": "$cum"}},
+        }},
+        # receipts up to as-of; allocated if present, else the full amount
+        {"$lookup": {
+            "from": rec_col.name,
+            "let": {"code": "$_id"},
+            "pipeline": [
+                {"$match": rec_match},
+                {"$project": {"v": {"$convert": {"input": {"$ifNull": ["$allocated", "$amount"]},
+                                                 "to": "double", "onError": 0.0, "onNull": 0.0}}}},
+                {"$match": {"v": {"$gt": 0}}},
+                {"$group": {"_id": None, "paid": {"$sum": "$v"}}},
+            ],
+            "as": "rec",
+        }},
+        {"$addFields": {"paid": {"$ifNull": [{"$first": "$rec.paid"}, 0.0]}}},
+        {"$unwind": "$invs"},
+        {"$project": {
+            "name": 1,
+            "outstanding": {"$min": ["$invs.amount", {"$max": [0, {"$subtract": ["$invs.cum", "$paid"]}]}]},
+            "age": {"$dateDiff": {"startDate": "$invs.due", "endDate": as_of_dt, "unit": "day"}},
+        }},
+        {"$match": {"outstanding": {"$gt": 0}}},
+        {"$addFields": {"bucket": {"$switch": {
+            "branches": [
+                {"case": {"$lte": ["$age", 30]}, "then": "b0_30"},   # not yet due counts as 0–30
+                {"case": {"$lte": ["$age", 60]}, "then": "b31_60"},
+                {"case": {"$lte": ["$age", 90]}, "then": "b61_90"},
+            ],
+            "default": "b90_plus",
+        }}}},
+        {"$group": {
+            "_id":      "$_id",
+            "name":     {"$first": "$name"},
+            "b0_30":    {"$sum": {"$cond": [{"$eq": ["$bucket", "b0_30"]}, "$outstanding", 0]}},
+            "b31_60":   {"$sum": {"$cond": [{"$eq": ["$bucket", "b31_60"]}, "$outstanding", 0]}},
+            "b61_90":   {"$sum": {"$cond": [{"$eq": ["$bucket", "b61_90"]}, "$outstanding", 0]}},
+            "b90_plus": {"$sum": {"$cond": [{"$eq": ["$bucket", "b90_plus"]}, "$outstanding", 0]}},
+            "total":    {"$sum": "$outstanding"},
+        }},
+        {"$facet": {
+            "rows": [
+                {"$sort": {"total": -1}},
+                # amounts leave the server already rounded to cents
+                {"$project": {
+                    "_id": 0,
+                    "customer_code": "$_id",
+                    "customer_name": {"$cond": [{"$eq": ["$name", ""]}, "$_id", "$name"]},
+                    "b0_30":    {"$round": ["$b0_30", 2]},
+                    "b31_60":   {"$round": ["$b31_60", 2]},
+                    "b61_90":   {"$round": ["$b61_90", 2]},
+                    "b90_plus": {"$round": ["$b90_plus", 2]},
+                    "total":    {"$round": ["$total", 2]},
+                }},
+            ],
+            "totals": [
+                {"$group": {
+                    "_id":      None,
+                    "b0_30":    {"$sum": "$b0_30"},
+                    "b31_60":   {"$sum": "$b31_60"},
+                    "b61_90":   {"$sum": "$b61_90"},
+                    "b90_plus": {"$sum": "$b90_plus"},
+                }},
+                {"$project": {
+                    "_id":      0,
+                    "b0_30":    {"$round": ["$b0_30", 2]},
+                    "b31_60":   {"$round": ["$b31_60", 2]},
+                    "b61_90":   {"$round": ["$b61_90", 2]},
+                    "b90_plus": {"$round": ["$b90_plus", 2]},
+                    "total":    {"$round": [{"$add": ["$b0_30", "$b31_60", "$b61_90", "$b90_plus"]}, 2]},
+                }},
+            ],
+        }},
+    ]
 
 
 @ar_aging_bp.get("/ar/aging")
@@ -56,9 +158,9 @@ def aging_report():
     """
     Accounts Receivable Aging report.
 
-    Logic:
-    - Pull all invoices (ar_invoices) for a customer (optional).
-    - Pull all receipts (ar_receipts) up to the As-Of date.
+    Logic (single aggregation, see _aging_pipeline):
+    - Invoices (ar_invoices), optionally for one customer.
+    - Receipts (ar_receipts) up to the As-Of date, summed per customer.
     - Per customer, allocate receipts FIFO against invoices by due date.
     - Any remaining outstanding amount on each invoice is aged by due days.
     """
@@ -69,146 +171,32 @@ def aging_report():
     customer_filter = (request.args.get("customer") or "").strip()
 
     # --------------------------
-    # 1) LOAD INVOICES PER CUSTOMER
-    # --------------------------
-    inv_q: Dict[str, Any] = {}
-    if customer_filter:
-        inv_q["customer"] = customer_filter
-
-    inv_cur = ar_invoices_col.find(inv_q)
-
-    invoices_by_cust: Dict[str, Dict[str, Any]] = {}
-
-    for inv in inv_cur:
-        code = (inv.get("customer") or "").strip() or "UNKNOWN"
-        name = (inv.get("customer_name") or code).strip() or code
-
-        amount = _safe_float(inv.get("amount"))
-        if amount <= 0:
-            # nothing billed => skip
-            continue
-
-        # Due date (for aging)
-        raw_due  = inv.get("due") or inv.get("due_date")
-        due_date = _to_date(raw_due)
-        if not due_date:
-            # if no due date, treat as due as-of
-            due_date = as_of
-
-        cust_block = invoices_by_cust.setdefault(code, {
-            "name":     name,
-            "invoices": [],
-        })
-        cust_block["invoices"].append({
-            "amount":   amount,
-            "due_date": due_date,
-        })
-
-    # --------------------------
-    # 2) LOAD PAYMENTS PER CUSTOMER (UP TO AS-OF)
+    # 1) AGE BALANCES ON THE SERVER (INVOICES - RECEIPTS FIFO)
     # --------------------------
-    rec_q: Dict[str, Any] = {
-        "date_dt": {
-            "$lte": datetime(as_of.year, as_of.month, as_of.day, 23, 59, 59, 999999)
-        }
-    }
-    if customer_filter:
-        rec_q["customer"] = customer_filter
-
-    rec_cur = rec_col.find(rec_q)
-
-    payments_by_cust: Dict[str, float] = {}
-
-    for r in rec_cur:
-        cust = (r.get("customer") or "").strip()
-        if not cust:
-            continue
-
-        # Use allocated if present, else fall back to full amount
-        paid_val = _safe_float(r.get("allocated", r.get("amount")))
-        if paid_val <= 0:
-            continue
-
-        payments_by_cust[cust] = payments_by_cust.get(cust, 0.0) + paid_val
+    result = next(ar_invoices_col.aggregate(_aging_pipeline(as_of, customer_filter)), {})
 
     # --------------------------
-    # 3) BUILD AGED BALANCES PER CUSTOMER (INVOICE - PAYMENTS FIFO)
+    # 2) BUILD ROWS & STATS
     # --------------------------
-    per_customer: Dict[str, Dict[str, Any]] = {}
-
-    for code, data in invoices_by_cust.items():
-        name = data["name"]
-        invs = data["invoices"]
-        if not invs:
-            continue
-
-        # Sort invoices oldest first for FIFO allocation
-        invs.sort(key=lambda x: x["due_date"])
-
-        remaining_pay = payments_by_cust.get(code, 0.0)
-
-        for inv in invs:
-            amt = inv["amount"]
+    rows: List[Dict[str, Any]] = result.get("rows") or []
+    totals: Dict[str, Any] = (result.get("totals") or [{}])[0]
 
-            # Apply payments FIFO
-            applied       = min(remaining_pay, amt)
-            remaining_pay -= applied
-            outstanding   = amt - applied
-
-            if outstanding <= 0:
-                # Fully paid by receipts up to as_of => skip
-                continue
-
-            due_date = inv["due_date"]
-            age_days = (as_of - due_date).days
-            if age_days < 0:
-                age_days = 0  # not yet due, treat as 0–30
-
-            # Decide bucket
-            if age_days <= 30:
-                bucket_key = "b0_30"
-            elif age_days <= 60:
-                bucket_key = "b31_60"
-            elif age_days <= 90:
-                bucket_key = "b61_90"
-            else:
-                bucket_key = "b90_plus"
-
-            if code not in per_customer:
-                per_customer[code] = {
-                    "customer_code": code,
-                    "customer_name": name,
-                    "b0_30":   0.0,
-                    "b31_60":  0.0,
-                    "b61_90":  0.0,
-                    "b90_plus":0.0,
-                    "total":   0.0,
-                }
-
-            per_customer[code][bucket_key] += outstanding
-            per_customer[code]["total"]     += outstanding
-
-    # --------------------------
-    # 4) BUILD ROWS & STATS
-    # --------------------------
-    rows: List[Dict[str, Any]] = list(per_customer.values())
-    rows.sort(key=lambda r: r["total"], reverse=True)
-
-    total_0_30    = sum(r["b0_30"]   for r in rows)
-    total_31_60   = sum(r["b31_60"]  for r in rows)
-    total_61_90   = sum(r["b61_90"]  for r in rows)
-    total_90_plus = sum(r["b90_plus"]for r in rows)
-    total_all     = total_0_30 + total_31_60 + total_61_90 + total_90_plus
+    # already rounded to 2dp by the pipeline
+    total_0_30    = totals.get("b0_30", 0.0)
+    total_31_60   = totals.get("b31_60", 0.0)
+    total_61_90   = totals.get("b61_90", 0.0)
+    total_90_plus = totals.get("b90_plus", 0.0)
+    total_all     = totals.get("total", 0.0)
 
     def pct(x: float) -> float:
         return (x / total_all * 100) if total_all > 0 else 0.0
 
     stats = {
-        "b0_30":      round(total_0_30, 2),
-        "b31_60":     round(total_31_60, 2),
-        "b61_90":     round(total_61_90, 2),
-        "b90_plus":   round(total_90_plus, 2),
-        "total":      round(total_all, 2),
+        "b0_30":      total_0_30,
+        "b31_60":     total_31_60,
+        "b61_90":     total_61_90,
+        "b90_plus":   total_90_plus,
+        "total":      total_all,
         "pct_0_30":   pct(total_0_30),
         "pct_31_60":  pct(total_31_60),
         "pct_61_90":  pct(total_61_90),
@@ -216,28 +204,34 @@ def aging_report():
     }
 
     # --------------------------
-    # 5) CSV EXPORT
+    # 3) CSV EXPORT
     # --------------------------
     if export:
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow([
-            "Customer Code", "Customer Name",
-            "0-30 Days (GH₵)", "31-60 Days (GH₵)",
-            "61-90 Days (GH₵)", ">90 Days (GH₵)", "Total Due (GH₵)",
-        ])
-        for r in rows:
+        def gen():
+            output = io.StringIO()
+            writer = csv.writer(output)
             writer.writerow([
-                r["customer_code"],
-                r["customer_name"],
-                f'{r["b0_30"]:.2f}',
-                f'{r["b31_60"]:.2f}',
-                f'{r["b61_90"]:.2f}',
-                f'{r["b90_plus"]:.2f}',
-                f'{r["total"]:.2f}',
+                "Customer Code", "Customer Name",
+                "0-30 Days (GH₵)", "31-60 Days (GH₵)",
+                "61-90 Days (GH₵)", ">90 Days (GH₵)", "Total Due (GH₵)",
             ])
+            yield output.getvalue()
+            for r in rows:
+                output.seek(0)
+                output.truncate()
+                writer.writerow([
+                    r["customer_code"],
+                    r["customer_name"],
+                    f'{r["b0_30"]:.2f}',
+                    f'{r["b31_60"]:.2f}',
+                    f'{r["b61_90"]:.2f}',
+                    f'{r["b90_plus"]:.2f}',
+                    f'{r["total"]:.2f}',
+                ])
+                yield output.getvalue()
+
         return Response(
-            output.getvalue(),
+            stream_with_context(gen()),
             mimetype="text/csv",
             headers={"Content-Disposition": 'attachment; filename="ar_aging_report.csv"'},
         )
@@ -1,22 +1,54 @@
 from __future__ import annotations
-from flask import Blueprint, render_template, request, url_for, Response, jsonify
-from datetime import datetime, date
-import io, csv, math, re
+from flask import Blueprint, render_template, request, url_for, Response, jsonify, stream_with_context
+from datetime import datetime, timedelta
+import io, csv, math
+from urllib.parse import urlencode
 from db import db
+from accounting_routes.common import after_token, keyset_after, parse_after, prefix_rx, run_once
 
 ar_invoices_bp = Blueprint("ar_invoices", __name__, template_folder="../templates")
 
 inv_col  = db["ar_invoices"]
 cust_col = db["customers"]
 
+_ROW_FIELDS = {"no":1,"customer":1,"customer_name":1,"issue":1,"due":1,"amount":1,"balance":1,"status":1,"issue_dt":1}
+
+def _ensure_indexes():
+    try:
+        # Matches the listing sort so keyset pages are a single index seek
+        inv_col.create_index([("issue_dt",-1),("_id",-1)])
+        # equality filter first, then the listing sort (ESR)
+        inv_col.create_index([("status",1),("issue_dt",-1),("_id",-1)])
+        inv_col.create_index([("customer",1),("issue_dt",-1)])
+        inv_col.create_index([("no",1)])
+        # backs ?q= search (one text index per collection)
+        inv_col.create_index([("no","text"),("customer","text"),("customer_name","text")], name="invoices_text")
+    except Exception:
+        pass
+
+_ensure_indexes()
+
+def _backfill_due_dates():
+    """Give older invoices a BSON-date due_date_dt (aging reads only that field)."""
+    inv_col.update_many(
+        {"due_date_dt": {"$exists": False}},
+        [{"$set": {"due_date_dt": {"$convert": {
+            "input": {"$ifNull": ["$due_dt", {"$ifNull": ["$due", "$due_date"]}]},
+            "to": "date", "onError": None, "onNull": None}}}}],
+    )
+
+run_once("ar_invoices.due_date_dt", _backfill_due_dates)
+
 def _iso(d): 
     try: return datetime.fromisoformat(d) if d else None
     except: return None
 
-def _paginate_url(page:int, per:int)->str:
-    args = request.args.to_dict()
+def _paginate_url(base:str, args:dict, page:int, per:int, after=None)->str:
+    # base/args are resolved once per request by the caller
     args["page"]=str(page); args["per"]=str(per)
-    return url_for("ar_invoices.invoices", **args)
+    args.pop("after", None)
+    if after: args["after"]=after
+    return f"{base}?{urlencode(args)}"
 
 @ar_invoices_bp.get("/ar/invoices")
 def invoices():
@@ -28,11 +60,12 @@ def invoices():
     page     = max(1, int(request.args.get("page", 1)))
     per      = min(100, max(25, int(request.args.get("per", 25))))
     export   = request.args.get("export") == "1"
+    after    = parse_after(request.args.get("after"))
 
     q = {}
     if qtxt:
-      rx = re.compile(re.escape(qtxt), re.IGNORECASE)
-      q["$or"] = [{"no":rx},{"customer":rx},{"customer_name":rx}]
+      # word search (invoices_text index) or an invoice-number prefix (no_1 index)
+      q["$or"] = [{"$text": {"$search": qtxt}}, {"no": {"$in": prefix_rx(qtxt)}}]
     if customer: q["customer"] = customer
     if status in ("draft","sent","part","overdue","paid"):
       q["status"] = status
@@ -41,38 +74,64 @@ def invoices():
       if dfrom: q["issue_dt"]["$gte"]=datetime(dfrom.year,dfrom.month,dfrom.day)
       if dto:   q["issue_dt"]["$lte"]=datetime(dto.year,dto.month,dto.day,23,59,59,999999)
 
-    cur = inv_col.find(q).sort([("issue_dt", -1), ("_id", -1)])
-    docs = list(cur)
-
-    # quick stats
-    now = datetime.utcnow().date()
-    overdue  = sum(float(d.get("balance",0) or 0) for d in docs if d.get("status")=="overdue")
-    awaiting = sum(float(d.get("balance",0) or 0) for d in docs if d.get("status") in ("sent","part"))
-    paid30   = sum(float(d.get("amount",0) or 0) for d in docs
-                   if d.get("status")=="paid" and isinstance(d.get("paid_dt"), date) and (now - d["paid_dt"]).days <= 30)
-    stats = type("S",(object,),dict(overdue=overdue, awaiting=awaiting, paid30=paid30))
+    sort = [("issue_dt", -1), ("_id", -1)]
 
     # export
-    if export and docs:
-        out = io.StringIO(); w = csv.writer(out)
-        w.writerow(["Invoice","Customer","Issue","Due","Amount(GH₵)","Balance(GH₵)","Status"])
-        for d in docs:
-            w.writerow([d.get("no",""), d.get("customer",""), d.get("issue",""), d.get("due",""),
-                        f'{float(d.get("amount",0)):0.2f}', f'{float(d.get("balance",0)):0.2f}', d.get("status","")])
-        return Response(out.getvalue(), mimetype="text/csv",
+    if export:
+        def gen():
+            out = io.StringIO(); w = csv.writer(out)
+            w.writerow(["Invoice","Customer","Issue","Due","Amount(GH₵)","Balance(GH₵)","Status"])
+            yield out.getvalue()
+            for d in inv_col.find(q, _ROW_FIELDS).sort(sort).batch_size(1000):
+                out.seek(0); out.truncate()
+                w.writerow([d.get("no",""), d.get("customer",""), d.get("issue",""), d.get("due",""),
+                            f'{float(d.get("amount",0)):0.2f}', f'{float(d.get("balance",0)):0.2f}', d.get("status","")])
+                yield out.getvalue()
+        return Response(stream_with_context(gen()), mimetype="text/csv",
                         headers={"Content-Disposition": 'attachment; filename="ar_invoices.csv"'})
 
-    total=len(docs); pages=max(1, math.ceil(total/per)); page=max(1, min(page,pages))
-    start=(page-1)*per; end=start+per
+    # quick stats + total in one round trip (the page itself is an indexed find below)
+    def _sum(field, match):
+        return [{"$match": match}, {"$group": {"_id": None, "s": {"$sum": field}}}]
+
+    res = next(inv_col.aggregate([
+        {"$match": q},
+        {"$facet": {
+            "overdue":  _sum("$balance", {"status": "overdue"}),
+            "awaiting": _sum("$balance", {"status": {"$in": ["sent","part"]}}),
+            "paid30":   _sum("$amount",  {"status": "paid", "paid_dt": {"$gte": datetime.utcnow() - timedelta(days=30)}}),
+            "total":    [{"$count": "n"}],
+        }},
+    ]), {})
+    first = lambda k, f: (res.get(k) or [{}])[0].get(f, 0)
+    stats = type("S",(object,),dict(overdue=float(first("overdue","s") or 0),
+                                    awaiting=float(first("awaiting","s") or 0),
+                                    paid30=float(first("paid30","s") or 0)))
+
+    total=first("total","n"); pages=max(1, math.ceil(total/per))
+    page = min(page, pages); start = (page-1)*per
+
+    if not total:
+        docs = []  # nothing matched; skip the page query entirely
+    elif after:
+        # keyset: seek past the previous page's last row instead of skip()
+        page_q = {"$and": [q, keyset_after("issue_dt", after)]}
+        docs = list(inv_col.find(page_q, _ROW_FIELDS).sort(sort).limit(per))
+    else:
+        # arbitrary page jump (or first page) falls back to skip()
+        docs = list(inv_col.find(q, _ROW_FIELDS).sort(sort).skip(start).limit(per))
+
+    base = url_for("ar_invoices.invoices"); args = request.args.to_dict(flat=True)
+    export_args = dict(args); export_args.pop("after", None); export_args["export"]="1"
+    export_url = f"{base}?{urlencode(export_args)}"
+
+    next_after = after_token(docs[-1], "issue_dt") if docs else None
     pager={"total":total,"page":page,"pages":pages,
-           "prev_url":_paginate_url(page-1,per) if page>1 else None,
-           "next_url":_paginate_url(page+1,per) if page<pages else None}
-
-    export_args = request.args.to_dict(flat=True); export_args["export"]="1"
-    export_url = url_for("ar_invoices.invoices", **export_args)
+           "prev_url":_paginate_url(base,args,page-1,per) if page>1 else None,
+           "next_url":_paginate_url(base,args,page+1,per,next_after) if page<pages else None}
 
     rows=[]
-    for d in docs[start:end]:
+    for d in docs:
         rows.append({
           "no": d.get("no",""),
           "customer": d.get("customer",""),
@@ -88,17 +147,18 @@ def invoices():
 
 @ar_invoices_bp.post("/ar/invoices/quick")
 def quick_create():
-    def _q(x): return (x or "").strip()
     def _f(x):
-        try: return float(str(x).replace(",",""))
+        try: return float(x.replace(",",""))
         except: return 0.0
 
-    no       = _q(request.form.get("no"))
-    customer = _q(request.form.get("customer"))
-    issue    = _q(request.form.get("issue"))
-    due      = _q(request.form.get("due"))
-    amount   = _f(request.form.get("amount"))
-    status   = (_q(request.form.get("status")) or "draft").lower()
+    form = request.form  # snapshot once, read each field one time
+    v = {k: (form.get(k) or "").strip() for k in ("no","customer","issue","due","amount","status")}
+    no       = v["no"]
+    customer = v["customer"]
+    issue    = v["issue"]
+    due      = v["due"]
+    amount   = _f(v["amount"])
+    status   = (v["status"] or "draft").lower()
 
     if not no or not customer or not issue or not due or amount<=0:
         return jsonify(ok=False, message="All fields are required and amount > 0."), 400
@@ -111,7 +171,7 @@ def quick_create():
 
     inv_col.insert_one({
         "no": no, "customer": customer, "customer_name": cust.get("name",""),
-        "issue": issue, "due": due, "issue_dt": issue_dt, "due_dt": due_dt,
+        "issue": issue, "due": due, "issue_dt": issue_dt, "due_dt": due_dt, "due_date_dt": due_dt,
         "amount": amount, "balance": amount,
         "status": status,
         "created_at": datetime.utcnow()
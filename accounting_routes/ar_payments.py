@@ -1,48 +1,150 @@
 # accounting_routes/ar_payments.py
 from __future__ import annotations
 
-from flask import Blueprint, render_template, request, url_for, Response, jsonify
-from datetime import datetime
+from flask import Blueprint, render_template, request, url_for, Response, jsonify, stream_with_context
+from datetime import datetime, time
+from functools import lru_cache
 import io, csv, math, re
+from typing import Any, Dict
+from urllib.parse import urlencode
 
+from pymongo import ReturnDocument
 from db import db
+from accounting_routes.common import (
+    after_token, cached_count, drop_counts, keyset_after, keyset_before, parse_after, run_once, seed_counter,
+)
 
 ar_payments_bp = Blueprint("ar_payments", __name__, template_folder="../templates")
 
 rec_col  = db["ar_receipts"]
 cust_col = db["customers"]
+counters_col = db["counters"]
+
+_RECEIPT_SEQ = "ar_receipt"  # counters _id holding the last issued REC-#### number
+_RECEIPT_NO_RX = re.compile(r"^REC-(\d+)$")
+
+# Fields read by the listing template / CSV export
+_RECEIPT_PROJECTION = {
+    "no": 1,
+    "date": 1,
+    "customer": 1,
+    "customer_name": 1,
+    "method": 1,
+    "amount": 1,
+    "allocated": 1,
+    "amount_cents": 1,
+    "allocated_cents": 1,
+    "reference": 1,
+    "status": 1,
+    "date_dt": 1,
+}
+
+# ?q= matches a prefix of any of these, via lower-cased "<field>_lc" shadow copies
+_SEARCH_FIELDS = ("no", "customer", "customer_name", "reference")
+
+
+def _ensure_indexes() -> None:
+    try:
+        # Listing sort, then equality filters ahead of the sort/range keys (ESR)
+        rec_col.create_index([("date_dt", -1), ("_id", -1)])
+        rec_col.create_index([("customer", 1), ("status", 1), ("date_dt", -1), ("_id", -1)])
+        rec_col.create_index([("status", 1), ("date_dt", -1), ("_id", -1)])
+        for f in _SEARCH_FIELDS:
+            rec_col.create_index([(f"{f}_lc", 1)])
+    except Exception:
+        pass
+    try:
+        # Separate so pre-existing duplicate receipt numbers don't block the indexes above
+        rec_col.create_index([("no", 1)], unique=True)
+    except Exception:
+        pass
+
+
+_ensure_indexes()
+
+
+def _backfill_search_fields() -> None:
+    """Derive the *_lc shadow fields for receipts written before they existed."""
+    rec_col.update_many(
+        {"no_lc": {"$exists": False}},
+        [{"$set": {
+            f"{f}_lc": {"$toLower": {"$ifNull": [f"${f}", ""]}} for f in _SEARCH_FIELDS
+        }}],
+    )
+
+
+run_once("ar_receipts.search_lc", _backfill_search_fields)
+seed_counter(_RECEIPT_SEQ, rec_col, "no", "REC-")
+
+
+def _cents(v) -> int:
+    """Money value -> integer cents (0 for blanks / junk)."""
+    try:
+        return int(round(float(v or 0) * 100))
+    except Exception:
+        return 0
+
+
+def _doc_cents(d: Dict[str, Any], field: str) -> int:
+    """Stored <field>_cents when present, else derived from the legacy float field."""
+    c = d.get(f"{field}_cents")
+    return c if isinstance(c, int) else _cents(d.get(field))
+
+
+def _fmt_cents(c: int) -> str:
+    """Integer cents -> "1234.56" without a float round trip."""
+    sign = "-" if c < 0 else ""
+    whole, frac = divmod(abs(c), 100)
+    return f"{sign}{whole}.{frac:02d}"
 
 
 def _iso(d: str | None):
+    if not d:
+        return None  # absent arg: skip the try/except entirely
     try:
-        return datetime.fromisoformat(d) if d else None
+        return datetime.fromisoformat(d)
     except Exception:
         return None
 
 
-def _paginate_url(page: int, per: int) -> str:
-    args = request.args.to_dict()
+@lru_cache(maxsize=256)
+def _search_rx(term: str) -> re.Pattern:
+    """Anchored prefix pattern for an (already lower-cased) ?q= term, compiled once per term."""
+    return re.compile("^" + re.escape(term))
+
+
+def _paginate_url(base: str, args: Dict[str, str], page: int, per: int,
+                  after: str | None = None, before: str | None = None) -> str:
+    """Listing URL built from a per-request base path + args snapshot (no url_for per link)."""
     args["page"] = str(page)
     args["per"]  = str(per)
-    return url_for("ar_payments.payments", **args)
+    args.pop("after", None)
+    args.pop("before", None)
+    if after:
+        args["after"] = after
+    if before:
+        args["before"] = before
+    return f"{base}?{urlencode(args)}"
 
 
 def _next_receipt_no() -> str:
     """
-    Generate the next receipt number in the form REC-0001, REC-0002, ...
-    based on the highest existing REC-#### value.
+    Preview the next receipt number (REC-0001, REC-0002, ...) for the form.
+    Read-only: the number is only taken by _allocate_receipt_no().
     """
-    last = rec_col.find_one(
-        {"no": {"$regex": r"^REC-\d+$"}},
-        sort=[("date_dt", -1), ("_id", -1)]
+    doc = counters_col.find_one({"_id": _RECEIPT_SEQ}) or {}
+    return f"REC-{int(doc.get('seq', 0)) + 1:04d}"
+
+
+def _allocate_receipt_no() -> str:
+    """Atomically take the next receipt number from the counters document."""
+    doc = counters_col.find_one_and_update(
+        {"_id": _RECEIPT_SEQ},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
     )
-    if not last:
-        return "REC-0001"
-    m = re.search(r"(\d+)$", last.get("no", ""))
-    if not m:
-        return "REC-0001"
-    num = int(m.group(1)) + 1
-    return f"REC-{num:04d}"
+    return f"REC-{doc['seq']:04d}"
 
 
 @ar_payments_bp.get("/ar/payments")
@@ -55,16 +157,14 @@ def payments():
     page     = max(1, int(request.args.get("page", 1)))
     per      = min(100, max(25, int(request.args.get("per", 25))))
     export   = request.args.get("export") == "1"
+    after    = parse_after(request.args.get("after"))
+    before   = parse_after(request.args.get("before"))
 
     q: dict = {}
     if qtxt:
-        rx = re.compile(re.escape(qtxt), re.IGNORECASE)
-        q["$or"] = [
-            {"no": rx},
-            {"customer": rx},
-            {"customer_name": rx},
-            {"reference": rx},
-        ]
+        # Anchored, case-sensitive regex on the lower-cased copies -> index range scans
+        rx = _search_rx(qtxt.lower())
+        q["$or"] = [{f"{f}_lc": rx} for f in _SEARCH_FIELDS]
     if customer:
         q["customer"] = customer
     if status in ("allocated", "partial", "unalloc"):
@@ -72,82 +172,121 @@ def payments():
     if dfrom or dto:
         q["date_dt"] = {}
         if dfrom:
-            q["date_dt"]["$gte"] = datetime(dfrom.year, dfrom.month, dfrom.day)
+            q["date_dt"]["$gte"] = datetime.combine(dfrom.date(), time.min)
         if dto:
-            q["date_dt"]["$lte"] = datetime(dto.year, dto.month, dto.day, 23, 59, 59, 999999)
+            q["date_dt"]["$lte"] = datetime.combine(dto.date(), time.max)
 
-    cur = rec_col.find(q).sort([("date_dt", -1), ("_id", -1)])
-    docs = list(cur)
+    sort = [("date_dt", -1), ("_id", -1)]
 
-    # stats
-    cash_impact = sum(float(d.get("amount", 0) or 0) for d in docs)
-    unallocated_total = sum(
-        max(
-            float(d.get("amount", 0) or 0) - float(d.get("allocated", 0) or 0),
-            0.0,
-        )
-        for d in docs
-    )
-    stats = type("S", (object,), dict(cash_impact=cash_impact, unallocated=unallocated_total))
-
-    # export
-    if export and docs:
-        out = io.StringIO()
-        w = csv.writer(out)
-        w.writerow([
-            "Receipt",
-            "Date",
-            "Customer",
-            "Method",
-            "Amount (GH₵)",
-            "Allocated (GH₵)",
-            "Unallocated (GH₵)",
-            "Reference",
-            "Status",
-        ])
-        for d in docs:
-            amt    = float(d.get("amount", 0) or 0)
-            alloc  = float(d.get("allocated", 0) or 0)
-            unalloc = max(amt - alloc, 0.0)
+    # export (answered before any of the page-only work below)
+    if export:
+        def gen():
+            out = io.StringIO()
+            w = csv.writer(out)
             w.writerow([
-                d.get("no", ""),
-                d.get("date", ""),
-                d.get("customer", ""),
-                d.get("method", ""),
-                f"{amt:0.2f}",
-                f"{alloc:0.2f}",
-                f"{unalloc:0.2f}",
-                d.get("reference", ""),
-                d.get("status", ""),
+                "Receipt",
+                "Date",
+                "Customer",
+                "Method",
+                "Amount (GH₵)",
+                "Allocated (GH₵)",
+                "Unallocated (GH₵)",
+                "Reference",
+                "Status",
             ])
+            yield out.getvalue()
+            for d in rec_col.find(q, _RECEIPT_PROJECTION).sort(sort).batch_size(500):
+                amt_c   = _doc_cents(d, "amount")
+                alloc_c = _doc_cents(d, "allocated")
+                out.seek(0)
+                out.truncate()
+                w.writerow([
+                    d.get("no", ""),
+                    d.get("date", ""),
+                    d.get("customer", ""),
+                    d.get("method", ""),
+                    _fmt_cents(amt_c),
+                    _fmt_cents(alloc_c),
+                    _fmt_cents(max(amt_c - alloc_c, 0)),
+                    d.get("reference", ""),
+                    d.get("status", ""),
+                ])
+                yield out.getvalue()
+
         return Response(
-            out.getvalue(),
+            stream_with_context(gen()),
             mimetype="text/csv",
             headers={"Content-Disposition": 'attachment; filename="ar_receipts.csv"'},
         )
 
-    total = len(docs)
-    pages = max(1, math.ceil(total / per))
-    page  = max(1, min(page, pages))
-    start = (page - 1) * per
-    end   = start + per
+    # stats (summed server-side over the whole filter); a non-numeric amount counts as 0
+    num = lambda f: {"$convert": {"input": f, "to": "double", "onError": 0, "onNull": 0}}
+    agg = next(rec_col.aggregate([
+        {"$match": q},
+        {"$group": {
+            "_id": None,
+            "cash": {"$sum": "$amount"},
+            "unalloc": {"$sum": {"$max": [
+                {"$subtract": [num("$amount"), num("$allocated")]},
+                0,
+            ]}},
+        }},
+    ]), {})
+    cash_impact = float(agg.get("cash") or 0)
+    unallocated_total = float(agg.get("unalloc") or 0)
+    stats = type("S", (object,), dict(cash_impact=cash_impact, unallocated=unallocated_total))
+
+    # Keyset only: every page is one index range read of per+1 rows (the extra row
+    # says whether another page follows), however deep it is. The total is only
+    # for the "Page x of y" label, so a cached / estimated count is enough.
+    total = cached_count(rec_col, q)
+    if after:
+        docs = list(rec_col.find({"$and": [q, keyset_after("date_dt", after)]}, _RECEIPT_PROJECTION)
+                    .sort(sort).limit(per + 1))
+        has_prev, has_next = True, len(docs) > per
+        docs = docs[:per]
+    elif before:
+        # Previous page: walk back from the first row shown, then restore the listing order
+        rev = [(f, -d) for f, d in sort]
+        docs = list(rec_col.find({"$and": [q, keyset_before("date_dt", before)]}, _RECEIPT_PROJECTION)
+                    .sort(rev).limit(per + 1))
+        has_prev, has_next = len(docs) > per, True
+        docs = docs[:per][::-1]
+    else:
+        docs = list(rec_col.find(q, _RECEIPT_PROJECTION).sort(sort).limit(per + 1))
+        has_prev, has_next = False, len(docs) > per
+        docs = docs[:per]
+
+    if not has_prev:
+        page = 1
+    pages = max(page + 1, math.ceil(total / per)) if has_next else page
+
+    base = url_for("ar_payments.payments")
+    args = request.args.to_dict(flat=True)
+
     pager = {
         "total": total,
         "page": page,
         "pages": pages,
-        "prev_url": _paginate_url(page - 1, per) if page > 1 else None,
-        "next_url": _paginate_url(page + 1, per) if page < pages else None,
+        "prev_url": (_paginate_url(base, args, page - 1, per, before=after_token(docs[0], "date_dt"))
+                     if has_prev and docs else None),
+        "next_url": (_paginate_url(base, args, page + 1, per, after=after_token(docs[-1], "date_dt"))
+                     if has_next and docs else None),
     }
 
-    export_args = request.args.to_dict(flat=True)
+    export_args = dict(args)
+    export_args.pop("after", None)
+    export_args.pop("before", None)
     export_args["export"] = "1"
-    export_url = url_for("ar_payments.payments", **export_args)
+    export_url = f"{base}?{urlencode(export_args)}"
 
     rows = []
-    for d in docs[start:end]:
-        amt    = float(d.get("amount", 0) or 0)
-        alloc  = float(d.get("allocated", 0) or 0)
-        unalloc = max(amt - alloc, 0.0)
+    for d in docs:
+        amt_c   = _doc_cents(d, "amount")
+        alloc_c = _doc_cents(d, "allocated")
+        amt     = amt_c / 100
+        alloc   = alloc_c / 100
+        unalloc = max(amt_c - alloc_c, 0) / 100
         rows.append({
             "no": d.get("no", ""),
             "date": d.get("date", ""),
@@ -161,13 +300,6 @@ def payments():
             "status": d.get("status", "unalloc"),
         })
 
-    # customer dropdown list for the modal
-    cust_docs = cust_col.find({}, {"code": 1, "name": 1}).sort([("name", 1)])
-    customers_list = [
-        {"code": c.get("code", ""), "name": c.get("name", "")}
-        for c in cust_docs
-    ]
-
     next_receipt_no = _next_receipt_no()
 
     return render_template(
@@ -176,11 +308,22 @@ def payments():
         pager=pager,
         stats=stats,
         export_url=export_url,
-        customers_list=customers_list,
         next_receipt_no=next_receipt_no,
     )
 
 
+@ar_payments_bp.get("/ar/customers.json")
+def customers_json():
+    """Customer dropdown for the receipt modal, fetched lazily and cached by the browser."""
+    cust_docs = cust_col.find({}, {"_id": 0, "code": 1, "name": 1}).sort([("name", 1)])
+    resp = jsonify([
+        {"code": c.get("code", ""), "name": c.get("name", "")}
+        for c in cust_docs
+    ])
+    resp.headers["Cache-Control"] = "private, max-age=120"
+    return resp
+
+
 @ar_payments_bp.post("/ar/payments/quick")
 def quick_create():
     def _q(x: str | None) -> str:
@@ -202,22 +345,26 @@ def quick_create():
     if not date_str or not customer or amount <= 0:
         return jsonify(ok=False, message="Date, Customer and Amount are required."), 400
 
-    # Auto-generate receipt number if not provided
-    if not no:
-        no = _next_receipt_no()
-    else:
-        if rec_col.find_one({"no": no}):
-            return jsonify(ok=False, message="Receipt already exists."), 409
-
     # Try parse date
     try:
         date_dt = datetime.fromisoformat(date_str)
     except Exception:
         return jsonify(ok=False, message="Invalid date format."), 400
 
+    # Auto-generate receipt number if not provided
+    if not no:
+        no = _allocate_receipt_no()
+    else:
+        if rec_col.find_one({"no": no}):
+            return jsonify(ok=False, message="Receipt already exists."), 409
+        m = _RECEIPT_NO_RX.match(no)
+        if m:
+            # keep the counter ahead of hand-entered REC-#### numbers
+            counters_col.update_one({"_id": _RECEIPT_SEQ}, {"$max": {"seq": int(m.group(1))}}, upsert=True)
+
     cust = cust_col.find_one({"code": customer}) or {}
 
-    rec_col.insert_one({
+    doc = {
         "no": no,
         "date": date_str,
         "date_dt": date_dt,
@@ -226,8 +373,14 @@ def quick_create():
         "method": method or "Cash",
         "amount": amount,
         "allocated": 0.0,
+        "amount_cents": _cents(amount),
+        "allocated_cents": 0,
         "reference": reference,
         "status": "unalloc",
         "created_at": datetime.utcnow(),
-    })
+    }
+    for f in _SEARCH_FIELDS:
+        doc[f"{f}_lc"] = (doc[f] or "").lower()
+    rec_col.insert_one(doc)
+    drop_counts(rec_col)
     return jsonify(ok=True, no=no)
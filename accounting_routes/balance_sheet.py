@@ -1,13 +1,14 @@
 # accounting_routes/balance_sheet.py
 from __future__ import annotations
 
-from flask import Blueprint, render_template, request, jsonify, Response
+from flask import Blueprint, render_template, request, jsonify, Response, stream_with_context
 from datetime import datetime, date, time
 from typing import Any, Dict, List
 import io
 import csv
-import json
+from time import monotonic
 
+import msgspec
 from bson import ObjectId
 from db import db
 
@@ -19,6 +20,23 @@ acc_balance_sheet = Blueprint(
 
 balance_sheets_col = db["balance_sheets"]
 
+# Fields the page serialises for the editor (data-sheet)
+_SHEET_PROJECTION = {"name": 1, "as_of_date": 1, "currency": 1, "lines": 1, "totals": 1}
+
+
+def _ensure_indexes() -> None:
+    try:
+        # Latest-sheet lookup and the selector listing both sort on this
+        balance_sheets_col.create_index([("as_of_date", -1), ("created_at", -1)])
+    except Exception:
+        pass
+
+
+_ensure_indexes()
+
+_OPTIONS_TTL = 60  # seconds the sheet selector list is reused
+_options_cache: dict = {}
+
 
 def _safe_float(v: Any, default: float = 0.0) -> float:
     try:
@@ -29,6 +47,18 @@ def _safe_float(v: Any, default: float = 0.0) -> float:
         return default
 
 
+def _cents(v: Any) -> int:
+    """Money value -> integer cents, so totals are summed without float drift."""
+    return int(round(_safe_float(v, 0.0) * 100))
+
+
+def _fmt_cents(c: int) -> str:
+    """Integer cents -> "1234.56" without a float round trip."""
+    sign = "-" if c < 0 else ""
+    whole, frac = divmod(abs(c), 100)
+    return f"{sign}{whole}.{frac:02d}"
+
+
 def _parse_iso_date(value: str | None) -> date | None:
     if not value:
         return None
@@ -39,6 +69,51 @@ def _parse_iso_date(value: str | None) -> date | None:
         return None
 
 
+def _sheet_options() -> List[Dict[str, Any]]:
+    """Selector entries for every saved sheet, reused for _OPTIONS_TTL seconds."""
+    hit = _options_cache.get("opts")
+    now = monotonic()
+    if hit and now - hit[0] < _OPTIONS_TTL:
+        return hit[1]
+
+    options: List[Dict[str, Any]] = []
+    cursor = balance_sheets_col.find(
+        {},
+        {"name": 1, "as_of_date": 1},
+    ).sort("as_of_date", -1)
+
+    for d in cursor:
+        oid = d.get("_id")
+        name = d.get("name") or ""
+        as_of = d.get("as_of_date")
+
+        if isinstance(as_of, datetime):
+            as_of_str = as_of.strftime("%Y-%m-%d")
+        elif isinstance(as_of, date):
+            as_of_str = as_of.strftime("%Y-%m-%d")
+        else:
+            as_of_str = ""
+
+        label_parts = []
+        if name:
+            label_parts.append(name)
+        if as_of_str:
+            label_parts.append(f"As at {as_of_str}")
+        label = " • ".join(label_parts) if label_parts else "Unnamed Sheet"
+
+        options.append(
+            {
+                "id": str(oid),
+                "name": name,
+                "as_of_date": as_of_str,
+                "label": label,
+            }
+        )
+
+    _options_cache["opts"] = (now, options)
+    return options
+
+
 # ---------------- PAGES ----------------
 
 @acc_balance_sheet.route("/balance-sheet", methods=["GET"])
@@ -54,7 +129,7 @@ def balance_sheet_page():
     if sheet_id_str:
         try:
             oid = ObjectId(sheet_id_str)
-            sheet_doc = balance_sheets_col.find_one({"_id": oid})
+            sheet_doc = balance_sheets_col.find_one({"_id": oid}, _SHEET_PROJECTION)
         except Exception:
             sheet_doc = None
 
@@ -62,6 +137,7 @@ def balance_sheet_page():
     if sheet_doc is None:
         sheet_doc = balance_sheets_col.find_one(
             {},
+            _SHEET_PROJECTION,
             sort=[("as_of_date", -1), ("created_at", -1)],
         )
 
@@ -93,40 +169,7 @@ def balance_sheet_page():
             },
         }
 
-    # Build options for selector
-    options: List[Dict[str, Any]] = []
-    cursor = balance_sheets_col.find(
-        {},
-        {"name": 1, "as_of_date": 1},
-    ).sort("as_of_date", -1)
-
-    for d in cursor:
-        oid = d.get("_id")
-        name = d.get("name") or ""
-        as_of = d.get("as_of_date")
-
-        if isinstance(as_of, datetime):
-            as_of_str = as_of.strftime("%Y-%m-%d")
-        elif isinstance(as_of, date):
-            as_of_str = as_of.strftime("%Y-%m-%d")
-        else:
-            as_of_str = ""
-
-        label_parts = []
-        if name:
-            label_parts.append(name)
-        if as_of_str:
-            label_parts.append(f"As at {as_of_str}")
-        label = " • ".join(label_parts) if label_parts else "Unnamed Sheet"
-
-        options.append(
-            {
-                "id": str(oid),
-                "name": name,
-                "as_of_date": as_of_str,
-                "label": label,
-            }
-        )
+    options = _sheet_options()
 
     today = date.today().strftime("%Y-%m-%d")
 
@@ -161,7 +204,8 @@ def balance_sheet_save():
     }
     """
     try:
-        data = request.get_json(force=True, silent=False)
+        # msgspec's C decoder reads the raw body bytes directly
+        data = msgspec.json.decode(request.get_data())
     except Exception:
         return jsonify(ok=False, message="Invalid JSON body"), 400
 
@@ -187,9 +231,7 @@ def balance_sheet_save():
 
     # Normalize lines and compute totals
     norm_lines: List[Dict[str, Any]] = []
-    total_assets = 0.0
-    total_liab = 0.0
-    total_equity = 0.0
+    total_cents = {"asset": 0, "liability": 0, "equity": 0}
 
     for line in lines:
         if not isinstance(line, dict):
@@ -210,12 +252,7 @@ def balance_sheet_save():
             # skip pure zero rows
             continue
 
-        if l_type == "asset":
-            total_assets += amount
-        elif l_type == "liability":
-            total_liab += amount
-        elif l_type == "equity":
-            total_equity += amount
+        total_cents[l_type] += _cents(amount)
 
         norm_lines.append(
             {
@@ -230,10 +267,10 @@ def balance_sheet_save():
         return jsonify(ok=False, message="All rows are empty or invalid."), 400
 
     totals = {
-        "assets": round(total_assets, 2),
-        "liabilities": round(total_liab, 2),
-        "equity": round(total_equity, 2),
-        "liab_plus_equity": round(total_liab + total_equity, 2),
+        "assets": total_cents["asset"] / 100,
+        "liabilities": total_cents["liability"] / 100,
+        "equity": total_cents["equity"] / 100,
+        "liab_plus_equity": (total_cents["liability"] + total_cents["equity"]) / 100,
     }
 
     doc: Dict[str, Any] = {
@@ -265,6 +302,8 @@ def balance_sheet_save():
         res = balance_sheets_col.insert_one(doc)
         sheet_id = str(res.inserted_id)
 
+    _options_cache.clear()
+
     return jsonify(ok=True, id=sheet_id, totals=totals), 200
 
 
@@ -292,8 +331,8 @@ def balance_sheet_export_csv():
         return jsonify(ok=False, message="No data to export"), 400
 
     try:
-        data = json.loads(payload)
-    except json.JSONDecodeError:
+        data = msgspec.json.decode(payload)
+    except msgspec.DecodeError:
         return jsonify(ok=False, message="Invalid JSON payload"), 400
 
     name = (data.get("name") or "").strip()
@@ -302,95 +341,110 @@ def balance_sheet_export_csv():
     lines = data.get("lines") or []
     totals = data.get("totals") or {}
 
-    out = io.StringIO()
-    w = csv.writer(out)
-
-    title = "Balance Sheet"
-    if name:
-        title += f" - {name}"
-    if as_of_date_str:
-        title += f" (As at {as_of_date_str})"
-
-    # Title row
-    w.writerow([title])
-    w.writerow([])
-
-    # Assets
-    w.writerow(["ASSETS"])
-    w.writerow(["Section", "Account", f"Amount ({currency})"])
-
-    asset_lines = [l for l in lines if (l.get("type") or "").lower() == "asset"]
-    current_section = None
-    total_assets = 0.0
-
-    for line in asset_lines:
-        section = line.get("section") or ""
-        label = line.get("label") or ""
-        amount = _safe_float(line.get("amount"), 0.0)
-        if section != current_section:
-            current_section = section
-            if section:
-                w.writerow([section, "", ""])
-        w.writerow(["", label, f"{amount:0.2f}"])
-        total_assets += amount
-
-    # Total assets row
-    if asset_lines:
-        w.writerow([])
-        w.writerow(["", "Total Assets", f"{total_assets:0.2f}"])
-
-    w.writerow([])
-    w.writerow([])
-
-    # Liabilities & Equity
-    w.writerow(["LIABILITIES & EQUITY"])
-    w.writerow(["Type", "Section", "Account", f"Amount ({currency})"])
+    # One pass over the lines, bucketed by type (order within a type is kept)
+    by_type: Dict[str, List[Dict[str, Any]]] = {"asset": [], "liability": [], "equity": []}
+    for l in lines:
+        bucket = by_type.get((l.get("type") or "").lower())
+        if bucket is not None:
+            bucket.append(l)
+    asset_lines = by_type["asset"]
+    liab_lines = by_type["liability"]
+    eq_lines = by_type["equity"]
+
+    def gen():
+        out = io.StringIO()
+        w = csv.writer(out)
+        cents, fmt = _cents, _fmt_cents
+
+        def emit(*rows) -> str:
+            """Render rows through the reused buffer and return the CSV text."""
+            out.seek(0)
+            out.truncate()
+            w.writerows(rows)
+            return out.getvalue()
+
+        title = "Balance Sheet"
+        if name:
+            title += f" - {name}"
+        if as_of_date_str:
+            title += f" (As at {as_of_date_str})"
 
-    liab_lines = [l for l in lines if (l.get("type") or "").lower() == "liability"]
-    eq_lines = [l for l in lines if (l.get("type") or "").lower() == "equity"]
+        # Title row
+        yield emit([title])
+        yield emit([])
 
-    total_liab = 0.0
-    total_eq = 0.0
+        # Assets
+        yield emit(["ASSETS"])
+        yield emit(["Section", "Account", f"Amount ({currency})"])
 
-    if liab_lines:
-        w.writerow(["Liabilities", "", "", ""])
-        current_section = None
-        for line in liab_lines:
-            section = line.get("section") or ""
-            label = line.get("label") or ""
-            amount = _safe_float(line.get("amount"), 0.0)
-            if section != current_section:
-                current_section = section
-                if section:
-                    w.writerow(["", section, "", ""])
-            w.writerow(["", "", label, f"{amount:0.2f}"])
-            total_liab += amount
-        w.writerow(["", "", "Total Liabilities", f"{total_liab:0.2f}"])
-
-    if eq_lines:
-        w.writerow([])
-        w.writerow(["Equity", "", "", ""])
         current_section = None
-        for line in eq_lines:
+        total_assets = 0
+
+        for line in asset_lines:
             section = line.get("section") or ""
             label = line.get("label") or ""
-            amount = _safe_float(line.get("amount"), 0.0)
+            amount = cents(line.get("amount"))
             if section != current_section:
                 current_section = section
                 if section:
-                    w.writerow(["", section, "", ""])
-            w.writerow(["", "", label, f"{amount:0.2f}"])
-            total_eq += amount
-        w.writerow(["", "", "Total Equity", f"{total_eq:0.2f}"])
+                    yield emit([section, "", ""])
+            yield emit(["", label, fmt(amount)])
+            total_assets += amount
 
-    w.writerow([])
-    w.writerow(["", "", "Total Liabilities + Equity", f"{(total_liab + total_eq):0.2f}"])
+        # Total assets row
+        if asset_lines:
+            yield emit([])
+            yield emit(["", "Total Assets", fmt(total_assets)])
+
+        yield emit([])
+        yield emit([])
+
+        # Liabilities & Equity
+        yield emit(["LIABILITIES & EQUITY"])
+        yield emit(["Type", "Section", "Account", f"Amount ({currency})"])
+
+        total_liab = 0
+        total_eq = 0
+
+        if liab_lines:
+            yield emit(["Liabilities", "", "", ""])
+            current_section = None
+            for line in liab_lines:
+                section = line.get("section") or ""
+                label = line.get("label") or ""
+                amount = cents(line.get("amount"))
+                if section != current_section:
+                    current_section = section
+                    if section:
+                        yield emit(["", section, "", ""])
+                yield emit(["", "", label, fmt(amount)])
+                total_liab += amount
+            yield emit(["", "", "Total Liabilities", fmt(total_liab)])
+
+        if eq_lines:
+            yield emit([])
+            yield emit(["Equity", "", "", ""])
+            current_section = None
+            for line in eq_lines:
+                section = line.get("section") or ""
+                label = line.get("label") or ""
+                amount = cents(line.get("amount"))
+                if section != current_section:
+                    current_section = section
+                    if section:
+                        yield emit(["", section, "", ""])
+                yield emit(["", "", label, fmt(amount)])
+                total_eq += amount
+            yield emit(["", "", "Total Equity", fmt(total_eq)])
+
+        yield emit([])
+        yield emit(["", "", "Total Liabilities + Equity", fmt(total_liab + total_eq)])
 
     filename_date = (as_of_date_str or date.today().strftime("%Y-%m-%d")).replace("-", "")
     filename = f"balance_sheet_{filename_date}.csv"
 
     return Response(
-        out.getvalue(),
+        stream_with_context(gen()),
         mimetype="text/csv",
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
@@ -1,12 +1,15 @@
 from __future__ import annotations
 
-from flask import Blueprint, render_template, request, url_for, Response, jsonify
+from flask import Blueprint, render_template, request, url_for, Response, jsonify, stream_with_context
 from datetime import datetime, date
 import io, csv
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+from time import monotonic
 
 from bson import ObjectId
 from db import db
+from accounting_routes.common import run_once
 
 bank_accounts_bp = Blueprint("bank_accounts", __name__, template_folder="../templates")
 
@@ -17,6 +20,25 @@ tax_col      = db["tax_records"]     # P-Tax outflows (source_bank_id)
 sbdc_col     = db["s_bdc_payment"]   # BDC bank payments (bank_paid_history)
 bank_txn_col = db["bank_transactions"]  # manual deposits/withdrawals/transfers
 
+# Shared workers for the per-collection flow pipelines (PyMongo releases the GIL on I/O)
+_FLOW_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bank-flows")
+
+_DASHBOARD_TTL = 30  # seconds the computed dashboard rows are reused
+_dashboard_cache: dict = {}
+
+# Fields read by the dashboard template / CSV export
+_ACCOUNT_PROJECTION = {
+    "bank_name": 1,
+    "account_name": 1,
+    "account_no": 1,
+    "account_number": 1,
+    "account_last4": 1,
+    "currency": 1,
+    "currency_symbol": 1,
+    "opening_balance": 1,
+    "last_reconciled": 1,
+}
+
 def _ensure_txn_indexes() -> None:
     try:
         bank_txn_col.create_index([("bank_id", 1), ("txn_date", -1)])
@@ -26,6 +48,41 @@ def _ensure_txn_indexes() -> None:
 
 _ensure_txn_indexes()
 
+def _ensure_flow_indexes() -> None:
+    """Indexes behind the grouped cash-flow pipelines in _bank_flows()."""
+    try:
+        payments_col.create_index([("bank_name", 1), ("account_last4", 1), ("status", 1)])
+        tax_col.create_index([("source_bank_id", 1), ("type", 1)])
+        sbdc_col.create_index([("bank_paid_history.bank_id", 1)])
+    except Exception:
+        pass
+
+_ensure_flow_indexes()
+
+def _backfill_account_last4() -> None:
+    """Store account_last4 on bank accounts created before it was written."""
+    acc_no = {"$let": {
+        "vars": {"n": {"$toString": {"$ifNull": ["$account_no", ""]}}},
+        "in": {"$cond": [
+            {"$eq": ["$$n", ""]},
+            {"$toString": {"$ifNull": ["$account_number", ""]}},
+            "$$n",
+        ]},
+    }}
+    accounts_col.update_many(
+        {"account_last4": {"$exists": False}},
+        [{"$set": {"account_last4": {"$let": {
+            "vars": {"s": acc_no},
+            "in": {"$substrCP": [
+                "$$s",
+                {"$max": [0, {"$subtract": [{"$strLenCP": "$$s"}, 4]}]},
+                4,
+            ]},
+        }}}}],
+    )
+
+run_once("bank_accounts.account_last4", _backfill_account_last4)
+
 
 # ----------------- helpers -----------------
 def _safe_float(v: Any, default: float = 0.0) -> float:
@@ -37,17 +94,20 @@ def _safe_float(v: Any, default: float = 0.0) -> float:
         return default
 
 
-def _currency_symbol(code: str) -> str:
-    code = (code or "").upper()
-    if code in ("GHS", "GH₵", "GHC"):
-        return "GH₵"
-    if code == "USD":
-        return "$"
-    if code == "EUR":
-        return "€"
-    if code == "GBP":
-        return "£"
-    return ""
+# Display symbol per (upper-cased) currency code; unknown codes get ""
+_CUR_SYM = {"GHS": "GH₵", "GHC": "GH₵", "GH₵": "GH₵", "USD": "$", "EUR": "€", "GBP": "£"}
+
+
+def _cents(v: Any) -> int:
+    """Money value -> integer cents (summed as ints, formatted once)."""
+    return int(round(_safe_float(v) * 100))
+
+
+def _fmt_cents(c: int) -> str:
+    """Integer cents -> "1234.56" without a float round trip."""
+    sign = "-" if c < 0 else ""
+    whole, frac = divmod(abs(c), 100)
+    return f"{sign}{whole}.{frac:02d}"
 
 
 def _last4(acc_number: str | None) -> str:
@@ -55,93 +115,83 @@ def _last4(acc_number: str | None) -> str:
     return s[-4:] if len(s) >= 4 else s
 
 
-def _sum_confirmed_in(bank_name: str, last4: str) -> float:
-    """Sum of confirmed inbound payments for this bank (by name + last4)."""
+def _totals_by(col, pipe: List[Dict[str, Any]]) -> Dict[Any, Dict[str, float]]:
+    """Run a pipeline whose $group emits {_id, <sums>...}; map _id -> float sums."""
     try:
-        pipe = [
-            {
-                "$match": {
-                    "bank_name": bank_name,
-                    "account_last4": last4,
-                    "status": "confirmed",
-                }
-            },
-            {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
-        ]
-        row = next(payments_col.aggregate(pipe), None)
-        return _safe_float(row["total"]) if row else 0.0
+        return {
+            row["_id"]: {k: _safe_float(v) for k, v in row.items() if k != "_id"}
+            for row in col.aggregate(pipe)
+        }
     except Exception:
-        return 0.0
+        return {}
 
 
-def _sum_ptax_out(bank_oid: ObjectId) -> float:
-    """Sum of P-Tax payments made from this bank (tax_records.source_bank_id)."""
-    try:
-        pipe = [
-            {
-                "$match": {
-                    "source_bank_id": bank_oid,
-                    "type": {"$regex": r"^p[\s_-]*tax$", "$options": "i"},
-                }
-            },
-            {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
-        ]
-        row = next(tax_col.aggregate(pipe), None)
-        return _safe_float(row["total"]) if row else 0.0
-    except Exception:
-        return 0.0
-
+def _bank_flows(docs: List[Dict[str, Any]]) -> Dict[str, Dict[Any, Dict[str, float]]]:
+    """
+    Cash-flow totals for every bank account in `docs`, one grouped pipeline per
+    source collection instead of one aggregate per account:
 
-def _sum_bdc_out(bank_oid: ObjectId) -> float:
-    """Sum of BDC bank payments (sum bank_paid_history.amount where bank_id==bank_oid)."""
-    try:
-        pipe = [
-            {"$match": {"bank_paid_history": {"$exists": True, "$ne": []}}},
-            {"$unwind": "$bank_paid_history"},
-            {"$match": {"bank_paid_history.bank_id": bank_oid}},
-            {"$group": {"_id": None, "total": {"$sum": "$bank_paid_history.amount"}}},
-        ]
-        row = next(sbdc_col.aggregate(pipe), None)
-        return _safe_float(row["total"]) if row else 0.0
-    except Exception:
-        return 0.0
+    - "in":     confirmed inbound payments, keyed by (bank_name, account_last4)
+    - "ptax":   P-Tax payments (tax_records.source_bank_id), keyed by bank _id
+    - "bdc":    BDC bank payments (bank_paid_history.bank_id), keyed by bank _id
+    - "manual": manual deposits/withdrawals/transfers, keyed by bank _id
+    """
+    oids = [d["_id"] for d in docs if isinstance(d.get("_id"), ObjectId)]
+    names = list({d.get("bank_name") or "" for d in docs})
+
+    # Independent pipelines on four collections: run them side by side so the
+    # page waits for the slowest round trip rather than the sum of all four.
+    f_in = _FLOW_POOL.submit(_totals_by, payments_col, [
+        {"$match": {"status": "confirmed", "bank_name": {"$in": names}}},
+        {"$group": {
+            "_id": {"bank_name": "$bank_name", "last4": "$account_last4"},
+            "total": {"$sum": "$amount"},
+        }},
+    ])
+    f_ptax = _FLOW_POOL.submit(_totals_by, tax_col, [
+        {"$match": {
+            "source_bank_id": {"$in": oids},
+            "type": {"$regex": r"^p[\s_-]*tax$", "$options": "i"},
+        }},
+        {"$group": {"_id": "$source_bank_id", "total": {"$sum": "$amount"}}},
+    ])
+    f_bdc = _FLOW_POOL.submit(_totals_by, sbdc_col, [
+        {"$match": {"bank_paid_history.bank_id": {"$in": oids}}},
+        {"$unwind": "$bank_paid_history"},
+        {"$match": {"bank_paid_history.bank_id": {"$in": oids}}},
+        {"$group": {"_id": "$bank_paid_history.bank_id", "total": {"$sum": "$bank_paid_history.amount"}}},
+    ])
+    f_manual = _FLOW_POOL.submit(_totals_by, bank_txn_col, [
+        {"$match": {"bank_id": {"$in": oids}}},
+        {"$group": {
+            "_id": "$bank_id",
+            "in": {"$sum": {"$cond": [{"$in": ["$type", ["deposit", "transfer_in"]]}, "$amount", 0]}},
+            "out": {"$sum": {"$cond": [{"$in": ["$type", ["withdrawal", "transfer_out"]]}, "$amount", 0]}},
+        }},
+    ])
 
-def _sum_manual_in(bank_oid: ObjectId) -> float:
-    """Sum manual inflows for this bank (deposit, transfer_in)."""
-    try:
-        pipe = [
-            {"$match": {"bank_id": bank_oid, "type": {"$in": ["deposit", "transfer_in"]}}},
-            {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
-        ]
-        row = next(bank_txn_col.aggregate(pipe), None)
-        return _safe_float(row["total"]) if row else 0.0
-    except Exception:
-        return 0.0
+    return {
+        "in": {(k.get("bank_name"), k.get("last4")): v for k, v in f_in.result().items()},
+        "ptax": f_ptax.result(),
+        "bdc": f_bdc.result(),
+        "manual": f_manual.result(),
+    }
 
-def _sum_manual_out(bank_oid: ObjectId) -> float:
-    """Sum manual outflows for this bank (withdrawal, transfer_out)."""
-    try:
-        pipe = [
-            {"$match": {"bank_id": bank_oid, "type": {"$in": ["withdrawal", "transfer_out"]}}},
-            {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
-        ]
-        row = next(bank_txn_col.aggregate(pipe), None)
-        return _safe_float(row["total"]) if row else 0.0
-    except Exception:
-        return 0.0
 
-
-# ----------------- pages -----------------
-@bank_accounts_bp.get("/bank-accounts")
-def list_accounts():
-    """
-    Bank & Cash Accounts dashboard.
-    """
-    docs = list(accounts_col.find({}).sort("bank_name", 1))
+def _dashboard_accounts() -> Tuple[List[Dict[str, Any]], float]:
+    """Dashboard rows (with cash-flow metrics) and the summed live balance."""
+    docs = list(accounts_col.find({}, _ACCOUNT_PROJECTION).sort("bank_name", 1))
+    flows = _bank_flows(docs)
 
     accounts: List[Dict[str, Any]] = []
     total_live_balance = 0.0
 
+    # Bind lookups used on every row to locals
+    sf, last4_of, cur_sym = _safe_float, _last4, _CUR_SYM.get
+    in_by_key, ptax_by_oid, bdc_by_oid, manual_by_oid = (
+        flows["in"], flows["ptax"], flows["bdc"], flows["manual"]
+    )
+
     for d in docs:
         bank_oid = d.get("_id")
         if not isinstance(bank_oid, ObjectId):
@@ -150,48 +200,71 @@ def list_accounts():
         bank_name = d.get("bank_name") or ""
 
         raw_acc_no = d.get("account_no") or d.get("account_number") or ""
-        last4 = _last4(raw_acc_no)
-
-        opening = _safe_float(d.get("opening_balance"))
-        total_in = _sum_confirmed_in(bank_name, last4)
-        ptax_out = _sum_ptax_out(bank_oid)
-        bdc_out = _sum_bdc_out(bank_oid)
-        manual_in = _sum_manual_in(bank_oid)
-        manual_out = _sum_manual_out(bank_oid)
+        last4 = d.get("account_last4")
+        if last4 is None:
+            last4 = last4_of(raw_acc_no)
+
+        opening = sf(d.get("opening_balance"))
+        manual = manual_by_oid.get(bank_oid, {})
+        total_in = in_by_key.get((bank_name, last4), {}).get("total", 0.0)
+        ptax_out = ptax_by_oid.get(bank_oid, {}).get("total", 0.0)
+        bdc_out = bdc_by_oid.get(bank_oid, {}).get("total", 0.0)
+        manual_in = manual.get("in", 0.0)
+        manual_out = manual.get("out", 0.0)
         total_out = ptax_out + bdc_out + manual_out
 
         live_balance = opening + total_in + manual_in - total_out
         total_live_balance += live_balance
 
         cur = (d.get("currency") or "GHS").upper()
-        sym = d.get("currency_symbol") or _currency_symbol(cur)
-
-        account_no_masked = f"…{last4}" if last4 else ""
-
-        acc_dict: Dict[str, Any] = dict(d)
-        acc_dict["id"] = str(bank_oid)
-        acc_dict["opening_balance"] = opening
-        acc_dict["balance"] = live_balance
-        acc_dict["currency"] = cur
-        acc_dict["currency_symbol"] = sym
-        acc_dict["account_no_masked"] = account_no_masked
-        acc_dict["last_reconciled"] = d.get("last_reconciled")
-        acc_dict["metrics"] = {
-            "total_in": round(total_in, 2),
-            "ptax_out": round(ptax_out, 2),
-            "bdc_out": round(bdc_out, 2),
-            "manual_in": round(manual_in, 2),
-            "manual_out": round(manual_out, 2),
-            "net_flow": round(total_in - total_out, 2),
+        sym = d.get("currency_symbol") or cur_sym(cur, "")
+
+        # Only the fields the template reads, rather than a copy of the whole doc
+        acc_dict: Dict[str, Any] = {
+            "id": str(bank_oid),
+            "bank_name": bank_name,
+            "account_name": d.get("account_name", ""),
+            "account_no": raw_acc_no,
+            "account_no_masked": f"…{last4}" if last4 else "",
+            "opening_balance": opening,
+            "balance": live_balance,
+            "currency": cur,
+            "currency_symbol": sym,
+            "last_reconciled": d.get("last_reconciled"),
+            "metrics": {
+                "total_in": round(total_in, 2),
+                "ptax_out": round(ptax_out, 2),
+                "bdc_out": round(bdc_out, 2),
+                "manual_in": round(manual_in, 2),
+                "manual_out": round(manual_out, 2),
+                "net_flow": round(total_in - total_out, 2),
+            },
         }
 
         accounts.append(acc_dict)
 
+    return accounts, total_live_balance
+
+
+# ----------------- pages -----------------
+@bank_accounts_bp.get("/bank-accounts")
+def list_accounts():
+    """
+    Bank & Cash Accounts dashboard.
+    """
+    hit = _dashboard_cache.get("accounts")
+    now = monotonic()
+    if hit and now - hit[0] < _DASHBOARD_TTL:
+        accounts, total_live_balance = hit[1]
+    else:
+        accounts, total_live_balance = _dashboard_accounts()
+        _dashboard_cache["accounts"] = (now, (accounts, total_live_balance))
+
     today = date.today().isoformat()
 
     if accounts:
         first = accounts[0]
-        sym = first.get("currency_symbol") or _currency_symbol(first.get("currency", "GHS"))
+        sym = first.get("currency_symbol") or _CUR_SYM.get(first.get("currency", "GHS"), "")
     else:
         sym = "GH₵"
 
@@ -232,14 +305,16 @@ def quick_create():
         except Exception:
             data["as_of_date"] = None
 
+    data["account_last4"] = _last4(data["account_no"])
     data["balance"] = data["opening_balance"]
-    data["currency_symbol"] = _currency_symbol(data["currency"])
+    data["currency_symbol"] = _CUR_SYM.get(data["currency"], "")
     data["last_reconciled"] = None
 
     if not data["account_name"] or not data["bank_name"]:
         return jsonify(ok=False, message="Account name and bank name are required."), 400
 
     res = accounts_col.insert_one(data)
+    _dashboard_cache.clear()
     return jsonify(ok=True, id=str(res.inserted_id))
 
 
@@ -248,69 +323,82 @@ def export_excel():
     """
     Export bank accounts as CSV (Excel-compatible).
     """
-    docs = list(accounts_col.find({}).sort("bank_name", 1))
-
-    out = io.StringIO()
-    w = csv.writer(out)
-
-    w.writerow([
-        "Bank Name",
-        "Account Name",
-        "Account Number",
-        "Currency",
-        "Opening Balance",
-        "Total Inflow (confirmed)",
-        "P-Tax Out",
-        "BDC Out",
-        "Manual In",
-        "Manual Out",
-        "Net Flow (In - Out)",
-        "Live Balance",
-        "Last Reconciled",
-    ])
-
-    for d in docs:
-        bank_oid = d.get("_id")
-        if not isinstance(bank_oid, ObjectId):
-            continue
-
-        bank_name = d.get("bank_name") or ""
-        raw_acc_no = d.get("account_no") or d.get("account_number") or ""
-        last4 = _last4(raw_acc_no)
-
-        opening = _safe_float(d.get("opening_balance"))
-        total_in = _sum_confirmed_in(bank_name, last4)
-        ptax_out = _sum_ptax_out(bank_oid)
-        bdc_out = _sum_bdc_out(bank_oid)
-        manual_in = _sum_manual_in(bank_oid)
-        manual_out = _sum_manual_out(bank_oid)
-        total_out = ptax_out + bdc_out + manual_out
-        net_flow = total_in + manual_in - total_out
-        live_balance = opening + net_flow
-
-        cur = (d.get("currency") or "GHS").upper()
-        last = d.get("last_reconciled")
-        if isinstance(last, datetime):
-            last = last.strftime("%Y-%m-%d")
+    def gen():
+        out = io.StringIO()
+        w = csv.writer(out)
 
         w.writerow([
-            bank_name,
-            d.get("account_name", ""),
-            raw_acc_no,
-            cur,
-            f"{opening:0.2f}",
-            f"{total_in:0.2f}",
-            f"{ptax_out:0.2f}",
-            f"{bdc_out:0.2f}",
-            f"{manual_in:0.2f}",
-            f"{manual_out:0.2f}",
-            f"{net_flow:0.2f}",
-            f"{live_balance:0.2f}",
-            last or "",
+            "Bank Name",
+            "Account Name",
+            "Account Number",
+            "Currency",
+            "Opening Balance",
+            "Total Inflow (confirmed)",
+            "P-Tax Out",
+            "BDC Out",
+            "Manual In",
+            "Manual Out",
+            "Net Flow (In - Out)",
+            "Live Balance",
+            "Last Reconciled",
         ])
+        yield out.getvalue()
+
+        docs = list(accounts_col.find({}, _ACCOUNT_PROJECTION).sort("bank_name", 1))
+        flows = _bank_flows(docs)
+        cents, fmt, last4_of = _cents, _fmt_cents, _last4
+        in_by_key, ptax_by_oid, bdc_by_oid, manual_by_oid = (
+            flows["in"], flows["ptax"], flows["bdc"], flows["manual"]
+        )
+        for d in docs:
+            bank_oid = d.get("_id")
+            if not isinstance(bank_oid, ObjectId):
+                continue
+
+            bank_name = d.get("bank_name") or ""
+            raw_acc_no = d.get("account_no") or d.get("account_number") or ""
+            last4 = d.get("account_last4")
+            if last4 is None:
+                last4 = last4_of(raw_acc_no)
+
+            # All arithmetic below is in integer cents
+            opening = cents(d.get("opening_balance"))
+            manual = manual_by_oid.get(bank_oid, {})
+            total_in = cents(in_by_key.get((bank_name, last4), {}).get("total"))
+            ptax_out = cents(ptax_by_oid.get(bank_oid, {}).get("total"))
+            bdc_out = cents(bdc_by_oid.get(bank_oid, {}).get("total"))
+            manual_in = cents(manual.get("in"))
+            manual_out = cents(manual.get("out"))
+            total_out = ptax_out + bdc_out + manual_out
+            net_flow = total_in + manual_in - total_out
+            live_balance = opening + net_flow
+
+            cur = (d.get("currency") or "GHS").upper()
+            last = d.get("last_reconciled")
+            if isinstance(last, datetime):
+                last = last.strftime("%Y-%m-%d")
+
+            out.seek(0)
+            out.truncate()
+            w.writerow([
+                bank_name,
+                d.get("account_name", ""),
+                raw_acc_no,
+                cur,
+                fmt(opening),
+                fmt(total_in),
+                fmt(ptax_out),
+                fmt(bdc_out),
+                fmt(manual_in),
+                fmt(manual_out),
+                fmt(net_flow),
+                fmt(live_balance),
+                last or "",
+            ])
+            yield out.getvalue()
 
     return Response(
-        out.getvalue(),
+        stream_with_context(gen()),
         mimetype="text/csv",
         headers={"Content-Disposition": 'attachment; filename="bank_accounts.csv"'},
     )
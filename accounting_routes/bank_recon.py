@@ -7,15 +7,20 @@ from flask import (
     request,
     url_for,
     Response,
-    jsonify,
     redirect,
+    stream_with_context,
 )
 from datetime import datetime, date
 from bson import ObjectId
-import io, csv
+from concurrent.futures import ThreadPoolExecutor
+import io, csv, re
+from time import monotonic
 from typing import Any, Dict, List
 
+import msgspec
+from pymongo.errors import OperationFailure
 from db import db
+from accounting_routes.common import after_token, keyset_after, parse_after
 
 bank_recon_bp = Blueprint("bank_recon", __name__, template_folder="../templates")
 
@@ -28,8 +33,58 @@ payments_col = db["payments"]        # confirmed inbound cash-ins
 tax_col      = db["tax_records"]     # P-Tax outflows (source_bank_id)
 sbdc_col     = db["s_bdc_payment"]   # BDC bank payments (bank_paid_history)
 
+# Shared workers for the live-metric aggregations (PyMongo releases the GIL on I/O)
+_METRICS_POOL = ThreadPoolExecutor(max_workers=3, thread_name_prefix="recon-metrics")
+
+_BANK_LINES_SHOWN = 500  # statement lines per page (newest first); totals cover every line
+
+_METRICS_TTL = 30  # seconds live metrics are reused for an account
+_metrics_cache: dict = {}
+
+# Accounts are created/edited from other blueprints, so this one just expires
+_SELECT_TTL = 60  # seconds the account selector list is reused
+_select_cache: dict = {}
+
+# Display symbol per (upper-cased) currency code
+_CCY_SYM = {"GHS": "GH₵", "GH₵": "GH₵", "GHC": "GH₵", "USD": "$", "EUR": "€", "GBP": "£"}
+
+_PTAX_TYPE_RX = re.compile(r"^p[\s_-]*tax$", re.IGNORECASE)
+
+# Index key patterns the metric aggregations hint at (see _ensure_metric_indexes)
+_PAYMENTS_IN_IDX = [("bank_name", 1), ("account_last4", 1), ("status", 1), ("amount", 1)]
+_TAX_OUT_IDX     = [("source_bank_id", 1), ("type", 1), ("amount", 1)]
+_SBDC_BANK_IDX   = [("bank_paid_history.bank_id", 1)]
+
+
+def _ensure_metric_indexes() -> None:
+    # amount is trailing so the inflow / P-Tax sums are answered from the index alone
+    for col, keys in ((payments_col, _PAYMENTS_IN_IDX), (tax_col, _TAX_OUT_IDX), (sbdc_col, _SBDC_BANK_IDX)):
+        try:
+            col.create_index(keys)
+        except Exception:
+            pass
+
+
+_ensure_metric_indexes()
+
+
+def _ensure_line_indexes() -> None:
+    try:
+        # view(): equality on account, then the newest-first listing sort
+        bank_lines_col.create_index([("account_id", 1), ("date", -1), ("_id", -1)])
+    except Exception:
+        pass
+
+
+_ensure_line_indexes()
+
 
 # ----------------- helpers -----------------
+def _json(**kw) -> Response:
+    """JSON response encoded by msgspec's C encoder (stands in for flask.jsonify)."""
+    return Response(msgspec.json.encode(kw), mimetype="application/json")
+
+
 def _safe_float(v: Any, default: float = 0.0) -> float:
     try:
         if v is None or v == "":
@@ -40,16 +95,7 @@ def _safe_float(v: Any, default: float = 0.0) -> float:
 
 
 def _currency_symbol(code: str) -> str:
-    code = (code or "").upper()
-    if code in ("GHS", "GH₵", "GHC"):
-        return "GH₵"
-    if code == "USD":
-        return "$"
-    if code == "EUR":
-        return "€"
-    if code == "GBP":
-        return "£"
-    return ""
+    return _CCY_SYM.get((code or "").upper(), "")
 
 
 def _iso(d: str | None):
@@ -62,15 +108,23 @@ def _iso(d: str | None):
         return None
 
 
-def _signed_amount(amount: float, direction: str) -> float:
-    """
-    Convert amount + direction ('debit'/'credit') into signed value.
-    Simplified rule: credits = +, debits = -.
-    """
-    direction = (direction or "debit").lower()
-    if direction == "credit":
-        return amount
-    return -amount
+# Statement date shapes -> the one strptime format that can parse them
+_DATE_DISPATCH = (
+    (re.compile(r"^\d{4}-\d{1,2}-\d{1,2}$"), "%Y-%m-%d"),
+    (re.compile(r"^\d{1,2}/\d{1,2}/\d{4}$"), "%d/%m/%Y"),
+    (re.compile(r"^\d{1,2}-\d{1,2}-\d{4}$"), "%d-%m-%Y"),
+)
+
+
+def _parse_statement_date(raw: str) -> datetime | None:
+    """Pick the format from the string's shape, then a single strptime (None if unparseable)."""
+    for rx, fmt in _DATE_DISPATCH:
+        if rx.match(raw):
+            try:
+                return datetime.strptime(raw, fmt)
+            except ValueError:
+                return None  # right shape, impossible date (e.g. 31/02/2024)
+    return None
 
 
 def _last4(acc_number: str | None) -> str:
@@ -78,6 +132,14 @@ def _last4(acc_number: str | None) -> str:
     return s[-4:] if len(s) >= 4 else s
 
 
+def _aggregate_hinted(col, pipe: List[Dict[str, Any]], hint: List[tuple]):
+    """Aggregate pinned to `hint`; if that index is missing, let the planner choose."""
+    try:
+        return col.aggregate(pipe, hint=hint)
+    except OperationFailure:
+        return col.aggregate(pipe)
+
+
 def _sum_confirmed_in(bank_name: str, last4: str) -> float:
     """Sum of confirmed inbound payments for this bank (by name + last4)."""
     try:
@@ -91,7 +153,7 @@ def _sum_confirmed_in(bank_name: str, last4: str) -> float:
             },
             {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
         ]
-        row = next(payments_col.aggregate(pipe), None)
+        row = next(_aggregate_hinted(payments_col, pipe, _PAYMENTS_IN_IDX), None)
         return _safe_float(row["total"]) if row else 0.0
     except Exception:
         return 0.0
@@ -104,12 +166,12 @@ def _sum_ptax_out(bank_oid: ObjectId) -> float:
             {
                 "$match": {
                     "source_bank_id": bank_oid,
-                    "type": {"$regex": r"^p[\s_-]*tax$", "$options": "i"},
+                    "type": _PTAX_TYPE_RX,
                 }
             },
             {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
         ]
-        row = next(tax_col.aggregate(pipe), None)
+        row = next(_aggregate_hinted(tax_col, pipe, _TAX_OUT_IDX), None)
         return _safe_float(row["total"]) if row else 0.0
     except Exception:
         return 0.0
@@ -119,17 +181,76 @@ def _sum_bdc_out(bank_oid: ObjectId) -> float:
     """Sum of BDC bank payments (sum bank_paid_history.amount where bank_id==bank_oid)."""
     try:
         pipe = [
-            {"$match": {"bank_paid_history": {"$exists": True, "$ne": []}}},
+            # leading $match on the multikey path narrows to this bank's docs via the index
+            {"$match": {"bank_paid_history.bank_id": bank_oid}},
             {"$unwind": "$bank_paid_history"},
             {"$match": {"bank_paid_history.bank_id": bank_oid}},
             {"$group": {"_id": None, "total": {"$sum": "$bank_paid_history.amount"}}},
         ]
-        row = next(sbdc_col.aggregate(pipe), None)
+        row = next(_aggregate_hinted(sbdc_col, pipe, _SBDC_BANK_IDX), None)
         return _safe_float(row["total"]) if row else 0.0
     except Exception:
         return 0.0
 
 
+def _live_metrics(bank_name: str, last4: str, bank_oid: ObjectId) -> Dict[str, float]:
+    """
+    Inflow, P-Tax and BDC totals for one bank account. The three aggregations
+    hit different collections, so they run side by side: one round trip of
+    wall-clock latency instead of three in series.
+    """
+    key = (bank_name, last4, bank_oid)
+    now = monotonic()
+    hit = _metrics_cache.get(key)
+    if hit and now - hit[0] < _METRICS_TTL:
+        return hit[1]
+
+    f_in   = _METRICS_POOL.submit(_sum_confirmed_in, bank_name, last4)
+    f_ptax = _METRICS_POOL.submit(_sum_ptax_out, bank_oid)
+    f_bdc  = _METRICS_POOL.submit(_sum_bdc_out, bank_oid)
+    metrics = {
+        "total_in": f_in.result(),
+        "ptax_out": f_ptax.result(),
+        "bdc_out":  f_bdc.result(),
+    }
+
+    if len(_metrics_cache) >= 512:
+        _metrics_cache.clear()
+    _metrics_cache[key] = (now, metrics)
+    return metrics
+
+
+def _drop_metrics(bank_oid: ObjectId) -> None:
+    """Forget cached live metrics for one account (after a write touching it)."""
+    for key in [k for k in _metrics_cache if k[2] == bank_oid]:
+        _metrics_cache.pop(key, None)
+
+
+def _accounts_for_select() -> List[Dict[str, Any]]:
+    """Account selector entries, reused for _SELECT_TTL seconds."""
+    hit = _select_cache.get("accounts")
+    now = monotonic()
+    if hit and now - hit[0] < _SELECT_TTL:
+        return hit[1]
+
+    accounts_for_select: List[Dict[str, Any]] = []
+    cur = bank_accounts_col.find(
+        {},
+        {"bank_name": 1, "account_name": 1, "account_no": 1, "account_number": 1},
+    )
+    for a in cur:
+        acc_no = a.get("account_no") or a.get("account_number") or ""
+        accounts_for_select.append({
+            "id": str(a.get("_id")),
+            "bank_name": a.get("bank_name", ""),
+            "account_name": a.get("account_name", ""),
+            "account_no": acc_no,
+        })
+
+    _select_cache["accounts"] = (now, accounts_for_select)
+    return accounts_for_select
+
+
 # --------------------------------------------------------------------
 # Index helper: /bank-recon → redirect to first account
 # --------------------------------------------------------------------
@@ -178,9 +299,10 @@ def view(account_id):
     last4 = _last4(raw_acc_no)
 
     opening = _safe_float(acc_doc.get("opening_balance"))
-    total_in = _sum_confirmed_in(bank_name, last4)
-    ptax_out = _sum_ptax_out(oid)
-    bdc_out  = _sum_bdc_out(oid)
+    metrics  = _live_metrics(bank_name, last4, oid)
+    total_in = metrics["total_in"]
+    ptax_out = metrics["ptax_out"]
+    bdc_out  = metrics["bdc_out"]
     total_out = ptax_out + bdc_out
     live_balance = opening + total_in - total_out
 
@@ -194,16 +316,7 @@ def view(account_id):
     }
 
     # All accounts to populate the select dropdown
-    accounts_all = list(bank_accounts_col.find({}))
-    accounts_for_select: List[Dict[str, Any]] = []
-    for a in accounts_all:
-        acc_no = a.get("account_no") or a.get("account_number") or ""
-        accounts_for_select.append({
-            "id": str(a.get("_id")),
-            "bank_name": a.get("bank_name", ""),
-            "account_name": a.get("account_name", ""),
-            "account_no": acc_no,
-        })
+    accounts_for_select = _accounts_for_select()
 
     selected_account = {
         "id": str(acc_doc.get("_id")),
@@ -226,17 +339,42 @@ def view(account_id):
         q["date"] = date_filter
 
     # --- Bank statement lines ---
-    all_lines = list(bank_lines_col.find(q))
+    # Totals over every line in the period in one $group pass.
+    amount_expr = {"$convert": {"input": "$amount", "to": "double", "onError": 0.0, "onNull": 0.0}}
+    is_credit = {"$eq": [{"$toLower": {"$ifNull": ["$direction", "debit"]}}, "credit"]}
+    totals_group: Dict[str, Any] = {
+        "_id": None,
+        # Simplified rule: credits = +, debits = -; $sum on doubles is compensated
+        "balance": {"$sum": {"$cond": [is_credit, amount_expr, {"$multiply": [-1, amount_expr]}]}},
+        "matched": {"$sum": {"$cond": ["$matched", 1, 0]}},
+        "total":   {"$sum": 1},
+    }
+    if not (from_date or to_date):
+        # Date span for the period label, tracked in the same pass as the sums
+        date_or_null = {"$cond": [{"$eq": [{"$type": "$date"}, "date"]}, "$date", None]}
+        totals_group["min_d"] = {"$min": date_or_null}
+        totals_group["max_d"] = {"$max": date_or_null}
+
+    totals: Dict[str, Any] = next(bank_lines_col.aggregate([
+        {"$match": q},
+        {"$group": totals_group},
+    ]), {})
+
+    # The rows shown: one keyset page off the account/date index, newest first
+    after = parse_after(request.args.get("after"))
+    page_q: Dict[str, Any] = q
+    if after:
+        page_q = {"$and": [q, keyset_after("date", after)]}
+    page = list(
+        bank_lines_col.find(page_q, {"date": 1, "description": 1, "amount": 1, "direction": 1, "matched": 1})
+        .sort([("date", -1), ("_id", -1)])
+        .limit(_BANK_LINES_SHOWN + 1)  # one extra row tells us an older page exists
+    )
+    has_older = len(page) > _BANK_LINES_SHOWN
+    page = page[:_BANK_LINES_SHOWN]
 
     bank_entries: List[Dict[str, Any]] = []
-    statement_balance = 0.0
-
-    for ln in all_lines:
-        amt = _safe_float(ln.get("amount"))
-        direction = ln.get("direction", "debit")
-        signed = _signed_amount(amt, direction)
-        statement_balance += signed
-
+    for ln in page:
         dt = ln.get("date")
         if isinstance(dt, datetime):
             dt_str = dt.strftime("%Y-%m-%d")
@@ -247,18 +385,33 @@ def view(account_id):
             "id": str(ln.get("_id")),
             "date": dt_str,
             "description": ln.get("description", ""),
-            "amount": amt,
+            "amount": _safe_float(ln.get("amount")),
             "matched": bool(ln.get("matched", False)),
         })
 
-    bank_total    = len(bank_entries)
-    bank_matched  = sum(1 for b in bank_entries if b["matched"])
+    statement_balance = _safe_float(totals.get("balance"))
+
+    bank_total    = int(totals.get("total") or 0)
+    bank_matched  = int(totals.get("matched") or 0)
     bank_counts   = {
         "total": bank_total,
         "matched": bank_matched,
         "unmatched": bank_total - bank_matched,
     }
 
+    # Shown when the table holds fewer lines than the period has
+    args = request.args.to_dict(flat=True)
+    args.pop("after", None)
+    older_token = after_token(page[-1], "date") if has_older and page else None
+    bank_page = {
+        "shown": len(bank_entries),
+        "total": bank_total,
+        "truncated": bool(after) or has_older,
+        "newest_url": url_for("bank_recon.view", account_id=account_id, **args) if after else None,
+        "older_url": (url_for("bank_recon.view", account_id=account_id, after=older_token, **args)
+                      if older_token else None),
+    }
+
     # --- GL side (placeholder: empty for now) ---
     gl_entries: List[Dict[str, Any]] = []
     gl_counts = {"total": 0, "matched": 0, "unmatched": 0}
@@ -275,15 +428,10 @@ def view(account_id):
         ftxt = from_date.strftime("%d %b %Y") if from_date else "Start"
         ttxt = to_date.strftime("%d %b %Y") if to_date else "Today"
         statement_period = f"{ftxt} – {ttxt}"
-    elif all_lines:
-        dates = [
-            ln.get("date") for ln in all_lines
-            if isinstance(ln.get("date"), datetime)
-        ]
-        if dates:
-            ftxt = min(dates).strftime("%d %b %Y")
-            ttxt = max(dates).strftime("%d %b %Y")
-            statement_period = f"{ftxt} – {ttxt}"
+    elif isinstance(totals.get("min_d"), datetime):
+        ftxt = totals["min_d"].strftime("%d %b %Y")
+        ttxt = totals["max_d"].strftime("%d %b %Y")
+        statement_period = f"{ftxt} – {ttxt}"
 
     export_url = url_for("bank_recon.export_excel", account_id=account_id)
     today      = date.today().isoformat()
@@ -300,6 +448,7 @@ def view(account_id):
         bank_entries=bank_entries,
         gl_counts=gl_counts,
         bank_counts=bank_counts,
+        bank_page=bank_page,
         export_url=export_url,
         statement_period=statement_period,
         today=today,
@@ -328,18 +477,17 @@ def import_statement(account_id):
     filename = f.filename or ""
     ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
 
-    rows = []
-
-    if ext == "csv":
-        text = f.stream.read().decode("utf-8", errors="ignore")
-        reader = csv.DictReader(io.StringIO(text))
-        for r in reader:
-            rows.append(r)
-    else:
+    if ext != "csv":
         # For now only CSV; you can extend to XLSX later.
         return redirect(url_for("bank_recon.view", account_id=account_id))
 
-    for r in rows:
+    # Decode and parse the upload as it is read; no full-text copy or row list
+    reader = csv.DictReader(io.TextIOWrapper(f.stream, encoding="utf-8", errors="ignore", newline=""))
+
+    now = datetime.utcnow()  # one timestamp for the whole import
+    docs: List[Dict[str, Any]] = []
+
+    for r in reader:
         desc = (r.get("description") or r.get("Details") or "").strip()
 
         # Amount logic: either single column or debit/credit pair
@@ -361,27 +509,23 @@ def import_statement(account_id):
                 direction = "debit"
 
         dt_raw = r.get("date") or r.get("Date")
-        dt = None
-        if dt_raw:
-            for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y"):
-                try:
-                    dt = datetime.strptime(dt_raw, fmt)
-                    break
-                except Exception:
-                    continue
-
-        doc = {
+        dt = _parse_statement_date(dt_raw.strip()) if dt_raw else None
+
+        docs.append({
             "account_id": oid,
-            "date": dt or datetime.utcnow(),
+            "date": dt or now,
             "description": desc,
             "amount": amt,
             "direction": direction,   # debit / credit
             "matched": False,
-            "created_at": datetime.utcnow(),
+            "created_at": now,
             "source": "import",
-        }
-        bank_lines_col.insert_one(doc)
+        })
 
+    if docs:
+        bank_lines_col.insert_many(docs, ordered=False)
+
+    _drop_metrics(oid)
     return redirect(url_for("bank_recon.view", account_id=account_id))
 
 
@@ -394,7 +538,7 @@ def add_manual_entry(account_id):
     try:
         oid = ObjectId(account_id)
     except Exception:
-        return jsonify(ok=False, message="Invalid account id."), 400
+        return _json(ok=False, message="Invalid account id."), 400
 
     date_str = request.form.get("date") or ""
     try:
@@ -416,7 +560,8 @@ def add_manual_entry(account_id):
     }
 
     bank_lines_col.insert_one(doc)
-    return jsonify(ok=True)
+    _drop_metrics(oid)
+    return _json(ok=True)
 
 
 @bank_recon_bp.get("/bank-recon/<account_id>/export")
@@ -429,29 +574,36 @@ def export_excel(account_id):
     except Exception:
         return "Invalid account id", 404
 
-    lines = list(bank_lines_col.find({"account_id": oid}))
-
-    out = io.StringIO()
-    w = csv.writer(out)
-
-    w.writerow(["Date", "Description", "Amount", "Direction", "Matched", "Source"])
-
-    for ln in lines:
-        dt = ln.get("date")
-        if isinstance(dt, datetime):
-            dt = dt.strftime("%Y-%m-%d")
-
-        w.writerow([
-            dt or "",
-            ln.get("description", ""),
-            f"{_safe_float(ln.get('amount')):0.2f}",
-            ln.get("direction", ""),
-            "Yes" if ln.get("matched") else "No",
-            ln.get("source", ""),
-        ])
+    def gen():
+        out = io.StringIO()
+        w = csv.writer(out)
+
+        w.writerow(["Date", "Description", "Amount", "Direction", "Matched", "Source"])
+        yield out.getvalue()
+
+        cur = bank_lines_col.find(
+            {"account_id": oid},
+            {"date": 1, "description": 1, "amount": 1, "direction": 1, "matched": 1, "source": 1},
+        ).batch_size(1000)
+        for ln in cur:
+            dt = ln.get("date")
+            if isinstance(dt, datetime):
+                dt = dt.strftime("%Y-%m-%d")
+
+            out.seek(0)
+            out.truncate()
+            w.writerow([
+                dt or "",
+                ln.get("description", ""),
+                f"{_safe_float(ln.get('amount')):0.2f}",
+                ln.get("direction", ""),
+                "Yes" if ln.get("matched") else "No",
+                ln.get("source", ""),
+            ])
+            yield out.getvalue()
 
     return Response(
-        out.getvalue(),
+        stream_with_context(gen()),
         mimetype="text/csv",
         headers={"Content-Disposition": 'attachment; filename="bank_reconciliation.csv"'},
     )
@@ -467,11 +619,12 @@ def finalize(account_id):
     try:
         oid = ObjectId(account_id)
     except Exception:
-        return jsonify(ok=False, message="Invalid account id."), 400
+        return _json(ok=False, message="Invalid account id."), 400
 
     bank_accounts_col.update_one(
         {"_id": oid},
         {"$set": {"last_reconciled": datetime.utcnow()}}
     )
+    _drop_metrics(oid)
 
-    return jsonify(ok=True)
+    return _json(ok=True)
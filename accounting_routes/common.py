@@ -0,0 +1,143 @@
+# accounting_routes/common.py
+"""Helpers shared by the accounting blueprints."""
+from __future__ import annotations
+from datetime import datetime
+from functools import lru_cache
+from time import monotonic
+from typing import Any, Callable, Dict, Tuple
+import logging, re
+
+import bson
+from bson import ObjectId
+from db import db
+
+migrations_col = db["migrations"]  # one marker doc per data migration that has completed
+counters_col   = db["counters"]    # {_id: <sequence name>, seq: <last number issued>}
+
+log = logging.getLogger(__name__)
+
+_COUNT_TTL = 30  # seconds a filtered count is reused
+_count_cache: dict = {}
+
+
+def run_once(name: str, fn: Callable[[], Any]) -> None:
+    """
+    Run the data migration `fn` once per database. It is skipped (one _id lookup)
+    once its marker exists; the marker is only written after `fn` succeeds, so a
+    failure is logged and retried on the next start rather than swallowed.
+    """
+    try:
+        if migrations_col.find_one({"_id": name}, {"_id": 1}):
+            return
+        fn()
+        migrations_col.update_one(
+            {"_id": name},
+            {"$setOnInsert": {"done_at": datetime.utcnow()}},
+            upsert=True,
+        )
+    except Exception:
+        log.exception("migration %r failed; it will be retried on the next start", name)
+
+
+def seed_counter(key: str, col, field: str, prefix: str) -> bool:
+    """
+    Start counters[key] at the highest <prefix><digits> number already in
+    col.<field>. $max never moves a counter backwards, so running this again
+    (or from several workers at once) is harmless. Returns False (logged) on failure.
+    """
+    n = len(prefix)
+    try:
+        row = next(col.aggregate([
+            {"$match": {field: {"$regex": "^" + re.escape(prefix) + r"\d+$"}}},
+            {"$group": {"_id": None, "n": {"$max": {"$toLong": {"$substrCP": [
+                f"${field}", n, {"$subtract": [{"$strLenCP": f"${field}"}, n]},
+            ]}}}}},
+        ]), None)
+        counters_col.update_one(
+            {"_id": key},
+            {"$max": {"seq": int(row["n"]) if row else 0}},
+            upsert=True,
+        )
+        return True
+    except Exception:
+        log.exception("could not seed counter %r", key)
+        return False
+
+
+@lru_cache(maxsize=256)
+def prefix_rx(s: str) -> tuple:
+    """
+    Anchored, case-sensitive prefix patterns for a code / number search term
+    (as typed + upper-cased). Both can be bounded by a plain btree index, unlike
+    an unanchored or case-insensitive regex. Compiled once per term.
+    """
+    return tuple(re.compile("^" + re.escape(v)) for v in dict.fromkeys((s, s.upper())))
+
+
+# ---------- keyset pagination over (<date field> desc, _id desc) ----------
+def parse_after(v: str | None) -> Tuple[datetime | None, ObjectId] | None:
+    """Parse an <iso>,<oid> keyset token into (datetime, ObjectId) or None; an empty date means undated."""
+    if not v or "," not in v:
+        return None
+    dt_s, _, oid_s = v.rpartition(",")
+    try:
+        return (datetime.fromisoformat(dt_s) if dt_s else None), ObjectId(oid_s)
+    except Exception:
+        return None
+
+
+def after_token(d: Dict[str, Any], field: str) -> str:
+    """Keyset token for a row (its sort date, blank when undated, and _id)."""
+    dt_v = d.get(field)
+    return f"{dt_v.isoformat() if isinstance(dt_v, datetime) else ''},{d['_id']}"
+
+
+def keyset_after(field: str, after: Tuple[datetime | None, ObjectId]) -> Dict[str, Any]:
+    """
+    Filter that seeks past the previous page's last row. Rows without a date
+    sort after every dated one (descending), so they stay reachable too.
+    """
+    last_dt, last_id = after
+    if last_dt is None:
+        return {field: None, "_id": {"$lt": last_id}}
+    return {"$or": [
+        {field: {"$lt": last_dt}},
+        {field: last_dt, "_id": {"$lt": last_id}},
+        {field: None},
+    ]}
+
+
+def keyset_before(field: str, before: Tuple[datetime | None, ObjectId]) -> Dict[str, Any]:
+    """Mirror of keyset_after: rows ahead of a page's first row (read them in ascending order)."""
+    first_dt, first_id = before
+    if first_dt is None:
+        return {"$or": [{field: {"$ne": None}}, {field: None, "_id": {"$gt": first_id}}]}
+    return {"$or": [
+        {field: {"$gt": first_dt}},
+        {field: first_dt, "_id": {"$gt": first_id}},
+    ]}
+
+
+# ---------- counts ----------
+def cached_count(collection, query: dict) -> int:
+    """Document count: metadata estimate when unfiltered, short-TTL cache otherwise."""
+    if not query:
+        return collection.estimated_document_count()
+
+    key = (collection.name, bson.encode(query))
+    now = monotonic()
+    hit = _count_cache.get(key)
+    if hit and now - hit[0] < _COUNT_TTL:
+        return hit[1]
+
+    total = collection.count_documents(query)
+    if len(_count_cache) >= 256:
+        _count_cache.clear()
+    _count_cache[key] = (now, total)
+    return total
+
+
+def drop_counts(collection) -> None:
+    """Forget cached counts for one collection (after a write to it)."""
+    for key in [k for k in _count_cache if k[0] == collection.name]:
+        _count_cache.pop(key, None)
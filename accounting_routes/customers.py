@@ -1,59 +1,105 @@
 from __future__ import annotations
-from flask import Blueprint, render_template, request, url_for, Response, jsonify
+from flask import Blueprint, render_template, request, url_for, Response, stream_with_context
 from datetime import datetime
 import io, csv, math, re
+from urllib.parse import urlencode
+
+import msgspec
+from pymongo import ReturnDocument
 from db import db
+from accounting_routes.common import prefix_rx, seed_counter
 
 customers_bp = Blueprint("customers", __name__, template_folder="../templates")
 
 customers_col = db["customers"]
+counters_col  = db["counters"]
+
+_CUSTOMER_SEQ = "customer_code"  # counters _id holding the last issued CUST-#### number
+_CUSTOMER_CODE_RX = re.compile(r"^CUST-(\d+)$")
+
+# Fields read by the listing template / CSV export
+_CUSTOMER_PROJECTION = {
+    "code": 1,
+    "name": 1,
+    "phone": 1,
+    "email": 1,
+    "status": 1,
+    "balance": 1,
+    "bucket": 1,
+    "last_invoice": 1,
+    "last_payment": 1,
+}
+
+
+def _ensure_indexes() -> None:
+    try:
+        # Matches the listing sort so a page is an index walk + limit
+        customers_col.create_index([("name", 1), ("_id", 1)])
+        # Backs ?q= search; a collection can only carry one text index
+        customers_col.create_index(
+            [("name", "text"), ("code", "text"), ("phone", "text"), ("email", "text")],
+            name="customers_text",
+        )
+    except Exception:
+        pass
+    # $text inside $or needs the code branch indexed too, so fall back to a
+    # plain index if pre-existing duplicate codes block the unique one
+    try:
+        customers_col.create_index([("code", 1)], unique=True)
+    except Exception:
+        try:
+            customers_col.create_index([("code", 1)])
+        except Exception:
+            pass
+
+
+_ensure_indexes()
+seed_counter(_CUSTOMER_SEQ, customers_col, "code", "CUST-")
+
+
+def _json(**kw) -> Response:
+    """JSON response encoded by msgspec's C encoder (stands in for flask.jsonify)."""
+    return Response(msgspec.json.encode(kw), mimetype="application/json")
 
 
-def _paginate_url(endpoint: str, page: int, per: int) -> str:
-    args = request.args.to_dict()
+def _safe_int(v, default: int) -> int:
+    """Query-string int, falling back to `default` on blanks / junk instead of a 500."""
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return default
+
+
+def _paginate_url(base: str, args: dict, page: int, per: int) -> str:
+    """Listing URL built from a per-request base path + args snapshot (no url_for per link)."""
     args["page"] = str(page)
     args["per"]  = str(per)
-    return url_for(endpoint, **args)
+    return f"{base}?{urlencode(args)}"
 
 
 def _next_customer_code() -> str:
     """
-    Generate next customer code like CUST-0001, CUST-0002, ...
+    Preview the next customer code (CUST-0001, CUST-0002, ...) for the form.
+    Read-only: the code is only taken by _allocate_customer_code().
     """
-    last = customers_col.find_one(
-        {"code": {"$regex": r"^CUST-\d+$"}},
-        sort=[("created_at", -1), ("_id", -1)],
-    )
-    if not last:
-        return "CUST-0001"
-    m = re.search(r"(\d+)$", last.get("code", ""))
-    if not m:
-        return "CUST-0001"
-    num = int(m.group(1)) + 1
-    return f"CUST-{num:04d}"
+    doc = counters_col.find_one({"_id": _CUSTOMER_SEQ}) or {}
+    return f"CUST-{int(doc.get('seq', 0)) + 1:04d}"
 
 
-@customers_bp.get("/customers")
-def customers():
-    qtxt   = (request.args.get("q") or "").strip()
-    status = (request.args.get("status") or "").strip().lower()
-    page   = max(1, int(request.args.get("page", 1)))
-    per    = min(100, max(12, int(request.args.get("per", 12))))
-    export = request.args.get("export") == "1"
-
-    q: dict = {}
-    if qtxt:
-        # search code/name/phone/email
-        rx = re.compile(re.escape(qtxt), re.IGNORECASE)
-        q["$or"] = [{"code": rx}, {"name": rx}, {"phone": rx}, {"email": rx}]
-    if status in ("active", "inactive"):
-        q["status"] = status
+def _allocate_customer_code() -> str:
+    """Atomically take the next customer code from the counters document."""
+    doc = counters_col.find_one_and_update(
+        {"_id": _CUSTOMER_SEQ},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return f"CUST-{doc['seq']:04d}"
 
-    cur = customers_col.find(q).sort([("name", 1), ("_id", 1)])
-    docs = list(cur)
 
-    # Export
-    if export and docs:
+def _export_customers_csv(q: dict, sort: list) -> Response:
+    """Stream the whole filter as CSV, one cursor batch at a time."""
+    def gen():
         out = io.StringIO()
         w   = csv.writer(out)
         w.writerow([
@@ -67,43 +113,55 @@ def customers():
             "Last Invoice",
             "Last Payment",
         ])
-        for d in docs:
+        yield out.getvalue()
+
+        for d in customers_col.find(q, _CUSTOMER_PROJECTION).sort(sort).batch_size(1000):
+            out.seek(0)
+            out.truncate()
             w.writerow([
                 d.get("code", ""),
                 d.get("name", ""),
                 d.get("phone", ""),
                 d.get("email", ""),
                 d.get("status", ""),
-                f'{float(d.get("balance", 0)):0.2f}',
+                f'{float(d.get("balance") or 0):0.2f}',
                 d.get("bucket", ""),
                 d.get("last_invoice", ""),
                 d.get("last_payment", ""),
             ])
-        return Response(
-            out.getvalue(),
-            mimetype="text/csv",
-            headers={"Content-Disposition": 'attachment; filename="customers.csv"'},
-        )
+            yield out.getvalue()
+
+    return Response(
+        stream_with_context(gen()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="customers.csv"'},
+    )
 
-    total = len(docs)
+
+def _render_customers_page(q: dict, sort: list, page: int, per: int) -> str:
+    """Listing page: only the requested page crosses the wire."""
+    total = customers_col.count_documents(q)
     pages = max(1, math.ceil(total / per))
     page  = max(1, min(page, pages))
     start = (page - 1) * per
-    end   = start + per
+    docs  = customers_col.find(q, _CUSTOMER_PROJECTION).sort(sort).skip(start).limit(per) if total else []
+
+    base = url_for("customers.customers")
+    args = request.args.to_dict(flat=True)
 
     pager = {
       "total": total, "page": page, "pages": pages,
-      "prev_url": _paginate_url("customers.customers", page-1, per) if page > 1 else None,
-      "next_url": _paginate_url("customers.customers", page+1, per) if page < pages else None,
+      "prev_url": _paginate_url(base, args, page-1, per) if page > 1 else None,
+      "next_url": _paginate_url(base, args, page+1, per) if page < pages else None,
     }
 
-    export_args = request.args.to_dict(flat=True)
+    export_args = dict(args)
     export_args["export"] = "1"
-    export_url  = url_for("customers.customers", **export_args)
+    export_url  = f"{base}?{urlencode(export_args)}"
 
     # map to simple rows for template
     rows = []
-    for d in docs[start:end]:
+    for d in docs:
         rows.append({
           "code": d.get("code",""),
           "name": d.get("name",""),
@@ -127,6 +185,31 @@ def customers():
     )
 
 
+@customers_bp.get("/customers")
+def customers():
+    qtxt   = (request.args.get("q") or "").strip()
+    status = (request.args.get("status") or "").strip().lower()
+    page   = max(1, _safe_int(request.args.get("page"), 1))
+    per    = min(100, max(12, _safe_int(request.args.get("per"), 12)))
+    export = request.args.get("export") == "1"
+
+    q: dict = {}
+    if qtxt:
+        # Words in code/name/phone/email via customers_text, or a code prefix
+        q["$or"] = [
+            {"$text": {"$search": qtxt}},
+            {"code": {"$in": prefix_rx(qtxt)}},
+        ]
+    if status in ("active", "inactive"):
+        q["status"] = status
+
+    sort = [("name", 1), ("_id", 1)]
+
+    if export:
+        return _export_customers_csv(q, sort)
+    return _render_customers_page(q, sort, page, per)
+
+
 @customers_bp.post("/customers/quick")
 def quick_create():
     def _q(x: str | None) -> str:
@@ -139,14 +222,18 @@ def quick_create():
     status = (_q(request.form.get("status")) or "active").lower()
 
     if not name:
-        return jsonify(ok=False, message="Name is required."), 400
+        return _json(ok=False, message="Name is required."), 400
 
-    # Auto-generate code if not provided
+    # Auto-generate code if not provided (only then is a number drawn)
     if not code:
-        code = _next_customer_code()
-
-    if customers_col.find_one({"code": code}):
-        return jsonify(ok=False, message="Code already exists."), 409
+        code = _allocate_customer_code()
+    else:
+        if customers_col.find_one({"code": code}):
+            return _json(ok=False, message="Code already exists."), 409
+        m = _CUSTOMER_CODE_RX.match(code)
+        if m:
+            # keep the counter ahead of hand-entered CUST-#### codes
+            counters_col.update_one({"_id": _CUSTOMER_SEQ}, {"$max": {"seq": int(m.group(1))}}, upsert=True)
 
     now = datetime.utcnow()
     customers_col.insert_one({
@@ -160,4 +247,4 @@ def quick_create():
         "created_at": now,
         "updated_at": now,
     })
-    return jsonify(ok=True, code=code)
+    return _json(ok=True, code=code)
@@ -5,7 +5,11 @@ from flask import Blueprint, render_template, request
 from datetime import datetime, date, timedelta
 from typing import Any, Dict, List, Tuple
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+import heapq
 
+from pymongo.errors import OperationFailure, PyMongoError
 from db import db
 
 acc_dashboard = Blueprint(
@@ -25,7 +29,36 @@ fixed_assets_col  = db["fixed_assets"]     # fixed asset register
 bank_recon_col    = db["bank_recon_items"] # or "bank_recon" – adjust if needed
 
 
+# The two KPI counts filter on status alone, so this index answers them by itself
+_STATUS_IDX = [("status", 1)]
+
+
+def _ensure_indexes() -> None:
+    try:
+        bank_recon_col.create_index(_STATUS_IDX)
+        journals_col.create_index(_STATUS_IDX)
+    except Exception:
+        pass
+
+
+_ensure_indexes()
+
+# The dashboard's reads are independent, so they overlap on shared workers
+# (PyMongo releases the GIL while waiting on the server)
+_DASHBOARD_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="acc-dashboard")
+
+# The figures come from collections written by other blueprints, so this one just expires
+_DASHBOARD_TTL = 30  # seconds computed figures are reused per (range, day)
+_dashboard_cache: dict = {}
+
+
 def _safe_float(v: Any, default: float = 0.0) -> float:
+    # BSON numbers decode as exactly float / int: skip the checks and float() dispatch
+    c = v.__class__
+    if c is float:
+        return v
+    if c is int:
+        return float(v)
     try:
         if v is None or v == "":
             return default
@@ -34,24 +67,246 @@ def _safe_float(v: Any, default: float = 0.0) -> float:
         return default
 
 
-def _get_doc_date(doc: Dict[str, Any], keys: List[str]) -> datetime | None:
+# ---------- aggregation expression builders ----------
+def _first_set(fields: Tuple[str, ...], default: Any) -> Dict[str, Any] | Any:
     """
-    Try multiple date keys and return the first valid datetime.
-    You can adjust the priority list depending on your schema.
+    Server-side `doc.get(a) or doc.get(b) or ... or default`: a field counts
+    only if it is truthy (null, missing, 0, false and "" all fall through).
     """
-    for k in keys:
-        val = doc.get(k)
-        if isinstance(val, datetime):
-            return val
-        if isinstance(val, date):
-            return datetime.combine(val, datetime.min.time())
-        if isinstance(val, str):
-            try:
-                # Accept ISO or YYYY-MM-DD
-                return datetime.fromisoformat(val)
-            except Exception:
-                continue
-    return None
+    expr: Any = default
+    for f in reversed(fields):
+        v = "$" + f
+        expr = {"$cond": [{"$and": [v, {"$ne": [v, ""]}]}, v, expr]}
+    return expr
+
+
+def _num(expr: Any) -> Dict[str, Any]:
+    """Server-side _safe_float: non-numeric values count as 0."""
+    return {"$convert": {"input": expr, "to": "double", "onError": 0.0, "onNull": 0.0}}
+
+
+def _date_of(keys: Tuple[str, ...]) -> Dict[str, Any]:
+    """First key holding a date or an ISO date string (None if none do)."""
+    expr: Any = None
+    for k in reversed(keys):
+        v = "$" + k
+        parsed = {"$switch": {
+            "branches": [
+                {"case": {"$eq": [{"$type": v}, "date"]}, "then": v},
+                {"case": {"$eq": [{"$type": v}, "string"]},
+                 "then": {"$dateFromString": {"dateString": v, "onError": None, "onNull": None}}},
+            ],
+            "default": None,
+        }}
+        expr = parsed if expr is None else {"$ifNull": [parsed, expr]}
+    return expr
+
+
+def _month_of(field: str) -> Dict[str, Any]:
+    """YYYY-MM chart key computed on the server."""
+    return {"$dateToString": {"format": "%Y-%m", "date": field}}
+
+
+def _recent_facet(ts_field: str) -> List[Dict[str, Any]]:
+    """Newest 20 rows by ts_field; only the overall newest 20 events are shown."""
+    return [
+        {"$match": {ts_field: {"$ne": None}}},
+        {"$sort": {ts_field: -1}},
+        {"$limit": 20},
+    ]
+
+
+# $bucket lower bounds (days past due) -> ar_aging_buckets key; 91+ lands in "default"
+_AR_AGING_BUCKETS = {-(10 ** 9): "current", 1: "1_30", 31: "31_60", 61: "61_90", 91: "90_plus"}
+
+
+def _ar_pipeline(start_dt: datetime, end_dt: datetime, today_dt: datetime) -> List[Dict[str, Any]]:
+    """Outstanding AR, period revenue by month, aging, top customers and recent invoices in one pass."""
+    days = {"$dateDiff": {"startDate": "$due", "endDate": today_dt, "unit": "day"}}
+    return [
+        {"$match": {"status": {"$ne": "cancelled"}}},
+        {"$project": {
+            "_id": 0,
+            "amt": _num(_first_set(("outstanding_amount", "grand_total", "total", "amount"), 0)),
+            "iss": _date_of(("issue_date", "invoice_date", "created_at")),
+            "due": _date_of(("due_date", "invoice_date", "issue_date")),
+            "ev": _date_of(("created_at", "issue_date")),
+            "name": {"$toString": _first_set(("customer_name", "customer_display_name"), "Unknown")},
+        }},
+        {"$match": {"amt": {"$gt": 0}}},
+        {"$facet": {
+            "totals": [{"$group": {"_id": None, "ar_total": {"$sum": "$amt"}}}],
+            "revenue": [
+                {"$match": {"iss": {"$gte": start_dt, "$lte": end_dt}}},
+                {"$group": {"_id": _month_of("$iss"), "total": {"$sum": "$amt"}}},
+            ],
+            # Aging by days past due (not yet due counts as current)
+            "aging": [
+                {"$match": {"due": {"$ne": None}}},
+                {"$bucket": {
+                    "groupBy": days,
+                    "boundaries": list(_AR_AGING_BUCKETS),
+                    "default": "90_plus",
+                    "output": {"total": {"$sum": "$amt"}},
+                }},
+            ],
+            "top_customers": [
+                {"$group": {"_id": "$name", "outstanding": {"$sum": "$amt"}}},
+                {"$sort": {"outstanding": -1}},
+                {"$limit": 5},
+            ],
+            "recent": _recent_facet("ev"),
+        }},
+    ]
+
+
+def _ap_pipeline(today_dt: datetime, chart_start: datetime) -> List[Dict[str, Any]]:
+    """Open AP by due bucket, paid bills by month, top suppliers and recent bills in one pass."""
+    days = {"$dateDiff": {"startDate": today_dt, "endDate": "$due", "unit": "day"}}
+    return [
+        {"$match": {"status": {"$ne": "cancelled"}}},
+        {"$project": {
+            "_id": 0,
+            "amt": _num(_first_set(("outstanding_amount", "total", "amount"), 0)),
+            "st": {"$toLower": {"$ifNull": ["$status", ""]}},
+            "due": _date_of(("due_date", "bill_date")),
+            "paid": _num("$paid_amount"),
+            "paid_dt": _date_of(("payment_date", "paid_at", "updated_at")),
+            "ev": _date_of(("created_at", "bill_date")),
+            "name": {"$toString": _first_set(("supplier_name", "vendor_name"), "Unknown")},
+        }},
+        {"$match": {"amt": {"$gt": 0}}},
+        {"$facet": {
+            # Every open bill counts toward ap_total; only dated ones land in a due bucket
+            "open": [
+                {"$match": {"st": {"$in": ["unpaid", "open", "partially_paid", ""]}}},
+                {"$group": {
+                    "_id": {"$switch": {
+                        "branches": [
+                            {"case": {"$eq": ["$due", None]}, "then": "undated"},
+                            {"case": {"$lt": [days, 0]}, "then": "overdue"},
+                            {"case": {"$eq": [days, 0]}, "then": "due_today"},
+                            {"case": {"$lte": [days, 7]}, "then": "next_7"},
+                            {"case": {"$lte": [days, 30]}, "then": "next_30"},
+                        ],
+                        "default": "later",
+                    }},
+                    "total": {"$sum": "$amt"},
+                }},
+            ],
+            "cash_out": [
+                {"$match": {"st": "paid", "paid": {"$gt": 0}, "paid_dt": {"$gte": chart_start}}},
+                {"$group": {"_id": _month_of("$paid_dt"), "total": {"$sum": "$paid"}}},
+            ],
+            "top_suppliers": [
+                {"$group": {"_id": "$name", "outstanding": {"$sum": "$amt"}}},
+                {"$sort": {"outstanding": -1}},
+                {"$limit": 5},
+            ],
+            "recent": _recent_facet("ev"),
+        }},
+    ]
+
+
+def _payments_pipeline(chart_start: datetime) -> List[Dict[str, Any]]:
+    """Customer cash-in by month and the most recent payments in one pass."""
+    return [
+        {"$project": {
+            "_id": 0,
+            "amt": _num(_first_set(("amount", "paid_amount"), 0)),
+            "ts": _date_of(("payment_date", "created_at")),
+        }},
+        {"$match": {"amt": {"$gt": 0}, "ts": {"$ne": None}}},
+        {"$facet": {
+            "by_month": [
+                {"$match": {"ts": {"$gte": chart_start}}},
+                {"$group": {"_id": _month_of("$ts"), "total": {"$sum": "$amt"}}},
+            ],
+            "recent": _recent_facet("ts"),
+        }},
+    ]
+
+
+def _expense_pipeline(start_dt: datetime, end_dt: datetime, chart_start: datetime) -> List[Dict[str, Any]]:
+    """Expenses by month, the selected period's total and recent expenses in one pass."""
+    return [
+        {"$project": {
+            "_id": 0,
+            "amt": _num("$amount"),
+            "dt": _date_of(("date", "expense_date", "created_at")),
+            "label": _first_set(("description",), "Expense recorded"),
+        }},
+        {"$match": {"amt": {"$gt": 0}, "dt": {"$ne": None}}},
+        {"$facet": {
+            "by_month": [
+                {"$match": {"dt": {"$gte": chart_start}}},
+                {"$group": {"_id": _month_of("$dt"), "total": {"$sum": "$amt"}}},
+            ],
+            "period": [
+                {"$match": {"dt": {"$gte": start_dt, "$lte": end_dt}}},
+                {"$group": {"_id": None, "total": {"$sum": "$amt"}}},
+            ],
+            "recent": _recent_facet("dt"),
+        }},
+    ]
+
+
+# ---------- dashboard readers (one per source, run side by side) ----------
+# Readers let PyMongo errors propagate; _result() records the failing source.
+def _read_cash_balance() -> float:
+    # Adjust field names for your schema:
+    # e.g., balance might be "current_balance", "balance", or "available_balance"
+    bal = _num(_first_set(("current_balance", "balance", "available_balance"), 0))
+    row = next(bank_accounts_col.aggregate([
+        {"$group": {"_id": None, "bal": {"$sum": bal}}},
+    ]), {})
+    return _safe_float(row.get("bal"))
+
+
+def _read_ar(start_dt: datetime, end_dt: datetime, today_start: datetime) -> Dict[str, Any]:
+    return next(ar_invoices_col.aggregate(_ar_pipeline(start_dt, end_dt, today_start), allowDiskUse=True), {})
+
+
+def _read_ar_payments(chart_start: datetime) -> Dict[str, Any]:
+    return next(ar_payments_col.aggregate(_payments_pipeline(chart_start), allowDiskUse=True), {})
+
+
+def _read_ap(today_start: datetime, chart_start: datetime) -> Dict[str, Any]:
+    return next(ap_bills_col.aggregate(_ap_pipeline(today_start, chart_start), allowDiskUse=True), {})
+
+
+def _read_expenses(start_dt: datetime, end_dt: datetime, chart_start: datetime) -> Dict[str, Any]:
+    return next(expenses_col.aggregate(_expense_pipeline(start_dt, end_dt, chart_start), allowDiskUse=True), {})
+
+
+def _read_net_book_value() -> float:
+    cost = _num("$cost")
+    acc_dep = _num(_first_set(("accumulated_depreciation", "acc_dep", "depreciation"), 0))
+    row = next(fixed_assets_col.aggregate([
+        # NBV per asset never goes below zero
+        {"$group": {"_id": None, "nbv": {"$sum": {"$max": [{"$subtract": [cost, acc_dep]}, 0.0]}}}},
+    ]), {})
+    return _safe_float(row.get("nbv"))
+
+
+def _count_by_status(col, statuses: List[Any]) -> int:
+    """count_documents pinned to the status index (a count scan, no document fetches)."""
+    filt = {"status": {"$in": statuses}}
+    try:
+        return col.count_documents(filt, hint=_STATUS_IDX)
+    except OperationFailure:
+        # index missing; let the planner choose
+        return col.count_documents(filt)
+
+
+def _count_unreconciled() -> int:
+    # Adjust filter to your schema – example: status != "matched"
+    # (None also matches docs with no status; the index stores those as null)
+    return _count_by_status(bank_recon_col, ["unmatched", "unreconciled", None, ""])
+
+
+def _count_draft_journals() -> int:
+    return _count_by_status(journals_col, ["draft", "pending_review"])
 
 
 def _period_range_from_key(key: str) -> Tuple[datetime, datetime, str]:
@@ -80,9 +335,24 @@ def _period_range_from_key(key: str) -> Tuple[datetime, datetime, str]:
     return start, end, label
 
 
-def _month_key(dt: datetime) -> str:
-    """Return YYYY-MM label used on charts."""
-    return dt.strftime("%Y-%m")
+# What the page shows for a source whose read failed
+_READ_DEFAULTS: Dict[str, Any] = {
+    "cash": 0.0, "ar": {}, "payments": {}, "ap": {}, "expenses": {},
+    "nbv": 0.0, "recon": 0, "journals": 0,
+}
+
+
+def _result(futs: Dict[str, Any], name: str, failed: List[str]) -> Any:
+    """A reader's result, or its default (and a note in failed) if MongoDB errored."""
+    try:
+        return futs[name].result()
+    except PyMongoError:
+        failed.append(name)
+        return _READ_DEFAULTS[name]
+
+
+_MONTH_ABBR = ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+               "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
 
 
 @acc_dashboard.route("/dashboard", methods=["GET"])
@@ -92,6 +362,16 @@ def accounting_dashboard() -> str:
     Aggregates key data from AR, AP, expenses, bank, fixed assets, etc.
     """
     range_key = request.args.get("range", "this_month")
+
+    # Keyed by day too, so "today"-relative aging never spans midnight
+    cache_key = (range_key, date.today().isoformat())
+    hit = _dashboard_cache.get(cache_key)
+    if hit and monotonic() - hit[0] < _DASHBOARD_TTL:
+        return render_template(
+            "accounting/dashboard.html",
+            dashboard_data=hit[1],
+        )
+
     start_dt, end_dt, range_label = _period_range_from_key(range_key)
 
     # ------------- KPIs INIT -------------
@@ -137,239 +417,130 @@ def accounting_dashboard() -> str:
     now = datetime.utcnow()
     today = date.today()
 
+    # ------------- FETCH (all sources at once) -------------
+    today_start = datetime(today.year, today.month, today.day)
+    # First day of the oldest month on the charts; older months are never grouped
+    chart_start = datetime(today.year + (today.month - 6) // 12, (today.month - 6) % 12 + 1, 1)
+    futs = {
+        "cash":     _DASHBOARD_POOL.submit(_read_cash_balance),
+        "ar":       _DASHBOARD_POOL.submit(_read_ar, start_dt, end_dt, today_start),
+        "payments": _DASHBOARD_POOL.submit(_read_ar_payments, chart_start),
+        "ap":       _DASHBOARD_POOL.submit(_read_ap, today_start, chart_start),
+        "expenses": _DASHBOARD_POOL.submit(_read_expenses, start_dt, end_dt, chart_start),
+        "nbv":      _DASHBOARD_POOL.submit(_read_net_book_value),
+        "recon":    _DASHBOARD_POOL.submit(_count_unreconciled),
+        "journals": _DASHBOARD_POOL.submit(_count_draft_journals),
+    }
+    failed: List[str] = []
+
     # ------------- CASH & BANK -------------
-    try:
-        for acc in bank_accounts_col.find({}):
-            # Adjust field names for your schema:
-            # e.g., balance might be "current_balance", "balance", or "available_balance"
-            bal = _safe_float(
-                acc.get("current_balance")
-                or acc.get("balance")
-                or acc.get("available_balance"),
-                0.0,
-            )
-            cash_balance += bal
-    except Exception:
-        pass
+    cash_balance = _result(futs, "cash", failed)
 
     # ------------- AR (INVOICES) -------------
-    try:
-        for inv in ar_invoices_col.find({"status": {"$ne": "cancelled"}}):
-            # ---- Amounts ----
-            # Customize depending on your schema:
-            # total field: "grand_total", "total", "amount"
-            total = _safe_float(
-                inv.get("outstanding_amount")
-                or inv.get("grand_total")
-                or inv.get("total")
-                or inv.get("amount"),
-                0.0,
-            )
-
-            # If you track "amount_paid" and want outstanding = total - paid, adapt here.
-
-            if total <= 0:
-                continue
-
-            # Outstanding AR total
-            ar_total += total
-
-            # Revenue series – invoices IN the selected period
-            issue_dt = _get_doc_date(inv, ["issue_date", "invoice_date", "created_at"])
-            if issue_dt and start_dt <= issue_dt <= end_dt:
-                month_key = _month_key(issue_dt)
-                rev_by_month[month_key] += total
-                net_revenue_period += total
-
-            # Aging – based on due_date (fallback: issue_date)
-            due_dt = _get_doc_date(inv, ["due_date", "invoice_date", "issue_date"])
-            if due_dt:
-                days = (today - due_dt.date()).days
-                if days <= 0:
-                    ar_aging_buckets["current"] += total
-                elif days <= 30:
-                    ar_aging_buckets["1_30"] += total
-                elif days <= 60:
-                    ar_aging_buckets["31_60"] += total
-                elif days <= 90:
-                    ar_aging_buckets["61_90"] += total
-                else:
-                    ar_aging_buckets["90_plus"] += total
-                    ar_overdue_total += total
-
-            # Top customers
-            cust_name = (
-                inv.get("customer_name")
-                or inv.get("customer_display_name")
-                or "Unknown"
-            )
-            customer_outstanding[cust_name] += total
-
-            # Activity
-            ev_created = _get_doc_date(inv, ["created_at", "issue_date"])
-            if ev_created:
-                recent_events.append(
-                    {
-                        "ts": ev_created,
-                        "type": "invoice",
-                        "label": f"Invoice for {cust_name}",
-                        "amount": total,
-                        "link": None,  # you can add url later
-                    }
-                )
-    except Exception:
-        pass
+    ar = _result(futs, "ar", failed)
+
+    ar_total = _safe_float((ar.get("totals") or [{}])[0].get("ar_total"))
+
+    # Revenue series – invoices IN the selected period
+    for r in ar.get("revenue") or []:
+        rev_by_month[r["_id"]] += r["total"]
+        net_revenue_period += r["total"]
+
+    # Aging – based on due_date (fallback: issue_date)
+    for r in ar.get("aging") or []:
+        ar_aging_buckets[_AR_AGING_BUCKETS.get(r["_id"], r["_id"])] += r["total"]
+    ar_overdue_total = ar_aging_buckets["90_plus"]
+
+    # Top customers
+    for r in ar.get("top_customers") or []:
+        customer_outstanding[r["_id"]] += r["outstanding"]
+
+    # Activity
+    for r in ar.get("recent") or []:
+        recent_events.append(
+            {
+                "ts": r["ev"],
+                "type": "invoice",
+                "label": f"Invoice for {r['name']}",
+                "amount": r["amt"],
+                "link": None,  # you can add url later
+            }
+        )
 
     # ------------- AR PAYMENTS (CASH IN) -------------
-    try:
-        for pay in ar_payments_col.find({}):
-            amt = _safe_float(pay.get("amount") or pay.get("paid_amount"), 0.0)
-            if amt <= 0:
-                continue
-
-            pay_dt = _get_doc_date(pay, ["payment_date", "created_at"])
-            if not pay_dt:
-                continue
-
-            month_key = _month_key(pay_dt)
-            cash_in_by_month[month_key] += amt
-
-            if start_dt <= pay_dt <= end_dt:
-                # Revenue-side cash in in selected range, if you want
-                pass
-
-            recent_events.append(
-                {
-                    "ts": pay_dt,
-                    "type": "payment",
-                    "label": "Customer payment received",
-                    "amount": amt,
-                    "link": None,
-                }
-            )
-    except Exception:
-        pass
+    pays = _result(futs, "payments", failed)
+
+    for r in pays.get("by_month") or []:
+        cash_in_by_month[r["_id"]] += r["total"]
+
+    for r in pays.get("recent") or []:
+        recent_events.append(
+            {
+                "ts": r["ts"],
+                "type": "payment",
+                "label": "Customer payment received",
+                "amount": r["amt"],
+                "link": None,
+            }
+        )
 
     # ------------- AP BILLS -------------
-    try:
-        for bill in ap_bills_col.find({"status": {"$ne": "cancelled"}}):
-            total = _safe_float(
-                bill.get("outstanding_amount")
-                or bill.get("total")
-                or bill.get("amount"),
-                0.0,
-            )
-            if total <= 0:
-                continue
-
-            # Outstanding AP total (you may want to only include unpaid / partially paid)
-            status = (bill.get("status") or "").lower()
-            if status in ("unpaid", "open", "partially_paid", ""):
-                ap_total += total
-
-                due_dt = _get_doc_date(bill, ["due_date", "bill_date"])
-                if due_dt:
-                    days_diff = (due_dt.date() - today).days
-                    if days_diff < 0:
-                        ap_due_buckets["overdue"] += total
-                    elif days_diff == 0:
-                        ap_due_buckets["due_today"] += total
-                    elif days_diff <= 7:
-                        ap_due_buckets["next_7"] += total
-                    elif days_diff <= 30:
-                        ap_due_buckets["next_30"] += total
-
-            # Cash out (if paid) – approximate
-            paid_amt = _safe_float(
-                bill.get("paid_amount") if status == "paid" else 0.0, 0.0
-            )
-            if paid_amt > 0:
-                bill_dt = _get_doc_date(bill, ["payment_date", "paid_at", "updated_at"])
-                if bill_dt:
-                    month_key = _month_key(bill_dt)
-                    cash_out_by_month[month_key] += paid_amt
-
-            # Top suppliers
-            supp_name = bill.get("supplier_name") or bill.get("vendor_name") or "Unknown"
-            supplier_outstanding[supp_name] += total
-
-            # Activity
-            ev_created = _get_doc_date(bill, ["created_at", "bill_date"])
-            if ev_created:
-                recent_events.append(
-                    {
-                        "ts": ev_created,
-                        "type": "bill",
-                        "label": f"Bill from {supp_name}",
-                        "amount": total,
-                        "link": None,
-                    }
-                )
-    except Exception:
-        pass
+    ap = _result(futs, "ap", failed)
+
+    # Outstanding AP total (unpaid / open / partially paid) and due buckets
+    for r in ap.get("open") or []:
+        ap_total += r["total"]
+        if r["_id"] in ap_due_buckets:
+            ap_due_buckets[r["_id"]] += r["total"]
+
+    # Cash out (if paid) – approximate
+    for r in ap.get("cash_out") or []:
+        cash_out_by_month[r["_id"]] += r["total"]
+
+    # Top suppliers
+    for r in ap.get("top_suppliers") or []:
+        supplier_outstanding[r["_id"]] += r["outstanding"]
+
+    # Activity
+    for r in ap.get("recent") or []:
+        recent_events.append(
+            {
+                "ts": r["ev"],
+                "type": "bill",
+                "label": f"Bill from {r['name']}",
+                "amount": r["amt"],
+                "link": None,
+            }
+        )
 
     # ------------- EXPENSES (TRACKER) -------------
-    try:
-        for exp in expenses_col.find({}):
-            amt = _safe_float(exp.get("amount"), 0.0)
-            if amt <= 0:
-                continue
-
-            exp_dt = _get_doc_date(exp, ["date", "expense_date", "created_at"])
-            if not exp_dt:
-                continue
-
-            month_key = _month_key(exp_dt)
-            exp_by_month[month_key] += amt
-            cash_out_by_month[month_key] += amt
-
-            if start_dt <= exp_dt <= end_dt:
-                total_expenses_period += amt
-
-            recent_events.append(
-                {
-                    "ts": exp_dt,
-                    "type": "expense",
-                    "label": exp.get("description") or "Expense recorded",
-                    "amount": amt,
-                    "link": None,
-                }
-            )
-    except Exception:
-        pass
+    ex = _result(futs, "expenses", failed)
+
+    for r in ex.get("by_month") or []:
+        exp_by_month[r["_id"]] += r["total"]
+        cash_out_by_month[r["_id"]] += r["total"]
+
+    total_expenses_period = _safe_float((ex.get("period") or [{}])[0].get("total"))
+
+    for r in ex.get("recent") or []:
+        recent_events.append(
+            {
+                "ts": r["dt"],
+                "type": "expense",
+                "label": r["label"],
+                "amount": r["amt"],
+                "link": None,
+            }
+        )
 
     # ------------- FIXED ASSETS (NET BOOK VALUE) -------------
-    net_book_value = 0.0
-    try:
-        for fa in fixed_assets_col.find({}):
-            cost = _safe_float(fa.get("cost"), 0.0)
-            acc_dep = _safe_float(
-                fa.get("accumulated_depreciation")
-                or fa.get("acc_dep")
-                or fa.get("depreciation"),
-                0.0,
-            )
-            nbv = max(cost - acc_dep, 0.0)
-            net_book_value += nbv
-    except Exception:
-        pass
+    net_book_value = _result(futs, "nbv", failed)
 
     # ------------- BANK RECON (UNRECONCILED ITEMS) -------------
-    try:
-        # Adjust filter to your schema – example: status != "matched"
-        unreconciled_count = bank_recon_col.count_documents(
-            {"status": {"$in": ["unmatched", "unreconciled", None, ""]}}
-        )
-    except Exception:
-        unreconciled_count = 0
+    unreconciled_count = _result(futs, "recon", failed)
 
     # ------------- JOURNALS (DRAFTS) -------------
-    try:
-        draft_journals = journals_col.count_documents(
-            {"status": {"$in": ["draft", "pending_review"]}}
-        )
-    except Exception:
-        draft_journals = 0
+    draft_journals = _result(futs, "journals", failed)
 
     # ------------- NET PROFIT (APPROX) -------------
     # Very rough: Revenue (invoices) - Expenses (tracker).
@@ -381,28 +552,20 @@ def accounting_dashboard() -> str:
         ar_overdue_pct = round((ar_overdue_total / ar_total) * 100.0, 1)
 
     # ------------- TOP CUSTOMERS / SUPPLIERS -------------
-    top_customers = sorted(
-        [
-            {"name": name, "outstanding": amt}
-            for name, amt in customer_outstanding.items()
-        ],
-        key=lambda x: x["outstanding"],
-        reverse=True,
-    )[:5]
-
-    top_suppliers = sorted(
-        [
-            {"name": name, "outstanding": amt}
-            for name, amt in supplier_outstanding.items()
-        ],
-        key=lambda x: x["outstanding"],
-        reverse=True,
-    )[:5]
+    # Partial selection (O(N log k)) rather than sorting every entry
+    top_customers = [
+        {"name": name, "outstanding": amt}
+        for name, amt in heapq.nlargest(5, customer_outstanding.items(), key=lambda kv: kv[1])
+    ]
+
+    top_suppliers = [
+        {"name": name, "outstanding": amt}
+        for name, amt in heapq.nlargest(5, supplier_outstanding.items(), key=lambda kv: kv[1])
+    ]
 
     # ------------- RECENT ACTIVITY -------------
-    recent_events_sorted = sorted(
-        recent_events, key=lambda e: e["ts"], reverse=True
-    )[:20]
+    # Up to 20 candidates per source
+    recent_events_sorted = heapq.nlargest(20, recent_events, key=lambda e: e["ts"])
 
     recent_activity = [
         {
@@ -415,27 +578,19 @@ def accounting_dashboard() -> str:
     ]
 
     # ------------- BUILD SERIES (LAST 6 MONTHS) -------------
-    # We force a consistent list of last 6 months (labels)
+    # We force a consistent list of last 6 months (labels), by calendar month
     today_dt = datetime.utcnow()
-    months_labels: List[str] = []
-    for i in range(5, -1, -1):
-        m = today_dt.replace(day=1) - timedelta(days=30 * i)
-        key = _month_key(m)
-        label = m.strftime("%b %Y")
-        months_labels.append(label)
-    # Map from label to key
-    key_by_label = {
-        label: datetime.strptime(label, "%b %Y").strftime("%Y-%m")
-        for label in months_labels
-    }
+    y, m = today_dt.year, today_dt.month
+    months = [(y + (m - 1 - i) // 12, (m - 1 - i) % 12 + 1) for i in range(5, -1, -1)]
+    months_labels: List[str] = [f"{_MONTH_ABBR[mm - 1]} {yy}" for yy, mm in months]
+    month_keys: List[str] = [f"{yy:04d}-{mm:02d}" for yy, mm in months]
 
     revenue_series: List[float] = []
     expense_series: List[float] = []
     cash_in_series: List[float] = []
     cash_out_series: List[float] = []
 
-    for label in months_labels:
-        key = key_by_label[label]
+    for key in month_keys:
         revenue_series.append(round(rev_by_month.get(key, 0.0), 2))
         expense_series.append(round(exp_by_month.get(key, 0.0), 2))
         cash_in_series.append(round(cash_in_by_month.get(key, 0.0), 2))
@@ -470,8 +625,17 @@ def accounting_dashboard() -> str:
         "top_customers": top_customers,
         "top_suppliers": top_suppliers,
         "recent_activity": recent_activity,
+        # Sources shown as zeros because their MongoDB read failed
+        "kpi_error": bool(failed),
+        "failed_sources": failed,
     }
 
+    # Partial figures are not cached, so the next request retries the failed reads
+    if not failed:
+        if len(_dashboard_cache) >= 16:
+            _dashboard_cache.clear()
+        _dashboard_cache[cache_key] = (monotonic(), dashboard_data)
+
     return render_template(
         "accounting/dashboard.html",
         dashboard_data=dashboard_data,
@@ -3,9 +3,11 @@ from __future__ import annotations
 from flask import Blueprint, render_template, request, jsonify
 from datetime import datetime, date, time, timedelta
 from typing import Any, Dict, List
+from time import monotonic
 
 from bson import ObjectId
 from db import db
+from accounting_routes.common import prefix_rx
 
 acc_expenses = Blueprint(
     "acc_expenses",
@@ -17,6 +19,30 @@ expenses_col = db["expenses"]
 expense_categories_col = db["expense_categories"]
 
 
+def _ensure_indexes() -> None:
+    try:
+        # Date-range filter + newest-first sort on the page and list API;
+        # amount rides along so min/max bounds are checked in the index
+        expenses_col.create_index([("date", -1), ("amount", 1)])
+        # Category filter on the list API; also lets distinct("category") walk the index
+        expenses_col.create_index([("category", 1)])
+        # Backs ?search= on the list API: words via expenses_text, and
+        # reference prefixes such as "0012" via the plain index
+        expenses_col.create_index([("reference", 1)])
+        expenses_col.create_index(
+            [("description", "text"), ("reference", "text")],
+            name="expenses_text",
+        )
+    except Exception:
+        pass
+
+
+_ensure_indexes()
+
+_CATEGORIES_TTL = 300  # seconds the category suggestion list is reused
+_categories_cache: dict = {}
+
+
 # ---------- helpers ----------
 
 def _safe_float(v: Any, default: float = 0.0) -> float:
@@ -59,27 +85,62 @@ def _serialize_expense(doc: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def _compute_totals(docs: List[Dict[str, Any]]) -> Dict[str, Any]:
-    total = 0.0
-    cat_map: Dict[str, float] = {}
-    for d in docs:
-        amt = float(d.get("amount", 0.0) or 0.0)
-        total += amt
-        cat = (d.get("category") or "").strip() or "Uncategorized"
-        cat_map[cat] = cat_map.get(cat, 0.0) + amt
-
-    cat_totals = [
-        {"category": k, "total": float(v)}
-        for k, v in sorted(cat_map.items(), key=lambda kv: kv[1], reverse=True)
-    ]
-
+def _query_with_totals(query: Dict[str, Any], limit: int) -> Dict[str, Any]:
+    """
+    Newest `limit` expenses plus count / total / per-category totals over
+    every match, all from one aggregation.
+    """
+    amount = {"$convert": {"input": "$amount", "to": "double", "onError": 0.0, "onNull": 0.0}}
+    category = {"$let": {
+        "vars": {"c": {"$trim": {"input": {"$ifNull": ["$category", ""]}}}},
+        "in": {"$cond": [{"$eq": ["$$c", ""]}, "Uncategorized", "$$c"]},
+    }}
+
+    res = next(expenses_col.aggregate([
+        {"$match": query},
+        # Sorted ahead of $facet so the date index supplies the order
+        {"$sort": {"date": -1}},
+        {"$facet": {
+            "rows": [
+                {"$limit": limit},
+                # Only what _serialize_expense reads
+                {"$project": {"date": 1, "amount": 1, "category": 1, "description": 1, "payment_method": 1}},
+            ],
+            "cats": [
+                {"$group": {"_id": category, "total": {"$sum": amount}}},
+                {"$sort": {"total": -1}},
+            ],
+            "totals": [{"$group": {"_id": None, "count": {"$sum": 1}, "total": {"$sum": amount}}}],
+        }},
+    ]), {})
+
+    totals = (res.get("totals") or [{}])[0]
     return {
-        "count": len(docs),
-        "total_amount": float(total),
-        "category_totals": cat_totals,
+        "docs": res.get("rows") or [],
+        "count": int(totals.get("count") or 0),
+        "total_amount": float(totals.get("total") or 0.0),
+        "category_totals": [
+            {"category": c["_id"], "total": float(c["total"])}
+            for c in res.get("cats") or []
+        ],
     }
 
 
+def _load_categories() -> List[str]:
+    """Sorted category names: the dedicated collection plus any used on expenses."""
+    hit = _categories_cache.get("names")
+    now = monotonic()
+    if hit and now - hit[0] < _CATEGORIES_TTL:
+        return hit[1]
+
+    names = set(expense_categories_col.distinct("name"))
+    names.update(expenses_col.distinct("category"))
+    categories = sorted({n.strip() for n in names if isinstance(n, str) and n.strip()})
+
+    _categories_cache["names"] = (now, categories)
+    return categories
+
+
 def _date_range_for_month(today: date) -> tuple[datetime, datetime]:
     start = today.replace(day=1)
     # end is today end-of-day
@@ -98,13 +159,8 @@ def expenses_page():
         "date": {"$gte": start_dt, "$lte": end_dt}
     }
 
-    docs = list(
-        expenses_col.find(query)
-        .sort("date", -1)
-        .limit(500)
-    )
-
-    totals_info = _compute_totals(docs)
+    totals_info = _query_with_totals(query, 500)
+    docs = totals_info["docs"]
     initial_data = {
         "expenses": [_serialize_expense(d) for d in docs],
         "totals": {
@@ -118,17 +174,7 @@ def expenses_page():
         },
     }
 
-    # distinct categories (from dedicated collection first)
-    cat_docs = list(expense_categories_col.find({}).sort("name", 1))
-    categories = [c.get("name") for c in cat_docs if c.get("name")]
-
-    # also merge categories from existing docs just in case
-    seen = set(categories)
-    for d in docs:
-        cat = (d.get("category") or "").strip()
-        if cat and cat not in seen:
-            seen.add(cat)
-            categories.append(cat)
+    categories = _load_categories()
 
     default_start = start_dt.date().isoformat()
     default_end = today.isoformat()
@@ -175,34 +221,26 @@ def expenses_list():
 
     # Search in description / reference
     if search:
+        # Words via expenses_text, or a literal reference prefix
         query["$or"] = [
-            {"description": {"$regex": search, "$options": "i"}},
-            {"reference": {"$regex": search, "$options": "i"}},
+            {"$text": {"$search": search}},
+            {"reference": {"$in": prefix_rx(search)}},
         ]
 
-    # Amount range handled client-side after serialization for simplicity
-    docs = list(
-        expenses_col.find(query)
-        .sort("date", -1)
-        .limit(1000)
-    )
-
-    # Apply amount filter in Python (since values are float anyway)
+    # Amount range
     min_amt = _safe_float(min_str, None) if min_str else None
     max_amt = _safe_float(max_str, None) if max_str else None
-
-    filtered_docs: List[Dict[str, Any]] = []
-    for d in docs:
-        amt = float(d.get("amount", 0.0) or 0.0)
-        if min_amt is not None and amt < min_amt:
-            continue
-        if max_amt is not None and amt > max_amt:
-            continue
-        filtered_docs.append(d)
-
-    totals_info = _compute_totals(filtered_docs)
+    if min_amt is not None or max_amt is not None:
+        amt_q = query.setdefault("amount", {})
+        if min_amt is not None:
+            amt_q["$gte"] = min_amt
+        if max_amt is not None:
+            amt_q["$lte"] = max_amt
+
+    totals_info = _query_with_totals(query, 1000)
+    docs = totals_info["docs"]
     data = {
-        "expenses": [_serialize_expense(d) for d in filtered_docs],
+        "expenses": [_serialize_expense(d) for d in docs],
         "totals": {
             "count": totals_info["count"],
             "total_amount": totals_info["total_amount"],
@@ -260,11 +298,13 @@ def create_expense():
 
     # upsert category for future suggestions
     if category:
-        expense_categories_col.update_one(
+        cat_res = expense_categories_col.update_one(
             {"name": category},
             {"$setOnInsert": {"name": category, "created_at": now}},
             upsert=True,
         )
+        if cat_res.upserted_id is not None:
+            _categories_cache.clear()  # new suggestion; rebuild on next page load
 
     expense_out = _serialize_expense(doc)
     return jsonify(ok=True, expense=expense_out), 200
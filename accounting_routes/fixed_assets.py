@@ -16,14 +16,89 @@ Routes become:
 
 from flask import (
     Blueprint, render_template, request, redirect,
-    url_for, flash, Response
+    url_for, flash, Response, stream_with_context
 )
 from datetime import datetime, date
+from time import monotonic
+from pymongo import ReturnDocument, UpdateOne
 from db import db
+from accounting_routes.common import prefix_rx, seed_counter
 import csv
 import io
 
+import numpy as np
+
 fixed_assets_col = db["fixed_assets"]
+counters_col = db["counters"]
+
+_ASSET_SEQ = "fixed_asset_id"  # counters _id holding the last issued FA-##### number
+
+_BULK_BATCH = 1000  # depreciation updates per bulk_write round trip
+
+_CATEGORIES_TTL = 60  # seconds the register's category filter list is reused
+_categories_cache = {}
+
+# Status filter options on the register
+_STATUSES = ["Active", "Fully Depreciated", "Disposed"]
+
+def _num(field):
+    """Server-side _safe_float: missing or non-numeric values count as 0."""
+    return {"$convert": {"input": field, "to": "double", "onError": 0.0, "onNull": 0.0}}
+
+
+# Fields read by the register view; amounts and NBV arrive computed by the server
+_REGISTER_PROJECTION = {
+    "asset_id": 1,
+    "name": 1,
+    "category": 1,
+    "method": 1,
+    "useful_life_years": 1,
+    "status": 1,
+    "acquisition_date": 1,
+    "cost": _num("$cost"),
+    "accum_depr": _num("$accum_depr"),
+    "net_book_value": {"$max": [0.0, {"$subtract": [_num("$cost"), _num("$accum_depr")]}]},
+}
+
+# Fields written by the CSV export
+_EXPORT_PROJECTION = {
+    "_id": 0,
+    "asset_id": 1,
+    "name": 1,
+    "category": 1,
+    "acquisition_date": 1,
+    "cost": 1,
+    "accum_depr": 1,
+    "method": 1,
+    "useful_life_years": 1,
+    "status": 1,
+}
+
+
+def _ensure_indexes():
+    try:
+        # Register filters (status, category) then sorts by acquisition date
+        fixed_assets_col.create_index([("status", 1), ("category", 1), ("acquisition_date", -1)])
+        fixed_assets_col.create_index([("acquisition_date", -1)])
+        # distinct("category") on a cache miss walks this instead of the documents
+        fixed_assets_col.create_index([("category", 1)])
+        # Backs ?q= search; a collection can only carry one text index
+        fixed_assets_col.create_index([("name", "text"), ("asset_id", "text")], name="fixed_assets_text")
+    except Exception:
+        pass
+    # Safety net under the counter; fall back to a plain index if legacy
+    # duplicate asset_ids block the unique one
+    try:
+        fixed_assets_col.create_index([("asset_id", 1)], unique=True)
+    except Exception:
+        try:
+            fixed_assets_col.create_index([("asset_id", 1)])
+        except Exception:
+            pass
+
+
+_ensure_indexes()
+seed_counter(_ASSET_SEQ, fixed_assets_col, "asset_id", "FA-")
 
 # NOTE: no url_prefix here – it will be applied in app.py
 fixed_assets_bp = Blueprint(
@@ -83,19 +158,27 @@ def _format_date(d):
 def _auto_asset_id():
     """
     Generate next asset_id like FA-00001.
-    Looks at existing records and increments highest numeric part.
+    Atomically takes the next number from the counters document.
     """
-    last = fixed_assets_col.find_one(
-        {"asset_id": {"$regex": r"^FA-\d+$"}},
-        sort=[("asset_id", -1)]
+    doc = counters_col.find_one_and_update(
+        {"_id": _ASSET_SEQ},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
     )
-    if not last:
-        return "FA-00001"
-    try:
-        num = int(str(last["asset_id"]).split("-")[1])
-    except Exception:
-        num = 0
-    return f"FA-{num + 1:05d}"
+    return f"FA-{doc['seq']:05d}"
+
+
+def _load_categories():
+    """Sorted non-empty asset categories for the register filter."""
+    hit = _categories_cache.get("names")
+    now = monotonic()
+    if hit and now - hit[0] < _CATEGORIES_TTL:
+        return hit[1]
+
+    categories = sorted([c for c in fixed_assets_col.distinct("category") if c])
+    _categories_cache["names"] = (now, categories)
+    return categories
 
 
 def _compute_net_book_value(asset):
@@ -117,17 +200,23 @@ def register():
 
     query = {}
     if q:
+        # Name words via fixed_assets_text, or an asset ID prefix via the asset_id index
         query["$or"] = [
-            {"asset_id": {"$regex": q, "$options": "i"}},
-            {"name": {"$regex": q, "$options": "i"}},
+            {"$text": {"$search": q}},
+            {"asset_id": {"$in": prefix_rx(q)}},
         ]
     if category:
         query["category"] = category
     if status:
         query["status"] = status
 
-    docs = list(
-        fixed_assets_col.find(query).sort("acquisition_date", -1)
+    docs = fixed_assets_col.aggregate(
+        [
+            {"$match": query},
+            {"$sort": {"acquisition_date": -1}},
+            {"$project": _REGISTER_PROJECTION},
+        ],
+        batchSize=500,
     )
 
     assets = []
@@ -140,27 +229,23 @@ def register():
             "method": doc.get("method", "SL"),
             "useful_life_years": doc.get("useful_life_years", 0),
             "status": doc.get("status", "Active"),
+            "cost": doc["cost"],
+            "accum_depr": doc["accum_depr"],
+            "net_book_value": doc["net_book_value"],
         }
 
-        cost = _safe_float(doc, "cost", 0)
-        accum = _safe_float(doc, "accum_depr", 0)
-        asset["cost"] = cost
-        asset["accum_depr"] = accum
-        asset["net_book_value"] = _compute_net_book_value(doc)
-
         acq_date = doc.get("acquisition_date")
         asset["acquisition_date_str"] = _format_date(_parse_date(acq_date))
 
         assets.append(asset)
 
-    categories = sorted([c for c in fixed_assets_col.distinct("category") if c])
-    statuses = ["Active", "Fully Depreciated", "Disposed"]
+    categories = _load_categories()
 
     return render_template(
         "accounting/fixed_assets_register.html",
         assets=assets,
         categories=categories,
-        statuses=statuses,
+        statuses=_STATUSES,
         currency_symbol="GHS ",
     )
 
@@ -171,46 +256,66 @@ def register():
 
 @fixed_assets_bp.route("/export", methods=["GET"])
 def export_assets():
-    docs = list(fixed_assets_col.find().sort("acquisition_date", -1))
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow([
-        "Asset ID",
-        "Name",
-        "Category",
-        "Acquisition Date",
-        "Cost",
-        "Accumulated Depreciation",
-        "Net Book Value",
-        "Method",
-        "Useful Life (Years)",
-        "Status",
-    ])
-
-    for doc in docs:
-        cost = _safe_float(doc, "cost", 0)
-        accum = _safe_float(doc, "accum_depr", 0)
-        nbv = _compute_net_book_value(doc)
-
+    """Stream the register as CSV, one chunk per cursor batch."""
+    def generate():
+        output = io.StringIO()
+        writer = csv.writer(output)
         writer.writerow([
-            doc.get("asset_id", ""),
-            doc.get("name", ""),
-            doc.get("category", ""),
-            _format_date(_parse_date(doc.get("acquisition_date"))),
-            f"{cost:,.2f}",
-            f"{accum:,.2f}",
-            f"{nbv:,.2f}",
-            doc.get("method", "SL"),
-            doc.get("useful_life_years", 0),
-            doc.get("status", "Active"),
+            "Asset ID",
+            "Name",
+            "Category",
+            "Acquisition Date",
+            "Cost",
+            "Accumulated Depreciation",
+            "Net Book Value",
+            "Method",
+            "Useful Life (Years)",
+            "Status",
         ])
+        yield output.getvalue()
+
+        # Rows are formatted per cursor batch and handed to the C writer
+        # in one writerows() call, so each yielded chunk is a full batch.
+        batch = []
+        cur = (
+            fixed_assets_col.find({}, _EXPORT_PROJECTION)
+            .sort("acquisition_date", -1)
+            .batch_size(500)
+        )
+        for doc in cur:
+            cost = _safe_float(doc, "cost", 0)
+            accum = _safe_float(doc, "accum_depr", 0)
+            nbv = _compute_net_book_value(doc)
+
+            batch.append([
+                doc.get("asset_id", ""),
+                doc.get("name", ""),
+                doc.get("category", ""),
+                _format_date(_parse_date(doc.get("acquisition_date"))),
+                f"{cost:,.2f}",
+                f"{accum:,.2f}",
+                f"{nbv:,.2f}",
+                doc.get("method", "SL"),
+                doc.get("useful_life_years", 0),
+                doc.get("status", "Active"),
+            ])
+            if len(batch) >= 500:
+                output.seek(0)
+                output.truncate()
+                writer.writerows(batch)
+                batch.clear()
+                yield output.getvalue()
+
+        if batch:
+            output.seek(0)
+            output.truncate()
+            writer.writerows(batch)
+            yield output.getvalue()
 
-    output.seek(0)
     filename = f"fixed_assets_{date.today().isoformat()}.csv"
 
     return Response(
-        output.getvalue(),
+        stream_with_context(generate()),
         mimetype="text/csv",
         headers={
             "Content-Disposition": f"attachment; filename={filename}"
@@ -237,15 +342,16 @@ def add_asset_form():
         return redirect(url_for("fixed_assets.register"))
 
     asset_id = _auto_asset_id()
+    now = datetime.utcnow()  # one timestamp for every field set below
 
     # 🔧 IMPORTANT: store as datetime.datetime (never datetime.date)
     if acq_date_raw:
         try:
             acquisition_datetime = datetime.strptime(acq_date_raw, "%Y-%m-%d")
         except Exception:
-            acquisition_datetime = datetime.utcnow()
+            acquisition_datetime = now
     else:
-        acquisition_datetime = datetime.utcnow()
+        acquisition_datetime = now
 
     cost = _safe_float({"cost": cost_raw}, "cost", 0)
     try:
@@ -264,11 +370,13 @@ def add_asset_form():
         "accum_depr": 0.0,
         "status": "Active",
         "notes": notes,
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow(),
+        "created_at": now,
+        "updated_at": now,
     }
 
     fixed_assets_col.insert_one(doc)
+    if category and category not in _categories_cache.get("names", (0, ()))[1]:
+        _categories_cache.clear()  # new category; rebuild on next page load
 
     flash(f"Asset {asset_id} created.", "success")
     return redirect(url_for("fixed_assets.register"))
@@ -278,52 +386,59 @@ def add_asset_form():
 # Compute & Post Depreciation
 # -------------------------------------------------------------------
 
-def _monthly_depreciation_amount(doc):
+def _monthly_depreciation(cost, accum, life, is_db):
     """
-    Very simple depreciation logic:
+    Very simple depreciation logic, vectorised over a batch of assets:
       - Straight Line: cost / (useful_life_years * 12)
       - DB: 2 * SL rate * remaining NBV
-    Assumes zero salvage value.
+    Assumes zero salvage value. Assets with no life or no NBV get 0,
+    and no asset is charged more than its NBV.
     """
-    method = (doc.get("method") or "SL").upper()
-    useful_life_years = int(doc.get("useful_life_years") or 0)
-    if useful_life_years <= 0:
-        return 0.0
-
-    cost = _safe_float(doc, "cost", 0)
-    accum = _safe_float(doc, "accum_depr", 0)
     nbv = cost - accum
-    if nbv <= 0:
-        return 0.0
+    ok = (life > 0) & (nbv > 0)
+    safe_life = np.where(life > 0, life, 1)  # keeps the unused lanes finite
+    monthly_rate = (2.0 / safe_life) / 12.0
+    dep = np.where(is_db, nbv * monthly_rate, cost / (safe_life * 12))
+    return np.where(ok, np.minimum(dep, nbv), 0.0)
 
-    months = useful_life_years * 12
 
-    if method == "DB":
-        annual_rate = 2.0 / useful_life_years
-        monthly_rate = annual_rate / 12.0
-        dep = nbv * monthly_rate
-    else:
-        dep = cost / months
-
-    if dep > nbv:
-        dep = nbv
-    return dep
+def _depreciation_totals_pipeline():
+    """
+    Server-side _monthly_depreciation summed over the depreciable
+    assets: one {count, total} document, no assets sent to the app.
+    """
+    def num(field, to="double"):
+        return {"$convert": {"input": field, "to": to, "onError": 0, "onNull": 0}}
+
+    months = {"$multiply": ["$life", 12]}
+    return [
+        {"$match": {"status": {"$in": ["Active", "Fully Depreciated"]}}},
+        {"$project": {
+            "_id": 0,
+            "life": num("$useful_life_years", "int"),
+            "cost": num("$cost"),
+            "nbv": {"$subtract": [num("$cost"), num("$accum_depr")]},
+            "is_db": {"$eq": [{"$toUpper": {"$ifNull": ["$method", ""]}}, "DB"]},
+        }},
+        {"$match": {"life": {"$gt": 0}, "nbv": {"$gt": 0}}},
+        {"$project": {"dep": {"$min": [
+            {"$cond": [
+                "$is_db",
+                {"$multiply": ["$nbv", {"$divide": [2.0, months]}]},  # 2 * SL rate * NBV
+                {"$divide": ["$cost", months]},                     # straight line
+            ]},
+            "$nbv",
+        ]}}},
+        {"$match": {"dep": {"$gt": 0}}},
+        {"$group": {"_id": None, "count": {"$sum": 1}, "total": {"$sum": "$dep"}}},
+    ]
 
 
 @fixed_assets_bp.route("/compute-depreciation", methods=["POST"])
 def compute_depreciation():
-    active = list(
-        fixed_assets_col.find({"status": {"$in": ["Active", "Fully Depreciated"]}})
-    )
-
-    count_eligible = 0
-    total_dep = 0.0
-
-    for doc in active:
-        dep = _monthly_depreciation_amount(doc)
-        if dep > 0:
-            count_eligible += 1
-            total_dep += dep
+    row = next(fixed_assets_col.aggregate(_depreciation_totals_pipeline()), {})
+    count_eligible = row.get("count", 0)
+    total_dep = row.get("total", 0.0)
 
     flash(
         f"Computed depreciation for {count_eligible} asset(s). "
@@ -333,36 +448,54 @@ def compute_depreciation():
     return redirect(url_for("fixed_assets.register"))
 
 
-@fixed_assets_bp.route("/post-depreciation", methods=["POST"])
-def post_depreciation():
-    active = list(
-        fixed_assets_col.find({"status": {"$in": ["Active", "Fully Depreciated"]}})
-    )
+def _post_depreciation_batch(docs, now):
+    """Depreciate one batch of assets in array form and write it back in one bulk_write."""
+    n = len(docs)
+    cost = np.fromiter((_safe_float(d, "cost", 0) for d in docs), float, n)
+    accum = np.fromiter((_safe_float(d, "accum_depr", 0) for d in docs), float, n)
+    life = np.fromiter((int(d.get("useful_life_years") or 0) for d in docs), float, n)
+    is_db = np.fromiter(((d.get("method") or "SL").upper() == "DB" for d in docs), bool, n)
 
-    updated_count = 0
-    for doc in active:
-        dep = _monthly_depreciation_amount(doc)
-        if dep <= 0:
-            continue
-        new_accum = _safe_float(doc, "accum_depr", 0) + dep
-        cost = _safe_float(doc, "cost", 0)
-
-        status = doc.get("status", "Active")
-        if new_accum >= cost:
-            new_accum = cost
-            status = "Fully Depreciated"
-
-        fixed_assets_col.update_one(
-            {"_id": doc["_id"]},
+    dep = _monthly_depreciation(cost, accum, life, is_db)
+    new_accum = accum + dep
+    full = new_accum >= cost
+    new_accum = np.where(full, cost, new_accum)
+
+    ops = [
+        UpdateOne(
+            {"_id": docs[i]["_id"]},
             {
                 "$set": {
-                    "accum_depr": new_accum,
-                    "status": status,
-                    "updated_at": datetime.utcnow(),
+                    "accum_depr": float(new_accum[i]),
+                    "status": "Fully Depreciated" if full[i] else docs[i].get("status", "Active"),
+                    "updated_at": now,
                 }
             },
         )
-        updated_count += 1
+        for i in np.flatnonzero(dep > 0)
+    ]
+    if ops:
+        fixed_assets_col.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+@fixed_assets_bp.route("/post-depreciation", methods=["POST"])
+def post_depreciation():
+    active = fixed_assets_col.find(
+        {"status": {"$in": ["Active", "Fully Depreciated"]}},
+        {"method": 1, "useful_life_years": 1, "cost": 1, "accum_depr": 1, "status": 1},
+    ).batch_size(_BULK_BATCH)
+
+    now = datetime.utcnow()  # one timestamp for the whole posting run
+    updated_count = 0
+    batch = []
+    for doc in active:
+        batch.append(doc)
+        if len(batch) >= _BULK_BATCH:
+            updated_count += _post_depreciation_batch(batch, now)
+            batch.clear()
+    if batch:
+        updated_count += _post_depreciation_batch(batch, now)
 
     flash(f"Posted monthly depreciation for {updated_count} asset(s).", "success")
     return redirect(url_for("fixed_assets.register"))
@@ -4,10 +4,32 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash
 from bson import ObjectId
 import math, datetime as dt
 from db import db
+from accounting_routes.common import after_token, keyset_after, parse_after, run_once
 
 journals_bp = Blueprint("journals", __name__, template_folder="../templates")
 journals_col = db["journals"]
 
+def _ensure_indexes() -> None:
+    try:
+        # Matches the listing sort so a page is an index walk + limit
+        journals_col.create_index([("date", -1), ("_id", -1)])
+    except Exception:
+        pass
+
+_ensure_indexes()
+
+def _backfill_account_lc():
+    """Give older journal lines lines[].account_lc (the ledger matches on that field)."""
+    journals_col.update_many(
+        {"lines": {"$elemMatch": {"account": {"$exists": True}, "account_lc": {"$exists": False}}}},
+        [{"$set": {"lines": {"$map": {"input": "$lines", "as": "l", "in": {"$mergeObjects": [
+            "$$l",
+            {"account_lc": {"$toLower": {"$trim": {"input": {"$ifNull": [{"$toString": "$$l.account"}, ""]}}}}},
+        ]}}}}}],
+    )
+
+run_once("journals.lines_account_lc", _backfill_account_lc)
+
 # ---------- helpers ----------
 def _q(s): 
     return (s or "").strip()
@@ -18,6 +40,20 @@ def _to_float(x):
     except Exception:
         return 0.0
 
+def _num_expr(x):
+    """Server-side _to_float: thousands separators dropped, junk counts as 0."""
+    return {"$convert": {
+        "input": {"$cond": [{"$eq": [{"$type": x}, "string"]},
+                            {"$trim": {"input": {"$replaceAll": {"input": x, "find": ",", "replacement": ""}}}},
+                            x]},
+        "to": "double", "onError": 0.0, "onNull": 0.0,
+    }}
+
+def _lines_total(field: str):
+    """Sum of lines[].<field> for one journal, computed on the server."""
+    return {"$sum": {"$map": {"input": {"$ifNull": ["$lines", []]}, "as": "l",
+                              "in": _num_expr(f"$$l.{field}")}}}
+
 def _as_datetime(d):
     """MongoDB can't store datetime.date; convert to datetime at midnight."""
     if isinstance(d, dt.datetime):
@@ -27,7 +63,8 @@ def _as_datetime(d):
     return None
 
 def _paginate(collection, query: dict, page: int, per: int):
-    total = collection.count_documents(query)
+    # Unfiltered list: the collection metadata count is enough for page numbers
+    total = collection.count_documents(query) if query else collection.estimated_document_count()
     pages = max(1, math.ceil(total / per))
     page = max(1, min(page, pages))
     def _u(p): return url_for("journals.journals", page=p, per=per)
@@ -42,19 +79,37 @@ def _paginate(collection, query: dict, page: int, per: int):
 def journals():
     page = int(request.args.get("page", 1))
     per  = min(50, int(request.args.get("per", 20)))
+    after = parse_after(request.args.get("after"))
     query = {}
 
     pager = _paginate(journals_col, query, page, per)
-    cur = (journals_col.find(query)
-           .sort([("date", -1), ("_id", -1)])
-           .skip((pager["page"]-1)*per)
-           .limit(per))
+    if after:
+        # Keyset: seek past the last row of the previous page instead of $skip
+        match = {"$and": [query, keyset_after("date", after)]}
+        skip = 0
+    else:
+        # Arbitrary page jump (or first page) falls back to $skip
+        match = query
+        skip = (pager["page"]-1)*per
+    # Line totals are summed on the server, so the lines arrays never leave it
+    cur = journals_col.aggregate([
+        {"$match": match},
+        {"$sort": {"date": -1, "_id": -1}},
+        {"$skip": skip},
+        {"$limit": per},
+        {"$project": {
+            "date": 1, "ref": 1, "source": 1, "memo": 1, "status": 1,
+            "total_dr": _lines_total("debit"),
+            "total_cr": _lines_total("credit"),
+        }},
+    ])
 
     rows = []
+    last = None
     for j in cur:
-        lines = j.get("lines", [])
-        total_dr = sum(_to_float(l.get("debit", 0)) for l in lines)
-        total_cr = sum(_to_float(l.get("credit", 0)) for l in lines)
+        last = j
+        total_dr = j["total_dr"]
+        total_cr = j["total_cr"]
 
         d = j.get("date")
         if isinstance(d, dt.datetime) or isinstance(d, dt.date):
@@ -73,6 +128,10 @@ def journals():
             "status": (j.get("status") or "draft").lower(),
         })
 
+    next_after = after_token(last, "date") if last else None
+    if pager["next_url"] and next_after:
+        pager["next_url"] = url_for("journals.journals", page=pager["page"]+1, per=per, after=next_after)
+
     # values for modal defaults
     today = dt.date.today().isoformat()
     ref = f"JE-{dt.datetime.utcnow().strftime('%Y%m%d-%H%M%S')}"
@@ -112,7 +171,8 @@ def journal_create():
         cr  = _to_float(credits[i] if i < len(credits) else 0)
         if not acc and dr == 0 and cr == 0 and not dsc:
             continue
-        lines.append({"account": acc, "partner": prt, "desc": dsc, "debit": dr, "credit": cr})
+        # account_lc: trimmed + lower-cased shadow the ledger looks accounts up by
+        lines.append({"account": acc, "account_lc": acc.lower(), "partner": prt, "desc": dsc, "debit": dr, "credit": cr})
 
     if not date_str or not ref:
         flash("Date and Reference are required.", "warning")
@@ -131,12 +191,13 @@ def journal_create():
     total_dr = round(sum(l["debit"] for l in lines), 2)
     total_cr = round(sum(l["credit"] for l in lines), 2)
 
+    now = dt.datetime.utcnow()  # posted/created/updated share one timestamp
     if action == "post":
         if total_dr != total_cr or total_dr <= 0:
             flash("Entry must be balanced and totals greater than zero to post.", "danger")
             return redirect(url_for("journals.journals"))
         status = "posted"
-        posted_at = dt.datetime.utcnow()
+        posted_at = now
     else:
         status = "draft"
         posted_at = None
@@ -151,8 +212,8 @@ def journal_create():
         "lines": lines,
         "status": status,
         "posted_at": posted_at,
-        "created_at": dt.datetime.utcnow(),
-        "updated_at": dt.datetime.utcnow(),
+        "created_at": now,
+        "updated_at": now,
         "created_by": None,
     }
 
@@ -1,6 +1,6 @@
 # accounting_routes/ledger.py
 from __future__ import annotations
-from flask import Blueprint, render_template, request, url_for, Response
+from flask import Blueprint, render_template, request, url_for, Response, stream_with_context
 from datetime import datetime, date
 from typing import List, Dict, Any
 import io, csv, math
@@ -10,6 +10,17 @@ from db import db
 ledger_bp = Blueprint("ledger", __name__, template_folder="../templates")
 journals_col = db["journals"]
 
+def _ensure_indexes() -> None:
+    try:
+        # Equality on status, range on date, then the account the lines are matched on
+        journals_col.create_index([("status", 1), ("date", 1), ("lines.account_lc", 1)])
+        # ?status= other than posted/draft drops the status filter; account leads instead
+        journals_col.create_index([("lines.account_lc", 1), ("date", 1)])
+    except Exception:
+        pass
+
+_ensure_indexes()
+
 def _to_dt(d: str | None):
     if not d:
         return None
@@ -31,6 +42,54 @@ def _fmt_date(d: Any) -> str:
         return d.strftime("%b %d, %Y")
     return ""
 
+def _money(expr: Any) -> Dict[str, Any]:
+    """Server-side round(float(x or 0), 2)."""
+    return {"$round": [{"$convert": {"input": expr, "to": "double", "onError": 0.0, "onNull": 0.0}}, 2]}
+
+def _ledger_pipeline(q: Dict[str, Any], account: str, side: str) -> List[Dict[str, Any]]:
+    """Matching journal lines in (date, ref) order, each with its running balance."""
+    pipeline: List[Dict[str, Any]] = [{"$match": q}]
+    acc_match = None
+    if account:
+        # Same test as the old Python loop (trimmed, case-insensitive equality), as a plain
+        # equality on the normalised shadow field so the account indexes can bound it
+        acc_match = {"lines.account_lc": account.strip().lower()}
+        pipeline.append({"$match": acc_match})  # drop journals without the account before unwinding
+    pipeline.append({"$unwind": {"path": "$lines", "includeArrayIndex": "li"}})
+    if acc_match:
+        pipeline.append({"$match": acc_match})
+
+    signed = ["$debit", "$credit"] if side == "debit" else ["$credit", "$debit"]
+    order = {"date": 1, "ref": 1, "_id": 1, "li": 1}
+    pipeline += [
+        {"$project": {
+            "li": 1,
+            "date": 1,
+            "ref": {"$ifNull": ["$ref", ""]},
+            "desc": {"$ifNull": ["$lines.desc", ""]},
+            "debit": _money("$lines.debit"),
+            "credit": _money("$lines.credit"),
+        }},
+        {"$sort": order},
+        {"$setWindowFields": {
+            "sortBy": order,
+            "output": {"running": {"$sum": {"$subtract": signed},
+                                   "window": {"documents": ["unbounded", "current"]}}},
+        }},
+    ]
+    return pipeline
+
+def _row(d: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "date": d.get("date"),
+        "date_display": _fmt_date(d.get("date")),
+        "ref": d.get("ref", ""),
+        "desc": d.get("desc") or "",
+        "debit": d["debit"],
+        "credit": d["credit"],
+        "running": round(d["running"], 2),
+    }
+
 @ledger_bp.get("/ledger")
 def ledger():
     account = (request.args.get("account") or "").strip()
@@ -53,54 +112,61 @@ def ledger():
         if date_to:
             q["date"]["$lte"] = date_to.replace(hour=23, minute=59, second=59, microsecond=999999)
 
-    cur = journals_col.find(q).sort([("date", 1), ("_id", 1)])
-
-    rows: List[Dict[str, Any]] = []
-    for j in cur:
-        j_date = j.get("date")
-        ref    = j.get("ref", "")
-        for ln in j.get("lines", []):
-            acc_name = (ln.get("account") or "").strip()
-            if account and acc_name.lower() != account.lower():
-                continue
-            debit  = float(ln.get("debit") or 0) or 0.0
-            credit = float(ln.get("credit") or 0) or 0.0
-            rows.append({
-                "date": j_date,
-                "date_display": _fmt_date(j_date),
-                "ref": ref,
-                "desc": ln.get("desc") or "",
-                "debit": round(debit, 2),
-                "credit": round(credit, 2),
-            })
-
-    rows.sort(key=lambda r: (r["date"] or datetime.min, r["ref"]))
-
-    running = 0.0
-    for r in rows:
-        running += (r["debit"] - r["credit"]) if side == "debit" else (r["credit"] - r["debit"])
-        r["running"] = round(running, 2)
-
-    tot_deb = round(sum(r["debit"] for r in rows), 2)
-    tot_crd = round(sum(r["credit"] for r in rows), 2)
-
-    if export and rows:
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["Date", "Ref", "Description", "Debit", "Credit", "Running"])
-        for r in rows:
-            writer.writerow([r["date_display"], r["ref"], r["desc"],
-                             f'{r["debit"]:.2f}', f'{r["credit"]:.2f}', f'{r["running"]:.2f}'])
-        return Response(output.getvalue(),
+    pipeline = _ledger_pipeline(q, account, side)
+
+    if export:
+        # Streamed straight off the aggregation cursor; the server carries the running balance
+        def gen():
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(["Date", "Ref", "Description", "Debit", "Credit", "Running"])
+            yield output.getvalue()
+            # One writerows() call per cursor batch instead of a writerow() per line
+            batch: List[list] = []
+            for d in journals_col.aggregate(pipeline, allowDiskUse=True, batchSize=500):
+                r = _row(d)
+                batch.append([r["date_display"], r["ref"], r["desc"],
+                              f'{r["debit"]:.2f}', f'{r["credit"]:.2f}', f'{r["running"]:.2f}'])
+                if len(batch) >= 500:
+                    output.seek(0)
+                    output.truncate()
+                    writer.writerows(batch)
+                    batch.clear()
+                    yield output.getvalue()
+            if batch:
+                output.seek(0)
+                output.truncate()
+                writer.writerows(batch)
+                yield output.getvalue()
+
+        return Response(stream_with_context(gen()),
                         mimetype="text/csv",
                         headers={"Content-Disposition": 'attachment; filename="general_ledger.csv"'})
 
-    total = len(rows)
-    pages = max(1, math.ceil(total / per))
-    page  = max(1, min(page, pages))
+    # One round trip for the requested page and the totals over every matching line
     start = (page - 1) * per
-    end   = start + per
-    page_rows = rows[start:end]
+    res = next(journals_col.aggregate(pipeline + [{"$facet": {
+        "rows": [{"$skip": start}, {"$limit": per}],
+        "totals": [{"$group": {"_id": None,
+                               "debit": {"$sum": "$debit"},
+                               "credit": {"$sum": "$credit"},
+                               "count": {"$sum": 1}}}],
+    }}], allowDiskUse=True), {})
+    totals_doc = (res.get("totals") or [{}])[0]
+    page_docs = res.get("rows") or []
+
+    total = int(totals_doc.get("count", 0))
+    pages = max(1, math.ceil(total / per))
+    if page > pages:
+        # Past the end: clamp and fetch the last page instead
+        page = pages
+        start = (page - 1) * per
+        page_docs = list(journals_col.aggregate(pipeline + [{"$skip": start}, {"$limit": per}], allowDiskUse=True))
+    page_rows = [_row(d) for d in page_docs]
+
+    tot_deb = round(totals_doc.get("debit", 0.0), 2)
+    tot_crd = round(totals_doc.get("credit", 0.0), 2)
+    running_end = (tot_deb - tot_crd) if side == "debit" else (tot_crd - tot_deb)
 
     pager = {
         "total": total, "page": page, "pages": pages,
@@ -128,10 +194,10 @@ def ledger():
     return render_template(
         "accounting/ledger.html",
         rows=page_rows,
-        totals={"debit": tot_deb, "credit": tot_crd} if rows else None,
+        totals={"debit": tot_deb, "credit": tot_crd} if total else None,
         pager=pager,
         account_info=account_info,
-        running_end=(f"{rows[-1]['running']:.2f}" if rows else "0.00"),
+        running_end=f"{running_end:.2f}",
         export_url=export_url,
         today_iso=today_iso, ref=ref, base_currency=base_currency,
     )
@@ -7,14 +7,16 @@ from flask import (
 )
 from bson import ObjectId
 from datetime import datetime, timedelta
-from decimal import Decimal, InvalidOperation
+from pymongo import ReturnDocument
 from werkzeug.utils import secure_filename
 import traceback
 import requests
 
 from db import db, users_collection
+from accounting_routes.common import seed_counter
 
 payment_vouchers_col = db["payment_vouchers"]
+counters_col = db["counters"]
 images_col = db["images"]  # traceability logs (same pattern as your other module)
 
 # NOTE:
@@ -57,12 +59,20 @@ def _ensure_indexes() -> None:
 _ensure_indexes()
 
 
-def _to_decimal(val, default: str = "0") -> Decimal:
-    """Safely convert any value from the form to Decimal."""
+def _cents(v) -> int:
+    """Form value -> integer hundredths (0 for blanks / junk); money and percentages alike."""
     try:
-        return Decimal(str(val or default))
-    except (InvalidOperation, TypeError):
-        return Decimal(default)
+        return int(round(float(v or 0) * 100))
+    except Exception:
+        return 0
+
+
+def _pct_of_cents(cents: int, pct_hundredths: int) -> int:
+    """`pct` percent of `cents`, rounded half-even to the cent (as Decimal.quantize did)."""
+    q, r = divmod(cents * pct_hundredths, 10000)
+    if 2 * r > 10000 or (2 * r == 10000 and q % 2):
+        q += 1
+    return q
 
 def _load_current_user():
     username = session.get("username")
@@ -119,28 +129,41 @@ def _pv_prefix_for_now(now: datetime | None = None) -> str:
     return f"TTGH-{yy}-{mm}-"
 
 
+# Monthly counters already seeded from existing vouchers by this process
+_seeded_pv_counters: set = set()
+
+
+def _pv_counter(now: datetime) -> tuple:
+    """(counters _id, PV prefix) for the month of `now`; seeds the counter on first use."""
+    prefix = _pv_prefix_for_now(now)
+    key = f"pv_{prefix.rstrip('-')}"  # e.g. pv_TTGH-25-12
+    if key not in _seeded_pv_counters and seed_counter(key, payment_vouchers_col, "pv_number", prefix):
+        _seeded_pv_counters.add(key)
+    return key, prefix
+
+
 def _next_pv_number(now: datetime | None = None) -> str:
     """
-    Generate next PV number like:
+    Preview the next PV number like:
       TTGH-25-12-0001
     where 25=year, 12=month, 0001 increments within that month.
+    Read-only: the number is only taken by _allocate_pv_number().
     """
-    now = now or datetime.today()
-    prefix = _pv_prefix_for_now(now)
-
-    last = payment_vouchers_col.find_one(
-        {"pv_number": {"$regex": f"^{prefix}"}},
-        sort=[("pv_number", -1)]
+    key, prefix = _pv_counter(now or datetime.today())
+    doc = counters_col.find_one({"_id": key}) or {}
+    return f"{prefix}{int(doc.get('seq', 0)) + 1:04d}"
+
+
+def _allocate_pv_number(now: datetime | None = None) -> str:
+    """Atomically take the next PV number from the month's counters document."""
+    key, prefix = _pv_counter(now or datetime.today())
+    doc = counters_col.find_one_and_update(
+        {"_id": key},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
     )
-
-    last_seq = 0
-    if last and isinstance(last.get("pv_number"), str):
-        try:
-            last_seq = int(last["pv_number"].split("-")[-1])
-        except Exception:
-            last_seq = 0
-
-    return f"{prefix}{last_seq + 1:04d}"
+    return f"{prefix}{doc['seq']:04d}"
 
 
 @payment_voucher_bp.post("/upload_image")
@@ -248,11 +271,9 @@ def form_page():
 def create_voucher():
     """Handle submission of a new payment voucher."""
     form = request.form
+    today = datetime.today()
 
-    # Always compute server-side too (don’t trust hidden input)
-    pv_number = _next_pv_number()
-
-    date_str = form.get("date") or datetime.today().strftime("%Y-%m-%d")
+    date_str = form.get("date") or today.strftime("%Y-%m-%d")
     to_name = (form.get("to_name") or "").strip()
     pay_method = form.get("pay_method", "tfr")  # 'cash' or 'tfr'
     tfr_no = (form.get("tfr_no") or "").strip()
@@ -262,30 +283,31 @@ def create_voucher():
     desc_list = form.getlist("line_description[]")
     amt_list = form.getlist("line_amount[]")
 
+    # Money is summed in integer cents and converted to float only for storage
     line_items = []
-    subtotal = Decimal("0")
+    subtotal_c = 0
 
     for desc, amt in zip(desc_list, amt_list):
         desc = (desc or "").strip()
         if not desc and not amt:
             continue
-        amount = _to_decimal(amt)
-        if amount < 0:
+        amount_c = _cents(amt)
+        if amount_c < 0:
             continue
-        line_items.append({"description": desc, "amount": float(amount)})
-        subtotal += amount
+        line_items.append({"description": desc, "amount": amount_c / 100})
+        subtotal_c += amount_c
 
     if not line_items:
         flash("Please add at least one line item.", "danger")
         return redirect(url_for("payment_voucher.form_page"))
 
-    # Tax percentages
-    vat_pct = _to_decimal(form.get("vat_pct"), "0")
-    wht_pct = _to_decimal(form.get("wht_pct"), "0")
+    # Tax percentages, in hundredths of a percent (12.5% -> 1250)
+    vat_pct_h = _cents(form.get("vat_pct"))
+    wht_pct_h = _cents(form.get("wht_pct"))
 
-    vat_amount = (subtotal * vat_pct / Decimal("100")).quantize(Decimal("0.01"))
-    wht_amount = (subtotal * wht_pct / Decimal("100")).quantize(Decimal("0.01"))
-    total_payable = (subtotal + vat_amount - wht_amount).quantize(Decimal("0.01"))
+    vat_c = _pct_of_cents(subtotal_c, vat_pct_h)
+    wht_c = _pct_of_cents(subtotal_c, wht_pct_h)
+    total_c = subtotal_c + vat_c - wht_c
 
     amount_in_words = (form.get("amount_in_words") or "").strip()
 
@@ -309,7 +331,11 @@ def create_voucher():
     try:
         date_obj = datetime.fromisoformat(date_str)
     except Exception:
-        date_obj = datetime.today()
+        date_obj = today
+
+    # Always compute server-side too (don’t trust hidden input). Taken only once the
+    # form has validated, so a rejected submission doesn't burn a number.
+    pv_number = _allocate_pv_number(today)
 
     doc = {
         "pv_number": pv_number,
@@ -320,12 +346,14 @@ def create_voucher():
         "bank_name": bank_name,
 
         "line_items": line_items,
-        "subtotal": float(subtotal),
-        "vat_pct": float(vat_pct),
-        "vat_amount": float(vat_amount),
-        "wht_pct": float(wht_pct),
-        "wht_amount": float(wht_amount),
-        "total_payable": float(total_payable),
+        "subtotal": subtotal_c / 100,
+        "vat_pct": vat_pct_h / 100,
+        "vat_amount": vat_c / 100,
+        "wht_pct": wht_pct_h / 100,
+        "wht_amount": wht_c / 100,
+        "total_payable": total_c / 100,
+        "subtotal_cents": subtotal_c,
+        "total_payable_cents": total_c,
 
         "amount_in_words": amount_in_words,
 
@@ -359,8 +387,8 @@ def create_voucher():
             flash("Payment voucher created.", "success")
             return redirect(url_for("payment_voucher.view_voucher", voucher_id=str(res.inserted_id)))
         except Exception:
-            # likely duplicate pv_number under concurrency — regenerate & retry
-            doc["pv_number"] = _next_pv_number()
+            # number already on file (e.g. entered by hand) — take the next & retry
+            doc["pv_number"] = _allocate_pv_number(today)
             continue
 
     flash("Could not create voucher. Please try again.", "danger")
@@ -382,10 +410,11 @@ def view_voucher(voucher_id: str):
     user = _load_current_user()
     can_delete = _can_delete_voucher(user)
     created_dt = _created_dt(voucher)
+    now = datetime.utcnow()
     delete_blocked = True
     delete_block_msg = "Deletion window expired (must delete within 7 days of creation)."
     if created_dt:
-        delete_blocked = datetime.utcnow() > (created_dt + timedelta(days=7))
+        delete_blocked = now > (created_dt + timedelta(days=7))
     else:
         delete_blocked = True
         delete_block_msg = "Missing created date, cannot validate deletion window"
@@ -396,7 +425,7 @@ def view_voucher(voucher_id: str):
         can_delete=can_delete,
         delete_blocked=delete_blocked,
         delete_block_msg=delete_block_msg,
-        now=datetime.utcnow(),
+        now=now,
     )
 
 
@@ -478,7 +507,8 @@ def delete_voucher(voucher_id: str):
     created_dt = _created_dt(voucher)
     if not created_dt:
         return jsonify({"ok": False, "error": "Missing created date, cannot validate deletion window"}), 400
-    if datetime.utcnow() > (created_dt + timedelta(days=7)):
+    now = datetime.utcnow()
+    if now > (created_dt + timedelta(days=7)):
         return jsonify({"ok": False, "error": "Deletion window expired (must delete within 7 days of creation)"}), 400
 
     reason = ""
@@ -492,7 +522,7 @@ def delete_voucher(voucher_id: str):
     deleted_by_name = user.get("full_name") or user.get("name") or user.get("username") if user else ""
     update = {
         "is_deleted": True,
-        "deleted_at": datetime.utcnow(),
+        "deleted_at": now,
         "deleted_by_id": user.get("_id") if user else None,
         "deleted_by_name": deleted_by_name,
         "delete_reason": reason,
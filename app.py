@@ -1,4 +1,5 @@
 from flask import Flask, redirect, url_for, session, render_template
+from jinja2 import FileSystemBytecodeCache
 import os
 
 # === Auth/Login ===
@@ -84,6 +85,13 @@ app.secret_key = os.getenv(
     "4b1b26eee81fd7da3be8efd2649c3b07140b511118b11009f243adabd4d61559"
 )
 
+# === Templates ===
+# Compiled templates are reused without re-stat'ing their files on each render
+# (app.run(debug=True) switches reloading back on), and the compiled bytecode
+# is kept on disk so restarted gunicorn workers skip recompiling.
+app.jinja_env.auto_reload = app.debug
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+
 # === Root / Index ===
 @app.route("/")
 def index():
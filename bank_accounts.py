@@ -145,6 +145,7 @@ def add_bank_account():
         "account_number": data.get("account_number"),
         "branch": data.get("branch")
     }
+    new_account["account_last4"] = _last4(new_account["account_number"])
     accounts_col.insert_one(new_account)
     return jsonify({"success": True, "message": "Bank account added"})
 
@@ -158,6 +159,7 @@ def edit_bank_account(id):
         "account_number": data.get("account_number"),
         "branch": data.get("branch")
     }
+    update["account_last4"] = _last4(update["account_number"])
     accounts_col.update_one({"_id": ObjectId(id)}, {"$set": update})
     return jsonify({"success": True, "message": "Bank account updated"})
 